@@ -0,0 +1 @@
+# Benchmarks for the hot paths. Run a module with e.g. `python -m bench.ingest`.
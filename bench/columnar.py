@@ -0,0 +1,62 @@
+import os
+import pickle
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from protocol import columnar
+from server.database import Database
+
+
+def _measure(function):
+    """Runs function, returns its result and peak traced memory in MB
+
+    :rtype: tuple"""
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, peak
+
+
+def _rows_path(db):
+    """get-data: dict of lists of tuples, pickled, then split into temp and rain lists like the web app did"""
+    data = pickle.loads(pickle.dumps(db.read()))
+    return {s: ([t for t, _ in rows], [r for _, r in rows]) for s, rows in data.items()}
+
+
+def _columns_path(db):
+    """get-columns: column arrays sent as raw buffers"""
+    data = columnar.decode(columnar.encode(db.read_columns()))
+    return {s: (c['temperature'], c['precipitation']) for s, c in data.items()}
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'), batch_size=65536)
+        db.write_many((i % 100, 10.0 + i % 7 / 10, 0.5) for i in range(rows))
+        db.flush()
+
+        print(f"get-data    payload {len(pickle.dumps(db.read())) / 2 ** 20:>7.1f} MB")
+        print(f"get-columns payload {len(columnar.encode(db.read_columns())) / 2 ** 20:>7.1f} MB")
+        for label, path in (('get-data', _rows_path), ('get-columns', _columns_path)):
+            start = perf_counter()
+            path(db)
+            elapsed = perf_counter() - start
+            _, peak = _measure(lambda: path(db))  # Separate run, tracing slows everything down
+            print(f"{label:<11} read, encode, decode: {elapsed:>6.2f} s, peak {peak:>7.1f} MB")
+
+        # Without the SQLite fetch, which costs the same for both
+        rows, columns = db.read(), db.read_columns()
+        for label, function in (('get-data', lambda: pickle.loads(pickle.dumps(rows))),
+                                ('get-columns', lambda: columnar.decode(columnar.encode(columns)))):
+            start = perf_counter()
+            function()
+            print(f"{label:<11} encode, decode only: {perf_counter() - start:>6.3f} s")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep
+
+import numpy as np
+
+from server.database import Database
+
+
+def run(readers, rows=200000, scanners=2, writes=500, interval=0.002):
+    """Measures write latency while other threads keep reading the whole table
+
+    :param int readers: Database read connections, 0 for the shared connection
+    :param int rows: Rows in the table before the test
+    :param int scanners: Threads doing full-range reads
+    :param int writes: Writes to time
+    :param float interval: Seconds between writes
+    :return: p50 and p99 write latency in ms, and full reads done
+    :rtype: tuple"""
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'bench.db')
+        db = Database(name, batch_size=65536)  # Load quickly
+        db.write_many((i % 100, 10.0, 0.5) for i in range(rows))
+        db.close()
+
+        db = Database(name, batch_size=1, readers=readers)  # Commit every write, like the unbatched ingest path
+
+        done = threading.Event()
+        scans = [0]
+
+        def scan():
+            while not done.is_set():
+                db.read_columns()
+                scans[0] += 1
+
+        threads = [threading.Thread(target=scan) for _ in range(scanners)]
+        for t in threads:
+            t.start()
+
+        latency = []
+        for i in range(writes):
+            start = perf_counter()
+            db.write(i % 100, 11.0, 0.0)
+            latency.append(perf_counter() - start)
+            sleep(interval)
+
+        done.set()
+        for t in threads:
+            t.join()
+        db.close()
+
+    p50, p99 = np.percentile(latency, [50, 99]) * 1000
+    return p50, p99, scans[0]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for readers in (0, 4):
+        p50, p99, scans = run(readers, rows)
+        label = 'shared connection' if readers == 0 else f'{readers} read connections'
+        print(f"{label:<20} write p50 {p50:>8.2f} ms, p99 {p99:>8.2f} ms, {scans} full reads")
+
+
+if __name__ == '__main__':
+    main()
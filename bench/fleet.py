@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep
+
+from protocol import telemetry
+from server import Server
+from station import FleetSimulator
+
+STATIONS = [1000, 10000, 100000]
+
+
+def step(stations, steps=20):
+    """Times one vectorized step and the encoding of its datagrams, without sending
+
+    :param int stations: Stations in the fleet
+    :param int steps: Steps to average over
+    :return: Milliseconds per step
+    :rtype: float"""
+    fleet = FleetSimulator(('localhost', 0), stations, seed=0)
+    start = perf_counter()
+    for _ in range(steps):
+        fleet._simulate()
+        records = fleet._records
+        records['temperature'] = fleet.temperature
+        records['rain'] = fleet.rain
+        for offset in range(0, stations, telemetry.MAX_RECORDS):
+            telemetry.encode(records[offset:offset + telemetry.MAX_RECORDS])
+    fleet.stop()
+    return (perf_counter() - start) / steps * 1000
+
+
+def run(stations, seconds=5, interval=1):
+    """Sends the fleet's readings to a fresh server
+
+    :param int stations: Stations in the fleet
+    :param float seconds: Seconds to send for
+    :param float interval: Seconds between readings of a station
+    :return: Threads while running, readings sent and stored
+    :rtype: tuple"""
+    with tempfile.TemporaryDirectory() as directory:
+        srv = Server(('localhost', 0), os.path.join(directory, 'bench.db'), batch_size=4096, flush_interval=0.1)
+        srv.start()
+        fleet = FleetSimulator(srv.address, stations, interval, seed=0)
+        fleet.start()
+        sleep(seconds)
+        threads = threading.active_count()
+        fleet.stop()
+
+        stored, last_change = 0, perf_counter()  # Wait until the server stops storing new rows
+        while stored < fleet.readings and perf_counter() - last_change < 1:
+            sleep(0.05)
+            count = srv.get_index()
+            if count != stored:
+                stored, last_change = count, perf_counter()
+        srv.stop()
+    return threads, fleet.readings, stored
+
+
+def main():
+    stations = [int(n) for n in sys.argv[1:]] or STATIONS
+    for n in stations:
+        ms = step(n)
+        threads, sent, stored = run(n)
+        print(f"{n:>7} stations: step {ms:>7.2f} ms, {threads} threads, {sent:>8,} sent, {stored:>8,} stored "
+              f"({1 - stored / sent:.1%} lost)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import tempfile
+import threading
+from socket import socket, socketpair, AF_INET, SOCK_STREAM
+from time import perf_counter, sleep
+
+from protocol.framing import FrameClient, FrameReader, send_frame
+from server import Server
+
+SIZES = [1, 4, 16, 64]  # MB
+
+
+def _sentinel_receive(sock):
+    """The old receive loop: 4 KB reads, re-concatenated until the data ends in 'EOF'
+
+    :param socket sock: Socket to read from
+    :rtype: bytes"""
+    data = sock.recv(4096)
+    while data[-3:] != b'EOF':
+        data += sock.recv(4096)
+    return data[:-3]
+
+
+def transfer(size, framed):
+    """Times one response of size bytes over a socket pair
+
+    :param int size: Payload size in bytes
+    :param bool framed: Use length-prefixed frames instead of the 'EOF' sentinel
+    :return: Throughput in MB/s
+    :rtype: float"""
+    payload = b'x' * size
+    a, b = socketpair()
+    if framed:
+        sender = threading.Thread(target=send_frame, args=(a, payload))
+    else:
+        sender = threading.Thread(target=a.sendall, args=(payload + b'EOF',))
+
+    start = perf_counter()
+    sender.start()
+    data = FrameReader(b).read()[1] if framed else _sentinel_receive(b)
+    elapsed = perf_counter() - start
+    sender.join()
+    assert len(data) == size
+    a.close()
+    b.close()
+    return size / elapsed / 2 ** 20
+
+
+def get_data(rows=200000, pipelined=8):
+    """Times framed 'get-data' responses from a running server
+
+    :param int rows: Rows in the database
+    :param int pipelined: Requests in flight at once
+    :return: Response size in MB, MB/s for sequential and pipelined requests
+    :rtype: tuple"""
+    with tempfile.TemporaryDirectory() as directory:
+        srv = Server(('localhost', 0), os.path.join(directory, 'bench.db'))
+        srv._database.write_many((i % 50, 10.0 + i % 7, 0.5) for i in range(rows))
+        srv.start()
+
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.connect(srv.address)
+        sock.send(b'gib')
+        client = FrameClient(sock)
+        size = len(client.request(b'get-data'))
+
+        start = perf_counter()
+        for _ in range(pipelined):
+            client.request(b'get-data')
+        sequential = perf_counter() - start
+
+        start = perf_counter()
+        for request_id in [client.send(b'get-data') for _ in range(pipelined)]:
+            client.receive(request_id)
+        overlapped = perf_counter() - start
+
+        client.send(b'exit')
+        sleep(0.1)
+        sock.close()
+        srv.stop()
+
+    mb = size * pipelined / 2 ** 20
+    return size / 2 ** 20, mb / sequential, mb / overlapped
+
+
+def main():
+    for mb in SIZES:
+        size = mb * 2 ** 20
+        old = transfer(size, False) if mb <= 4 else float('nan')  # Sentinel loop is quadratic, too slow past this
+        print(f"{mb:>3} MB response: sentinel {old:>8,.0f} MB/s, framed {transfer(size, True):>8,.0f} MB/s")
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    size, sequential, pipelined = get_data(rows)
+    print(f"get-data ({size:.1f} MB): sequential {sequential:,.0f} MB/s, pipelined {pipelined:,.0f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+from time import perf_counter, time
+
+import numpy as np
+
+from server.database import Database
+
+STATIONS = 200
+INTERVAL = 2  # Seconds between readings of a station
+HOURS = 2  # Hours of readings stored
+CAPACITY = 1024  # Readings per station in the hot tier, about 34 minutes at INTERVAL
+ROUNDS = 20  # Reads timed per window
+
+
+def _load(db, now):
+    """Writes HOURS of readings of every station, ending at now
+
+    :rtype: None"""
+    steps = HOURS * 3600 // INTERVAL
+    for start in range(0, steps, 512):
+        db.write_many((i % STATIONS, 10.0, 0.5, now - (steps - step) * INTERVAL)
+                      for step in range(start, min(start + 512, steps)) for i in range(STATIONS))
+        db.flush()
+
+
+def _latency(read):
+    """Times a read
+
+    :return: Median and 95th percentile in milliseconds
+    :rtype: tuple"""
+    times = []
+    for _ in range(ROUNDS):
+        start = perf_counter()
+        read()
+        times.append((perf_counter() - start) * 1000)
+    return np.percentile(times, 50), np.percentile(times, 95)
+
+
+def run(hot, minutes=(1, 5, 15, 60)):
+    """Reads the last minutes of readings of every station, and of one station
+
+    :param bool hot: Keep a hot tier of CAPACITY readings per station
+    :param tuple minutes: Windows to read
+    :return: minutes -> (all stations p50, p95, one station p50, p95) in milliseconds
+    :rtype: dict"""
+    with tempfile.TemporaryDirectory() as directory:
+        now = time()
+        db = Database(os.path.join(directory, 'bench.db'), batch_size=65536, hot_capacity=CAPACITY if hot else 0,
+                      hot_stations=STATIONS)
+        _load(db, now)
+        results = {}
+        for window in minutes:
+            ts_from = now - window * 60
+            results[window] = _latency(lambda: db.read_range(ts_from)) + \
+                _latency(lambda: db.read_range(ts_from, None, 0))
+        db.close()
+    return results
+
+
+def main():
+    minutes = tuple(int(x) for x in sys.argv[1:]) or (1, 5, 15, 60)
+    print(f"{STATIONS} stations, a reading every {INTERVAL} s for {HOURS} h, hot tier of {CAPACITY} readings "
+          f"({CAPACITY * INTERVAL / 60:.0f} min) per station")
+    for hot in (False, True):
+        for window, (p50, p95, one50, one95) in run(hot, minutes).items():
+            print(f"{'hot tier' if hot else 'sqlite  '} last {window:>3} min: all stations p50 {p50:>8.2f} ms, "
+                  f"p95 {p95:>8.2f} ms; one station p50 {one50:>7.3f} ms, p95 {one95:>7.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+from server.database import Database
+
+# (label, batch_size, synchronous)
+CONFIGS = [
+    ('unbatched, FULL', 1, 'FULL'),
+    ('batch 64, NORMAL', 64, 'NORMAL'),
+    ('batch 256, NORMAL', 256, 'NORMAL'),
+    ('batch 1024, OFF', 1024, 'OFF'),
+]
+
+
+def run(batch_size, synchronous, rows=20000, threads=8):
+    """Writes rows to a fresh database from several threads, the way receivers do
+
+    :param int batch_size: Database batch size
+    :param str synchronous: SQLite synchronous level
+    :param int rows: Total rows to write
+    :param int threads: Amount of writer threads
+    :return: Rows written per second
+    :rtype: float"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'), batch_size=batch_size, synchronous=synchronous)
+
+        def writer(station_id):
+            for i in range(rows // threads):
+                db.write(station_id, 10.0 + i % 7, 0.5)
+
+        workers = [threading.Thread(target=writer, args=(i,)) for i in range(threads)]
+        start = perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        db.flush()
+        elapsed = perf_counter() - start
+
+        assert db.get_count() == rows // threads * threads
+        db.close()
+
+    return rows // threads * threads / elapsed
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for label, batch_size, synchronous in CONFIGS:
+        print(f"{label:<20} {run(batch_size, synchronous, rows):>12,.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
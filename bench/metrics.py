@@ -0,0 +1,128 @@
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from protocol import telemetry
+from server import metrics
+from server.database import Database
+from server.receiver import Decoder
+
+ROUNDS = 9  # Alternating runs with and without metrics, the medians are compared
+
+
+def _datagrams(readings, per_datagram):
+    """Encodes readings the way stations send them
+
+    :param int readings: Readings in total
+    :param int per_datagram: Readings per datagram, 1 like Station, up to telemetry.MAX_RECORDS like FleetSimulator
+    :rtype: list"""
+    records = np.zeros(readings, telemetry.RECORD)
+    records['station_id'] = np.arange(readings) % 1000
+    records['timestamp'] = 1600000000 + np.arange(readings)
+    records['temperature'] = 10.0
+    return [telemetry.encode(records[i:i + per_datagram]) for i in range(0, readings, per_datagram)]
+
+
+def ingest(datagrams):
+    """Feeds datagrams through the receivers' decoder into a fresh database, without the network
+
+    :param list datagrams: Encoded datagrams
+    :return: Readings stored per second
+    :rtype: float"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'), batch_size=4096, flush_interval=None)
+        decoder = Decoder()
+        start = perf_counter()
+        for data in datagrams:
+            records, _ = decoder.decode(data)
+            if records is not None and len(records):
+                db.write_records(records)
+        db.flush()
+        elapsed = perf_counter() - start
+        stored = db.get_count()
+        db.close()
+    return stored / elapsed
+
+
+def _patched(inc, observe):
+    """Replaces Counter.inc and Histogram.observe
+
+    :param inc: Replacement of Counter.inc
+    :param observe: Replacement of Histogram.observe
+    :return: The methods to put back
+    :rtype: tuple"""
+    saved = metrics.Counter.inc, metrics.Histogram.observe
+    metrics.Counter.inc, metrics.Histogram.observe = inc, observe
+    return saved
+
+
+def updates(datagrams):
+    """Counts the metric updates made while ingesting
+
+    :param list datagrams: Encoded datagrams
+    :return: Calls to inc and to observe
+    :rtype: tuple"""
+    made = [0, 0]
+
+    def inc(self, amount=1):
+        made[0] += 1
+
+    def observe(self, value):
+        made[1] += 1
+
+    saved = _patched(inc, observe)
+    try:
+        ingest(datagrams)
+    finally:
+        _patched(*saved)
+    return tuple(made)
+
+
+def cost(calls=1000000):
+    """Times a counter increment and a histogram observation
+
+    :param int calls: Calls to average over
+    :return: Nanoseconds per inc and per observe
+    :rtype: tuple"""
+    counter, histogram = metrics.Counter(), metrics.Histogram()
+    start = perf_counter()
+    for _ in range(calls):
+        counter.inc()
+    inc = perf_counter() - start
+    start = perf_counter()
+    for _ in range(calls):
+        histogram.observe(0.003)
+    observe = perf_counter() - start
+    return inc / calls * 1e9, observe / calls * 1e9
+
+
+def main():
+    readings = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    inc, observe = cost()
+    print(f"Counter.inc {inc:.0f} ns, Histogram.observe {observe:.0f} ns")
+
+    for per_datagram in (1, telemetry.MAX_RECORDS):
+        datagrams = _datagrams(readings, per_datagram)
+        with_metrics, without = [], []
+        for _ in range(ROUNDS):
+            with_metrics.append(ingest(datagrams))
+            saved = _patched(lambda self, amount=1: None, lambda self, value: None)  # Like a build without metrics
+            try:
+                without.append(ingest(datagrams))
+            finally:
+                _patched(*saved)
+        on, off = np.median(with_metrics), np.median(without)
+
+        # Run to run noise on a busy machine is larger than the difference, so also estimate it from the updates made
+        incs, observations = updates(datagrams)
+        estimate = (incs * inc + observations * observe) / 1e9 / (readings / on)
+        print(f"{per_datagram:>2} readings/datagram: {off:>9,.0f} readings/s without metrics, {on:>9,.0f} with "
+              f"({1 - on / off:+.1%} measured), {incs:,} inc and {observations:,} observe calls "
+              f"({estimate:.2%} estimated)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+from time import perf_counter, time
+
+from server.database import Database
+
+STATIONS = 100
+START = 1600000000  # Unix time of the first reading
+DAY = 86400
+
+
+def _load(db, days, rows_per_day, partitioned):
+    """Writes readings spread evenly over days, sealing a partition after each day
+
+    :rtype: None"""
+    step = DAY / rows_per_day
+    for day in range(days):
+        db.write_many((i % STATIONS, 10.0, 0.5, START + day * DAY + i * step) for i in range(rows_per_day))
+        db.flush()
+        if partitioned:
+            db.maintain(time() + DAY)  # Everything written so far arrived in a finished period
+
+
+def run(partitioned, days=7, rows_per_day=200000):
+    """Drops the oldest day of readings, and reads one day of one station
+
+    :param bool partitioned: Partition by day, else keep every reading in station_data
+    :param int days: Days of readings
+    :param int rows_per_day: Readings per day
+    :return: Seconds to drop a day, and seconds to read a day of one station
+    :rtype: tuple"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'), batch_size=65536,
+                      partition_seconds=DAY if partitioned else None, coarse_resolution=None)
+        _load(db, days, rows_per_day, partitioned)
+
+        start = perf_counter()
+        db.read_range(START + DAY, START + 2 * DAY - 1, 0)
+        read = perf_counter() - start
+
+        start = perf_counter()
+        if partitioned:
+            db._retention = (days - 1) * DAY
+            db.maintain(START + days * DAY)
+        else:  # The way to reclaim space before, one DELETE holding the write lock
+            with db._lock:
+                db._cursor.execute("DELETE FROM station_data WHERE measured_ts < ?;", (START + DAY,))
+                db._conn.commit()
+        drop = perf_counter() - start
+        db.close()
+    return drop, read
+
+
+def main():
+    rows_per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for partitioned in (False, True):
+        drop, read = run(partitioned, rows_per_day=rows_per_day)
+        label = 'daily partitions' if partitioned else 'one table'
+        print(f"{label:<18} drop oldest day {drop * 1000:>9.1f} ms, read a day of one station {read * 1000:>7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
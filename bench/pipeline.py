@@ -0,0 +1,238 @@
+"""End-to-end load test: simulated stations, console clients and dashboards against one server.
+
+    python -m bench.pipeline --stations 1000 --clients 4 --web 1 --duration 10 --out report.json
+    python -m bench.pipeline --baseline report.json
+
+A report is written as JSON with --out. Given --baseline, every metric is compared with the same
+metric of a saved report and the run fails (exit code 1) when one got worse by more than --tolerance."""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from socket import socket, AF_INET, SOCK_STREAM
+from time import perf_counter, sleep
+
+import numpy as np
+from werkzeug.serving import make_server
+
+import flask_implementation.app as web
+from bench.server_load import rss
+from protocol.framing import FrameClient
+from server import Server
+from station import FleetSimulator
+
+CONFIGURATION = ('stations', 'clients', 'dashboards', 'duration', 'interval')  # Should match the baseline's
+WINDOW = 1000  # Rows a console client asks for with get-data, the latest ones
+
+# Metric: True if higher is better. Only these are compared with the baseline.
+METRICS = {
+    'rows_per_s': True,
+    'loss': False,
+    'get_data_p50_ms': False, 'get_data_p95_ms': False, 'get_data_p99_ms': False,
+    'status_p50_ms': False, 'status_p95_ms': False, 'status_p99_ms': False,
+    'web_p50_ms': False, 'web_p95_ms': False,
+    'cpu_percent': False,
+    'rss_mb': False,
+}
+# Absolute differences ignored, so small values don't fail on noise. Latencies get 1 ms.
+SLACK = {'loss': 0.01, 'cpu_percent': 5.0, 'rss_mb': 5.0}
+
+
+def _percentiles(latency, name, result, ranks=(50, 95, 99)):
+    """Adds latency percentiles in milliseconds to the result
+
+    :param list latency: Seconds per request
+    :param str name: Prefix of the metric names
+    :param dict result: Report to add to
+    :param tuple ranks: Percentiles to add
+    :rtype: None"""
+    result[f'{name}_requests'] = len(latency)
+    for rank, value in zip(ranks, np.percentile(latency, ranks) if latency else [float('nan')] * len(ranks)):
+        result[f'{name}_p{rank}_ms'] = round(float(value) * 1000, 2)
+
+
+def _console(address, deadline, latency, failed):
+    """One console client alternating get-data for the latest rows and status, like fmi does
+
+    :param tuple address: Server address
+    :param float deadline: perf_counter value to stop at
+    :param dict latency: Lists of seconds per command to append to
+    :param list failed: Counter of failed requests
+    :rtype: None"""
+    with socket(AF_INET, SOCK_STREAM) as sock:
+        sock.connect(address)
+        sock.send(b'gib')
+        client = FrameClient(sock)
+        while perf_counter() < deadline:
+            index = int(client.request(b'get-index'))
+            for command, request in (('get_data', f'get-data {max(index - WINDOW, 0)} {index}'.encode()),
+                                     ('status', b'status')):
+                start = perf_counter()
+                if client.request(request) == b'error':
+                    failed[0] += 1
+                    continue
+                latency[command].append(perf_counter() - start)
+        client.send(b'exit')
+
+
+def _dashboard(url, deadline, latency, failed):
+    """One browser polling a chart
+
+    :param str url: Update route of a chart
+    :param float deadline: perf_counter value to stop at
+    :param list latency: Seconds per request to append to
+    :param list failed: Counter of failed requests
+    :rtype: None"""
+    while perf_counter() < deadline:
+        start = perf_counter()
+        try:
+            urllib.request.urlopen(url).read()
+        except urllib.error.HTTPError:
+            failed[0] += 1
+            continue
+        latency.append(perf_counter() - start)
+
+
+def run(stations=1000, clients=4, dashboards=1, duration=10.0, interval=1, points=600):
+    """Runs the whole pipeline on a fresh database and measures it
+
+    :param int stations: Simulated stations sending readings
+    :param int clients: Console clients sending get-data and status
+    :param int dashboards: Web clients polling the charts through the Flask app
+    :param float duration: Seconds to run
+    :param float interval: Seconds between readings of a station
+    :param int points: Points per station each chart asks for
+    :return: Report
+    :rtype: dict"""
+    result = {'stations': stations, 'clients': clients, 'dashboards': dashboards, 'duration': duration,
+              'interval': interval, 'python': platform.python_version(), 'cpus': os.cpu_count()}
+    with tempfile.TemporaryDirectory() as directory:
+        memory = rss()
+        srv = Server(('localhost', 0), os.path.join(directory, 'bench.db'), batch_size=4096, flush_interval=0.1)
+        srv.start()
+
+        http = None
+        if dashboards:
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)  # No line per request
+            web.connect(srv.address)
+            http = make_server('localhost', 0, web.app, threaded=True)
+            threading.Thread(target=http.serve_forever, daemon=True).start()
+
+        times, start = os.times(), perf_counter()
+        fleet = FleetSimulator(srv.address, stations, interval, seed=0)
+        fleet.start()
+        sleep(interval)  # Let the first readings in, so there is something to query
+
+        latency = {'get_data': [], 'status': []}
+        web_latency = []
+        failed = [0]
+        deadline = perf_counter() + duration
+        threads = [threading.Thread(target=_console, args=(srv.address, deadline, latency, failed))
+                   for _ in range(clients)]
+        threads += [threading.Thread(target=_dashboard, args=(
+            f'http://localhost:{http.server_port}/display_{("temp", "rain")[n % 2]}/update?points={points}',
+            deadline, web_latency, failed)) for n in range(dashboards)]
+
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        fleet.stop()
+
+        stored, last_change = 0, perf_counter()  # Wait until the server stops storing new rows
+        while stored < fleet.readings and perf_counter() - last_change < 1:
+            sleep(0.05)
+            count = srv.get_index()
+            if count != stored:
+                stored, last_change = count, perf_counter()
+        elapsed = last_change - start
+        cpu = sum(os.times()[:2]) - sum(times[:2])
+
+        result.update(threads=threading.active_count(), rss_mb=round(rss() - memory, 1),
+                      max_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1))
+
+        if http is not None:
+            http.shutdown()
+            web.pool.close()
+        srv.stop()
+
+    result.update(readings=fleet.readings, datagrams=fleet.datagrams, stored=stored,
+                  rows_per_s=round(stored / elapsed),
+                  cpu_percent=round(cpu / elapsed * 100, 1), failed=failed[0])
+    result['loss'] = round(1 - stored / result['readings'], 4) if result['readings'] else 0.0
+    _percentiles(latency['get_data'], 'get_data', result)
+    _percentiles(latency['status'], 'status', result)
+    _percentiles(web_latency, 'web', result, (50, 95))
+    return result
+
+
+def compare(report, baseline, tolerance=0.5):
+    """Compares a report with a saved one
+
+    :param dict report: Report of this run
+    :param dict baseline: Report to compare with
+    :param float tolerance: Relative change allowed before a metric counts as a regression
+    :return: (metric, baseline value, value, relative change, regressed) for every metric in both reports
+    :rtype: list"""
+    rows = []
+    for metric, higher_is_better in METRICS.items():
+        old, new = baseline.get(metric), report.get(metric)
+        if old is None or new is None or old != old or new != new:  # Missing or NaN
+            continue
+        change = (new - old) / abs(old) if old else 0.0 if new == old else float('inf')
+        worse = -change if higher_is_better else change
+        regressed = worse > tolerance and abs(new - old) > SLACK.get(metric, 1.0 if metric.endswith('_ms') else 0)
+        rows.append((metric, old, new, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stations', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=4, help='console clients')
+    parser.add_argument('--web', type=int, default=1, help='dashboard clients')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--interval', type=float, default=1)
+    parser.add_argument('--out', help='write the report to this JSON file')
+    parser.add_argument('--baseline', help='compare with this saved report')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    report = run(args.stations, args.clients, args.web, args.duration, args.interval)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        report['baseline'] = args.baseline
+        report['regressions'] = [metric for metric, *_, regressed in compare(report, baseline, args.tolerance)
+                                 if regressed]
+
+    print(f"{report['stations']} stations, {report['clients']} clients, {report['dashboards']} dashboards, "
+          f"{report['duration']:.0f} s: {report['rows_per_s']:,} rows/s, {report['loss']:.1%} lost, "
+          f"{report['cpu_percent']}% CPU, {report['rss_mb']} MB RSS ({report['max_rss_mb']} MB peak), "
+          f"{report['failed']} failed requests")
+    for name in ('get_data', 'status', 'web'):
+        if report[f'{name}_requests']:
+            print(f"  {name:<9} {report[f'{name}_requests']:>6} requests, p50 {report[f'{name}_p50_ms']:>8.2f} ms, "
+                  f"p95 {report[f'{name}_p95_ms']:>8.2f} ms")
+    if args.baseline:
+        differs = [key for key in CONFIGURATION if report[key] != baseline.get(key)]
+        if differs:
+            print(f"  baseline ran with different {', '.join(differs)}, the comparison is not like for like")
+        for metric, old, new, change, regressed in compare(report, baseline, args.tolerance):
+            print(f"  {metric:<16} {old:>10} -> {new:>10} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(report, file, indent=2)
+    sys.exit(1 if report.get('regressions') else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import hashlib
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from server.database import Database
+from station import Replay
+
+
+def main():
+    stations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    replay = Replay(stations, days * 24, seed=0)
+
+    digest = hashlib.sha1()
+    start = perf_counter()
+    for records in replay.records():
+        digest.update(records.tobytes())
+    seconds = perf_counter() - start
+    print(f"{stations} stations x {days} days: {len(replay):,} readings, sha1 {digest.hexdigest()[:12]} "
+          f"(the same on every run)")
+    print(f"{'generate':<10} {len(replay) / seconds:>12,.0f} readings/s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, 'bench.db'), batch_size=65536)
+        start = perf_counter()
+        rows = replay.load(db)
+        seconds = perf_counter() - start
+        db.close()
+    print(f"{'bulk load':<10} {rows / seconds:>12,.0f} readings/s into Database")
+
+
+if __name__ == '__main__':
+    main()
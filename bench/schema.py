@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from server.database import Database
+
+STATIONS = 100
+START = 1600000000  # Unix time of the first reading
+WINDOW = 3600  # Seconds per range query
+QUERIES = 20
+
+
+def _rows(rows, timestamps):
+    """Readings of STATIONS stations reporting once a second, in arrival order
+
+    :param int rows: Readings
+    :param bool timestamps: Add measured and ingest time
+    :rtype: iterator"""
+    n = np.arange(rows)
+    station = (n % STATIONS).tolist()
+    temp = (10 + 5 * np.sin(n / 1e4)).round(2).tolist()
+    rain = (n % 13 / 10).tolist()
+    if not timestamps:
+        return zip(temp, rain, station)
+    ts = (START + n // STATIONS).astype(np.float64).tolist()
+    return zip(temp, rain, station, ts, ts)
+
+
+def _load(conn, query, rows):
+    """Inserts rows in batches of one transaction each
+
+    :rtype: None"""
+    for chunk in iter(lambda: [r for _, r in zip(range(1000000), rows)], []):
+        conn.executemany(query, chunk)
+        conn.commit()
+
+
+def _median_ms(conn, query, params):
+    """Runs query once per parameter set
+
+    :return: Median milliseconds and rows of the last run
+    :rtype: tuple"""
+    times = []
+    for p in params:
+        start = perf_counter()
+        result = conn.execute(query, p).fetchall()
+        times.append(perf_counter() - start)
+    return np.median(times) * 1000, len(result)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    span = rows // STATIONS  # Seconds of readings
+    rng = np.random.default_rng(0)
+    picks = [(int(s), int(t)) for s, t in zip(rng.integers(0, STATIONS, QUERIES),
+                                               rng.integers(0, max(1, span - WINDOW), QUERIES))]
+
+    with tempfile.TemporaryDirectory() as directory:
+        old, new = os.path.join(directory, 'old.db'), os.path.join(directory, 'new.db')
+
+        # Before, the table as it was: no timestamps, no index but data_index
+        conn = sqlite3.connect(old)
+        conn.execute("CREATE TABLE station_data (data_index INTEGER PRIMARY KEY AUTOINCREMENT, temperature FLOAT "
+                     "NOT NULL,precipitation FLOAT NOT NULL,station_id INTEGER DEFAULT 0);")
+        _load(conn, "INSERT INTO station_data (temperature, precipitation, station_id) VALUES (?, ?, ?);",
+              _rows(rows, False))
+        print(f"{rows} rows, {STATIONS} stations, median of {QUERIES} queries")
+
+        # Without timestamps, an hour of one station is its rows in the index range of that hour
+        ms, n = _median_ms(conn, "SELECT data_index, temperature, precipitation FROM station_data "
+                                 "WHERE station_id = ? AND data_index BETWEEN ? AND ?;",
+                           [(s, t * STATIONS + 1, (t + WINDOW) * STATIONS) for s, t in picks])
+        print(f"{'before, station hour':<28} {ms:>10.2f} ms ({n} rows)")
+        ms, n = _median_ms(conn, "SELECT data_index, temperature, precipitation FROM station_data "
+                                 "WHERE station_id = ?;", [(s,) for s, _ in picks[:3]])
+        print(f"{'before, station history':<28} {ms:>10.2f} ms ({n} rows)")
+        conn.close()
+
+        # After, loaded into the current schema
+        Database(new, readers=0).close()
+        conn = sqlite3.connect(new)
+        _load(conn, "INSERT INTO station_data (temperature, precipitation, station_id, measured_ts, ingest_ts) "
+                    "VALUES (?, ?, ?, ?, ?);", _rows(rows, True))
+        conn.close()
+        db = Database(new)
+        db.rebuild_rollups()
+
+        ms, n = _median_ms(db._conn, "SELECT data_index, temperature, precipitation, measured_ts FROM station_data "
+                                     "WHERE station_id = ? AND measured_ts BETWEEN ? AND ?;",
+                           [(s, START + t, START + t + WINDOW - 1) for s, t in picks])
+        print(f"{'after, station hour':<28} {ms:>10.2f} ms ({n} rows)")
+        ms, n = _median_ms(db._conn, "SELECT data_index, temperature, precipitation, measured_ts FROM station_data "
+                                     "WHERE station_id = ?;", [(s,) for s, _ in picks[:3]])
+        print(f"{'after, station history':<28} {ms:>10.2f} ms ({n} rows)")
+
+        times = []
+        for s, t in picks:
+            start = perf_counter()
+            db.read_range(START + t, START + t + WINDOW - 1, s)
+            times.append(perf_counter() - start)
+        print(f"{'after, read_range hour':<28} {np.median(times) * 1000:>10.2f} ms")
+        db.close()
+
+        start = perf_counter()
+        Database(old, readers=0).close()
+        print(f"Migrating the old table took {perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
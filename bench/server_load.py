@@ -0,0 +1,105 @@
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+from socket import socket, AF_INET, SOCK_DGRAM, SOCK_STREAM
+from time import perf_counter, sleep
+
+from protocol import telemetry
+from server import AsyncServer, Server
+
+MODES = ['threaded', 'async', 'workers']
+STATIONS = [1000, 10000]
+RESULT = 'RESULT '  # Starts the line a child reports on
+
+
+def rss():
+    """Resident memory of this process
+
+    :return: RSS in MB
+    :rtype: float"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def run(mode, stations, readings=5):
+    """Connects simulated stations to a fresh server and floods it with readings
+
+    :param str mode: 'threaded' for Server, 'async' for AsyncServer, 'workers' for Server with a worker per core
+    :param int stations: Amount of simulated stations
+    :param int readings: Readings sent per station
+    :return: Measurements
+    :rtype: dict"""
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'bench.db')
+        if mode == 'async':
+            srv = AsyncServer(('localhost', 0), name, flush_interval=0.1)
+        else:
+            srv = Server(('localhost', 0), name, flush_interval=0.1, workers=os.cpu_count() if mode == 'workers' else 0)
+        srv.start()
+        memory = rss()
+
+        # Handshake for every station
+        addresses = []
+        for _ in range(stations):
+            with socket(AF_INET, SOCK_STREAM) as sock:
+                sock.connect(srv.address)
+                sock.send(b'take')
+                addresses.append(tuple(pickle.loads(sock.recv(1024))))
+
+        result = {'mode': mode, 'stations': stations, 'threads': threading.active_count(),
+                  'rss_mb': round(rss() - memory, 1)}
+
+        sent = 0
+        udp = socket(AF_INET, SOCK_DGRAM)
+        start = perf_counter()
+        for reading in range(readings):
+            for station_id, address in enumerate(addresses):
+                udp.sendto(telemetry.encode([(station_id, reading, 0.0, 10.0 + reading, 0.5)]), address)
+                sent += 1
+
+        # Wait until the server stops storing new rows
+        stored, last_change = 0, perf_counter()
+        while stored < sent and perf_counter() - last_change < 1:
+            sleep(0.05)
+            count = srv.get_index()
+            if count != stored:
+                stored, last_change = count, perf_counter()
+        elapsed = last_change - start
+
+        udp.close()
+        srv.stop()
+
+    result.update(sent=sent, stored=stored, rows_per_s=round(stored / elapsed), loss=round(1 - stored / sent, 4))
+    return result
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:  # One configuration, reported as JSON on a line of its own after RESULT
+        print(f"\n{RESULT}{json.dumps(run(sys.argv[2], int(sys.argv[3])))}\n", end='', flush=True)  # One write
+        return
+
+    # Each configuration runs in its own process, so threads and memory don't carry over
+    stations = [int(n) for n in sys.argv[1:]] or STATIONS
+    for n in stations:
+        for mode in MODES:
+            proc = subprocess.run([sys.executable, '-m', 'bench.server_load', '--child', mode, str(n)],
+                                  capture_output=True, text=True)
+            # Server threads the child doesn't join may still print, even onto the line of the result
+            lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT)]
+            if proc.returncode or not lines:
+                print(f"{mode:<9} {n:>6} stations: failed ({proc.stderr.strip().splitlines()[-1:]})")
+                continue
+            r = json.loads(lines[-1][len(RESULT):])
+            print(f"{mode:<9} {n:>6} stations: {r['threads']:>6} threads, {r['rss_mb']:>7.1f} MB, "
+                  f"{r['rows_per_s']:>8,} rows/s, {r['loss']:.1%} lost")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import pickle
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from protocol import telemetry
+
+
+def _datagrams(readings, batch):
+    """Builds binary datagrams holding batch readings each
+
+    :param int readings: Total readings
+    :param int batch: Readings per datagram
+    :rtype: list"""
+    records = np.zeros(readings, telemetry.RECORD)
+    records['station_id'] = np.arange(readings) % 1000
+    records['sequence'] = np.arange(readings)
+    records['temperature'] = 10.0
+    return [telemetry.encode(records[i:i + batch]) for i in range(0, readings, batch)]
+
+
+def _rate(decode, datagrams, readings):
+    """Decodes every datagram and returns readings decoded per second
+
+    :rtype: float"""
+    start = perf_counter()
+    for data in datagrams:
+        decode(data)
+    return readings / (perf_counter() - start)
+
+
+def main():
+    readings = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    legacy = [pickle.dumps((i % 1000, 10.0, 0.0)) for i in range(readings)]
+    print(f"pickle            {len(legacy[0]):>5} B/reading "
+          f"{_rate(pickle.loads, legacy, readings):>12,.0f} readings/s")
+    print(f"pickle -> records {len(legacy[0]):>5} B/reading "
+          f"{_rate(telemetry.decode_legacy, legacy, readings):>12,.0f} readings/s")
+
+    for batch in (1, 8, telemetry.MAX_RECORDS):
+        datagrams = _datagrams(readings, batch)
+        size = len(datagrams[0]) / batch
+        print(f"binary, batch {batch:<3} {size:>5.0f} B/reading "
+              f"{_rate(telemetry.decode, datagrams, readings):>12,.0f} readings/s")
+
+
+if __name__ == '__main__':
+    main()
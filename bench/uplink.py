@@ -0,0 +1,72 @@
+import os
+import random
+import sys
+import tempfile
+from time import sleep
+
+from server import Server
+from server.database import Database
+from station import LINGER, Station
+
+
+class LossyStation(Station):
+    def __init__(self, *args, loss=0.0, **kwargs):
+        """Station whose datagrams get lost on the way, at random
+
+        :param float loss: Share of datagrams dropped
+        :rtype: None"""
+        super().__init__(*args, **kwargs)
+        self._loss = loss
+        self._random = random.Random(kwargs.get('station_id', 0))
+
+    def _send(self, readings):
+        if self._random.random() < self._loss:
+            self._highest_sent = max(self._highest_sent, readings[-1][1])  # Sent, as far as the station knows
+            return
+        super()._send(readings)
+
+
+def run(reliable, loss, stations=20, seconds=5, interval=0.01, batch=4):
+    """Sends readings over a lossy uplink and counts what was stored
+
+    :param bool reliable: Keep readings until acked, and send them again
+    :param float loss: Share of datagrams dropped
+    :param int stations: Stations sending
+    :param float seconds: Seconds to send for
+    :param float interval: Seconds between readings of a station
+    :param int batch: Readings per datagram
+    :return: Readings taken, stored, stored per second of sending, and readings sent again
+    :rtype: tuple"""
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'bench.db')
+        srv = Server(('localhost', 0), name, batch_size=4096, flush_interval=0.1)
+        srv.start()
+        fleet = [LossyStation(srv.address, interval, station_id=i, batch=batch, reliable=reliable, loss=loss)
+                 for i in range(stations)]
+        for station in fleet:
+            station.start()
+        sleep(seconds)
+        for station in fleet:
+            station.stop()
+        sleep(LINGER if reliable else 0.5)  # Last acks and retransmits
+        srv.stop()
+
+        db = Database(name)
+        stored = db.get_count()
+        db.close()
+
+    taken = sum(station._sequence for station in fleet)
+    return taken, stored, stored / seconds, sum(station.retransmitted for station in fleet)
+
+
+def main():
+    stations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for loss in (0.0, 0.01, 0.1):
+        for reliable in (False, True):
+            taken, stored, rate, retransmitted = run(reliable, loss, stations)
+            print(f"{'reliable' if reliable else 'plain   '} {loss:>4.0%} loss: {taken:>6,} taken, {stored:>6,} stored "
+                  f"({1 - stored / taken:>6.2%} lost), {rate:>7,.0f} readings/s, {retransmitted:>5,} sent again")
+
+
+if __name__ == '__main__':
+    main()
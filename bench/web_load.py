@@ -0,0 +1,95 @@
+import os
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from time import perf_counter
+
+import numpy as np
+from werkzeug.serving import make_server
+
+import flask_implementation.app as web
+from flask_implementation.cache import SnapshotCache
+from flask_implementation.pool import ConnectionPool
+from server import Server
+from server.database import Database
+from station import Station
+
+
+def run(clients, pool_size, cached=True, rows=20000, stations=20, duration=5.0, points=600):
+    """Measures dashboard updates served while many browsers poll at once
+
+    :param int clients: Concurrent dashboard clients
+    :param int pool_size: Server connections the web app may open
+    :param bool cached: Keep results until the data changes, else only share fetches that overlap
+    :param int rows: Readings in the database
+    :param int stations: Stations the readings are spread over
+    :param float duration: Seconds to run
+    :param int points: Points per station each chart asks for
+    :return: Requests per second, p50 and p95 latency in ms, failed requests and cache counters
+    :rtype: tuple"""
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'bench.db')
+        db = Database(name, batch_size=65536)
+        db.write_many((i % stations, 10.0 + i % 7, 0.5) for i in range(rows))
+        db.close()
+
+        server = Server(("localhost", 0), name)
+        server.start()
+
+        web.connect(server.address)
+        web.pool = ConnectionPool(server.address, size=pool_size)
+        web.cache = SnapshotCache(web._latest_index, 64 if cached else 0)
+        station = Station(server.address, 1, station_id=stations)  # Moves the index about every second
+        station.start()
+        http = make_server('localhost', 0, web.app, threaded=True)
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+
+        urls = [f'http://localhost:{http.server_port}/display_{chart}/update?points={points}'
+                for chart in ('temp', 'rain')]
+        deadline = perf_counter() + duration
+        latency = [[] for _ in range(clients)]
+        failed = [0]
+
+        def client(n):
+            while perf_counter() < deadline:
+                start = perf_counter()
+                try:
+                    urllib.request.urlopen(urls[n % 2]).read()
+                except urllib.error.HTTPError:  # No free server connection in time
+                    failed[0] += 1
+                    continue
+                latency[n].append(perf_counter() - start)
+
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+        start = perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = perf_counter() - start
+
+        station.stop()
+        http.shutdown()
+        web.pool.close()
+        server.stop()
+
+    latency = np.concatenate([np.asarray(l) for l in latency])
+    p50, p95 = np.percentile(latency, [50, 95]) * 1000
+    return len(latency) / elapsed, p50, p95, failed[0], web.cache.stats()
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    for clients in (1, 8, 32):
+        for pool_size, cached in ((1, False), (8, False), (8, True)):
+            rate, p50, p95, failed, stats = run(clients, pool_size, cached, duration=duration)
+            print(f"{clients:>3} clients, {pool_size} connection{'s' if pool_size > 1 else ' '}, "
+                  f"{'cache    ' if cached else 'coalesce '}: "
+                  f"{rate:>8.1f} req/s, p50 {p50:>8.2f} ms, p95 {p95:>8.2f} ms, {failed} failed, "
+                  f"{stats['hits']} hits, {stats['misses']} misses, {stats['coalesced']} coalesced")
+
+
+if __name__ == '__main__':
+    main()
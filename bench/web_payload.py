@@ -0,0 +1,74 @@
+import gzip
+import json
+import sys
+import zlib
+from time import perf_counter
+
+import numpy as np
+
+from flask_implementation import payload
+from flask_implementation.app import colours
+from protocol import columnar
+
+
+def _stations(stations, points):
+    """Per-station columns like the web app gets from the server
+
+    :param int stations: Stations
+    :param int points: Readings per station
+    :rtype: dict"""
+    rng = np.random.default_rng(0)
+    return {station: {'data_index': np.arange(station, stations * points, stations, dtype=np.int64),
+                      'station_id': np.full(points, station, dtype=np.int64),
+                      'temperature': rng.normal(10, 5, points).round(2),
+                      'precipitation': rng.exponential(1, points).round(2)}
+            for station in range(stations)}
+
+
+def _double_encoded(stations):
+    """Response body of the update routes before, a JSON string of the JSON of a list of dicts
+
+    :param dict stations: station_id -> columns
+    :rtype: bytes"""
+    l = [{"station_id": station_id, "temp": columns['temperature'].tolist(),
+          "rain": columns['precipitation'].tolist(), "hours": columns['data_index'].tolist(),
+          "color": colours[i % 8]}
+         for i, (station_id, columns) in enumerate(stations.items())]
+    return json.dumps(json.dumps(l)).encode()
+
+
+def _time(f, *args):
+    """Runs f once
+
+    :return: Result and seconds taken
+    :rtype: tuple"""
+    start = perf_counter()
+    result = f(*args)
+    return result, perf_counter() - start
+
+
+def main():
+    stations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    points = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    data = _stations(stations, points)
+    print(f"{stations} stations x {points} points")
+
+    body, seconds = _time(_double_encoded, data)
+    print(f"{'double encoded JSON':<22} {len(body) / 1e6:>8.1f} MB, encode {seconds * 1000:>8.0f} ms")
+    del body
+
+    body, seconds = _time(payload.encode, data, colours)
+    print(f"{'JSON from arrays':<22} {len(body) / 1e6:>8.1f} MB, encode {seconds * 1000:>8.0f} ms")
+
+    p = payload.Payload(body)
+    gzipped, seconds = _time(lambda: p.gzipped)
+    print(f"{'+ gzip':<22} {len(gzipped) / 1e6:>8.1f} MB, gzip   {seconds * 1000:>8.0f} ms (once per snapshot)")
+    assert gzip.decompress(gzipped) == body
+
+    raw, seconds = _time(columnar.encode, data)
+    print(f"{'columnar (reference)':<22} {len(raw) / 1e6:>8.1f} MB, encode {seconds * 1000:>8.0f} ms, "
+          f"deflated {len(zlib.compress(raw, payload.GZIP_LEVEL)) / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
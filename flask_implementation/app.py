@@ -1,11 +1,31 @@
-from flask import Flask, render_template, request,url_for, jsonify, json
+from flask import Flask, Response, render_template, request,url_for, jsonify, json
 from socket import socket, AF_INET, SOCK_STREAM
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
 import pickle
 import random
 
+import numpy as np
+
+from flask_implementation import payload
+from flask_implementation.cache import SnapshotCache
+from flask_implementation.pool import ConnectionPool
+from protocol import columnar
+from protocol.framing import FrameReader, send_frame
+from server.aggregate import downsample
+
 app = Flask(__name__)
 
-sock = socket(AF_INET, SOCK_STREAM)
+address = None  # Server address, set by run
+pool = None  # Connections to the server shared by request threads, set by run
+cache = None  # Results of update shared by all pages, set by run
+
+STREAM_BACKLOG = 64  # Events queued for a browser before new ones are dropped
+KEEPALIVE = 15  # Seconds between keep-alive comments on an idle stream
+
+streams = set()  # Event queue of every open /stream response
+streams_lock = Lock()
+upstream = None  # Thread reading readings pushed by the server
 
 # route tells flask what URL should trigger our function
 # This will trigger localhost
@@ -15,44 +35,116 @@ colours = ['rgb(255, 0, 0)', 'rgb(255, 0, 255)', 'rgb(0, 0, 255)', 'rgb(0, 255,
            'rgb(102, 51, 0)', 'rgb(153, 204, 255)', 'rgb(255, 204, 229)', 'rgb(0, 0, 0)']
 
 
-def update():
+POINTS = 1000  # Default points per station, when the chart doesn't say how wide it is
+HISTORY = 10000  # Latest readings kept per station, that the live charts are downsampled from
+
+cursor = 0  # Highest data_index received from the server
+history = dict()  # station_id -> column arrays of the station's latest HISTORY readings
+history_lock = Lock()
+
+
+def _extend():
     """
-    Updates all the datapoints in the graph
+    Adds the readings stored since the last poll to the history, so a poll costs O(new rows)
+
+    :return: If the server answered
+    :rtype: bool
     """
-    global sock
-    sock.send(b'get-data')
-    # Receive data
-    data = sock.recv(4096)
-    while data[-3:] != b'EOF':
-        data += sock.recv(4096)
+    global cursor
+    summary = pickle.loads(pool.request(b'get-summary'))  # station_id -> (count, last index, temp, rain)
+    if any(station_id not in summary for station_id in history):  # Database was cleared, start over
+        cursor = 0
+        history.clear()
 
-    data = data[:-3]  # Remove poison-pill from message
+    data = pool.request(f'get-columns since {cursor}'.encode())
+    if data == b'error':
+        return False
+
+    for station_id, columns in columnar.decode(data).items():
+        if station_id in history:
+            columns = {name: np.concatenate((history[station_id][name], values)) for name, values in columns.items()}
+        history[station_id] = {name: values[-HISTORY:].copy() for name, values in columns.items()}
+        cursor = max(cursor, int(columns['data_index'][-1]))
+    return True
+
+
+def update(points=POINTS, idx_from=0, idx_to=-1):
+    """
+    Updates all the datapoints in the graph, downsampled to the chart's resolution
+
+    The live charts (the default range) are downsampled here from the latest HISTORY readings of each station, which
+    are extended with the new rows on every poll. Other ranges are downsampled by the server.
+
+    :param int points: Points per station the chart can show, usually its width in pixels
+    :param int idx_from: Index to start from (inclusive)
+    :param int idx_to: Index to stop at, -1 for newest
+    :return: JSON of every station's series, None if the server refused
+    :rtype: payload.Payload
+    """
+    if idx_from == 0 and idx_to == -1:
+        with history_lock:
+            if not _extend():
+                print("Server responded with error.")
+                return None
+            stations = {station_id: downsample(columns, points) for station_id, columns in history.items()}
+        return payload.Payload(payload.encode(stations, colours))
+
+    data = pool.request(f'get-agg {idx_from} {idx_to} {points} lttb'.encode())
 
     if data == b'error':
         print("Server responded with error.")
         return None
 
-    dic = pickle.loads(data)
+    return payload.Payload(payload.encode(columnar.decode(data), colours))
+
+
+def _latest_index():
+    """
+    Asks the server for its highest data_index
+
+    :rtype: int
+    """
+    return int(pool.request(b'get-index'))
+
 
-    l = list()
+def _query():
+    """
+    Reads the resolution and range the chart asked for
 
-    i = 0
-    for station_id, info in dic.items():
-        d = dict()
-        d["station_id"] = station_id
-        temp, rain = [], []
-        for t, r in info:
-            temp.append(t)
-            rain.append(r)
-        d["temp"] = temp
-        d["rain"] = rain
-        d["hours"] = [i for i in range(len(info))]
-        d["color"] = colours[i % 8]
-        i += 1
-        l.append(d)
-    return l
+    :return: Keyword arguments for update
+    :rtype: dict
+    """
+    return dict(points=max(1, request.args.get('points', POINTS, type=int)),
+                idx_from=request.args.get('from', 0, type=int),
+                idx_to=request.args.get('to', -1, type=int))
 
 
+def cached_update(points=POINTS, idx_from=0, idx_to=-1):
+    """
+    Same as update, but shared by every page asking for the same range and resolution until new data arrives.
+    Temperature and rain charts share one snapshot.
+    """
+    return cache.get((points, idx_from, idx_to), lambda: update(points, idx_from, idx_to))
+
+
+def _respond(p):
+    """
+    Sends a payload, gzipped if the browser takes it, or 304 if the browser has it already
+
+    :param payload.Payload p: Payload to send, None if there is none
+    :rtype: Response
+    """
+    if p is None:
+        return Response(b'null', 502, mimetype='application/json')
+
+    gzipped = request.accept_encodings['gzip'] > 0
+    response = Response(p.gzipped if gzipped else p.body, mimetype='application/json')
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(p.etag + ('-gzip' if gzipped else ''))  # Encodings of one payload are different bytes
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True  # Browser keeps it, but asks every time
+    return response.make_conditional(request)
 
 
 @app.route("/")
@@ -71,8 +163,7 @@ def update_rain():
     """
     Updates rain data
     """
-    l = update()
-    return jsonify(json.dumps(l))
+    return _respond(cached_update(**_query()))
 
 
 # displays temp data
@@ -87,12 +178,109 @@ def display_temp():
 # displays temp data
 @app.route('/display_temp/update', methods=["GET"])
 def update_temp():
-    l = update()
-    return jsonify(json.dumps(l))
+    return _respond(cached_update(**_query()))
+
+
+@app.route('/cache')
+def cache_stats():
+    """
+    Hit and miss counters of the update cache
+    """
+    return jsonify(cache.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Metrics of the server and of the web app, in the Prometheus text format
+    """
+    try:
+        server = pool.request(b'metrics').decode()
+        up = 1
+    except (OSError, TimeoutError):  # Still report the web app, a scrape shows the server is down
+        server, up = '', 0
+
+    stats = cache.stats()
+    with streams_lock:
+        stats['streams'] = len(streams)
+    web = [('webapp_server_up', 'gauge', 'Whether the server answered the metrics request', up),
+           ('webapp_cache_hits_total', 'counter', 'Updates answered from the cache', stats['hits']),
+           ('webapp_cache_misses_total', 'counter', 'Updates fetched from the server', stats['misses']),
+           ('webapp_cache_coalesced_total', 'counter', 'Updates that waited for a fetch already running',
+            stats['coalesced']),
+           ('webapp_cache_entries', 'gauge', 'Snapshots in the cache', stats['entries']),
+           ('webapp_streams', 'gauge', 'Open /stream responses', stats['streams'])]
+    text = server + ''.join(f'# HELP {name} {description}\n# TYPE {name} {kind}\n{name} {value}\n'
+                            for name, kind, description, value in web)
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+def _upstream():
+    """
+    Subscribes to new readings on the server, and fans every batch out to all open streams
+    """
+    global upstream
+    try:
+        with socket(AF_INET, SOCK_STREAM) as s:
+            s.connect(address)
+            s.send(b'gib')
+            send_frame(s, b'subscribe')
+            reader = FrameReader(s)
+            reader.read()  # 'ok'
+            while True:
+                _, data = reader.read()
+                event = payload.encode(columnar.decode(bytes(data))).decode()
+                with streams_lock:
+                    for queue in streams:
+                        try:
+                            queue.put_nowait(event)
+                        except Full:  # Browser is behind, it catches up on its next full update
+                            pass
+    except OSError as e:
+        print(f"Lost subscription to server: '{e}'")
+    finally:
+        upstream = None  # Next stream subscribes again
+
+
+@app.route('/stream')
+def stream():
+    """
+    Server-Sent Events with the readings of every station as they are stored, shared by all open pages
+    """
+    global upstream
+    queue = Queue(STREAM_BACKLOG)
+    with streams_lock:
+        streams.add(queue)
+        if upstream is None:  # One subscription to the server, however many pages are open
+            upstream = Thread(target=_upstream, daemon=True)
+            upstream.start()
+
+    def events():
+        try:
+            while True:
+                try:
+                    yield f"data: {queue.get(timeout=KEEPALIVE)}\n\n"
+                except Empty:
+                    yield ": keepalive\n\n"
+        finally:  # Page closed
+            with streams_lock:
+                streams.discard(queue)
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+def connect(addr):
+    """
+    Points the web app at a server
+
+    :param tuple addr: Server address
+    """
+    global address, pool, cache
+    address = addr
+    pool = ConnectionPool(addr)
+    cache = SnapshotCache(_latest_index)
 
 
 def run(addr):
-    global sock
-    sock.connect(addr)
-    sock.send(b'gib')
+    connect(addr)
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from threading import Event, Lock
+
+
+class _Flight:
+    def __init__(self):
+        """Fetch in progress, that other requests for the same key wait on
+
+        :rtype: None"""
+        self.done = Event()
+        self.value = None
+        self.error = None
+
+
+class SnapshotCache:
+    def __init__(self, latest_index, max_entries=64):
+        """Cache of query results, valid until the server's data_index moves
+
+        :param latest_index: Function returning the server's highest data_index
+        :param int max_entries: Results to keep, least recently used go first
+        :rtype: None"""
+        self._latest_index = latest_index
+        self._max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (data_index, value)
+        self._flights = dict()  # (key, data_index) -> _Flight
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # Misses that waited for another request's fetch instead of fetching
+
+    def get(self, key, fetch):
+        """Returns the cached result for key, or fetches it once however many requests ask at the same time
+
+        :param key: Query, e.g. (points, from, to)
+        :param fetch: Function returning the result
+        :return: Result of fetch
+        """
+        index = self._latest_index()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == index:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+
+            flight = self._flights.get((key, index))
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._flights[key, index] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fetch()  # Rows newer than index may be included, the next index refetches anyway
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key, index]
+                if flight.error is None and flight.value is not None:
+                    self._entries[key] = index, flight.value
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self._max_entries:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+    def stats(self):
+        """Hit and miss counters
+
+        :rtype: dict"""
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, coalesced=self.coalesced, entries=len(self._entries))
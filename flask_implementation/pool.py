@@ -0,0 +1,133 @@
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from socket import socket, AF_INET, SOCK_STREAM
+from threading import Lock
+from time import monotonic
+
+from protocol.framing import FrameClient
+
+HEALTH_CHECK_AFTER = 30  # Seconds a connection may sit idle before it is pinged on checkout
+
+
+class _Connection:
+    def __init__(self, address, timeout):
+        """Sender connection to the server
+
+        :param tuple address: Server address
+        :param float timeout: Socket timeout in seconds
+        :rtype: None"""
+        self.socket = socket(AF_INET, SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+        self.socket.send(b'gib')
+        self.client = FrameClient(self.socket)
+        self.used = monotonic()
+
+    def healthy(self):
+        """Pings the server if the connection has been idle for a while
+
+        :rtype: bool"""
+        if monotonic() - self.used < HEALTH_CHECK_AFTER:
+            return True
+        try:
+            return self.client.request(b'ping') == b'pong'
+        except OSError:
+            return False
+
+    def close(self):
+        try:
+            self.client.send(b'exit')
+        except OSError:
+            pass
+        self.socket.close()
+
+
+class ConnectionPool:
+    def __init__(self, address, size=8, timeout=10):
+        """Pool of connections to the server for web request threads, so requests don't share one socket
+
+        :param tuple address: Server address
+        :param int size: Max open connections, further checkouts wait for one to be checked in
+        :param float timeout: Seconds to wait for the server, and for a free connection
+        :rtype: None"""
+        self._address = address
+        self._size = size
+        self._timeout = timeout
+        self._idle = LifoQueue()  # Most recently used first, so spare connections go idle and get checked
+        self._open = 0
+        self._lock = Lock()
+
+    def _checkout(self):
+        """Takes an idle, healthy connection, or opens one if the pool isn't full
+
+        :rtype: _Connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                with self._lock:
+                    opening = self._open < self._size
+                    if opening:
+                        self._open += 1
+                if opening:
+                    try:
+                        return _Connection(self._address, self._timeout)
+                    except OSError:
+                        self._discard(None)
+                        raise
+                try:
+                    conn = self._idle.get(timeout=self._timeout)
+                except Empty:
+                    raise TimeoutError("No free server connection") from None
+
+            if conn.healthy():
+                return conn
+            self._discard(conn)  # Server restarted or connection dropped, reconnect
+
+    def _discard(self, conn):
+        """Closes a broken connection and frees its slot
+
+        :param _Connection conn: Connection to close, or None if it never opened
+        :rtype: None"""
+        if conn is not None:
+            conn.close()
+        with self._lock:
+            self._open -= 1
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection for the block, and checks it in after
+
+        :rtype: FrameClient"""
+        conn = self._checkout()
+        try:
+            yield conn.client
+        except OSError:
+            self._discard(conn)  # Don't hand out a connection with half a response in it
+            raise
+        conn.used = monotonic()
+        self._idle.put(conn)
+
+    def request(self, payload, retries=1):
+        """Sends a request on a pooled connection and returns the response, reconnecting if the connection broke
+
+        :param bytes payload: Request
+        :param int retries: Extra attempts on a fresh connection
+        :rtype: bytes"""
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as client:
+                    return client.request(payload)
+            except OSError:
+                if attempt == retries:
+                    raise
+
+    def close(self):
+        """Closes idle connections
+
+        :rtype: None"""
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except Empty:
+                return
@@ -8,38 +8,28 @@ function func() {
     $.ajax({
         url: "display_temp/update",
         type:"GET",
+        data: {points: ctx.width},  // Ask for as many points as the chart has pixels
         dataType: "json",
         success: function(data) {
-            weather_data = JSON.parse(data);
-            // console.log(data)
-            console.log(weather_data)
+            weather_data = data;  // Parsed once by jQuery
 
 
             theChart.data.datasets = []
 
-            let max = 0;
-            let hours = [];
             for (const i in weather_data) {
 
                 const ds = {
                     type: "line",
                     label: 'Station ' + weather_data[i]["station_id"],
-                    data: weather_data[i]["temp"],
+                    data: weather_data[i]["hours"].map((x, j) => ({x: x, y: weather_data[i]["temp"][j]})),
                     fill: false,
                     backgroundColor: weather_data[i]["color"],
                     borderColor: weather_data[i]["color"]
                 };
 
                 theChart.data.datasets.push(ds);
-
-                if (weather_data[i]["hours"].length > max) {
-                    max = weather_data[i]["hours"].length;
-                    hours = weather_data[i]["hours"];
-                }
             }
 
-            theChart.data.labels = hours;
-
             theChart.update()
         }
     });
@@ -49,7 +39,7 @@ function func() {
 const ctx = document.getElementById("rain_temp_canvas");
 var theChart = new Chart(ctx, {
     options: {
-        scales: { y: { beginAtZero: true}
+        scales: { x: { type: 'linear' }, y: { beginAtZero: true}
         },
         legend: { display: false },
         title: { display: true },
@@ -58,7 +48,21 @@ var theChart = new Chart(ctx, {
 });
 
 
-setInterval(func,5000)
+func()
+setInterval(func,60000)  // Full update now and then, downsampled again by the server
+
+// New readings are pushed as soon as they are stored, and added to the chart
+const events = new EventSource("/stream");
+events.onmessage = function(event) {
+    for (const station of JSON.parse(event.data)) {
+        const ds = theChart.data.datasets.find(d => d.label === 'Station ' + station["station_id"]);
+        if (ds === undefined) {
+            continue;  // New station, shows up on the next full update
+        }
+        station["hours"].forEach((x, j) => ds.data.push({x: x, y: station["temp"][j]}));
+    }
+    theChart.update();
+};
 
 console.log(temp_data)
 console.log(rain_data)
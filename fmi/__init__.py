@@ -1,8 +1,14 @@
-import pickle
 import re
+from itertools import count
 from socket import socket, AF_INET, SOCK_STREAM
+from threading import Thread
 from typing import List, Union
 import flask_implementation.app as app
+from fmi import client
+from protocol import columnar
+from protocol.framing import FrameClient
+
+OPTIONS = ('--limit', '--station', '--out')  # Options of get-data, each followed by a value
 
 
 class FMI:
@@ -11,11 +17,15 @@ class FMI:
 
         :rtype: None"""
         self._socket = socket(AF_INET, SOCK_STREAM)
+        self._client = FrameClient(self._socket)  # Frames requests and matches up responses
 
         self._shut_down = False
 
         self._address = None
 
+        self._queries = dict()  # Query number -> thread, of queries writing to files in the background
+        self._query_numbers = count(1)
+
     def _update(self):
         """Constantly gets request from console
 
@@ -33,7 +43,7 @@ class FMI:
         # Shutdown
         # Try to send shutdown message to server
         try:
-            self._socket.send(b'exit')
+            self._client.send(b'exit')
         except OSError:
             pass
 
@@ -56,17 +66,6 @@ class FMI:
         :rtype: None"""
         self._shut_down = True
 
-    def _receive(self):
-        """Receive data
-
-        :rtype: bytes"""
-        data = b''
-        data = self._socket.recv(4096)
-        while data[-3:] != b'EOF':
-            data += self._socket.recv(4096)
-
-        return data[:-3]  # Remove poison-pill from message
-
     def _parse_cmd(self, cmd, args=None):
         """Parses the cmd request and performs
 
@@ -87,6 +86,12 @@ class FMI:
             self._connect(args)
         elif cmd == 'status':
             self._status()
+        elif cmd == 'wait':
+            self._wait()
+        elif cmd == 'export':
+            self._export(args)
+        elif cmd == 'import':
+            self._import(args)
         elif cmd == 'exit':
             self._exit()
         elif cmd == 'clear':
@@ -119,12 +124,22 @@ class FMI:
         if cmd == 'get-data' or cmd is None:
             print("\tGET-DATA [FROM] [TO]:"
                   "\t\t\tFetches data from server using supplied indexes, default values are: 0, inf.")
+            print("\tGET-DATA SINCE INDEX:"
+                  "\t\t\tFetches data added after INDEX, and the new highest index.")
+            print("\t\t[--limit N] [--station ID]:\t\tFetches at most N rows, or only rows of station ID.")
+            print("\t\t[--out FILE.csv|FILE.npz]:\t\tWrites to a file in the background instead of printing.")
         if cmd == 'start-webapp' or cmd is None:
             print("\tSTART-WEBAPP [ADDRESS:PORT]:\t\tStarts a webpage where data can be viewed in real time.")
         if cmd == 'connect' or cmd is None:
             print("\tCONNECT ADDRESS:PORT:\t\t\tAttempts to connect to a server using supplied address : port.")
         if cmd == 'status' or cmd is None:
             print("\tSTATUS:\t\t\t\t\t\t\tGives information about the current session.")
+        if cmd == 'export' or cmd is None:
+            print("\tEXPORT FILE.npz|FILE.csv:\t\tWrites every reading to a file in the background, for backups.")
+        if cmd == 'import' or cmd is None:
+            print("\tIMPORT FILE.npz:\t\t\t\tLoads an exported file in the background, all or nothing.")
+        if cmd == 'wait' or cmd is None:
+            print("\tWAIT:\t\t\t\t\t\t\tWaits for queries running in the background.")
         if cmd == 'exit' or cmd is None:
             print("\tEXIT:\t\t\t\t\t\t\tExit the FMI console.")
         if cmd == 'clear' or cmd is None:
@@ -133,34 +148,123 @@ class FMI:
     def _get_data(self, args=None, print_data=True) -> Union[dict, None]:
         """Get data from index
 
+        Ranges are streamed in chunks and printed or written as they arrive, SINCE is read at once.
+
         :param List[str] args: Command line arguments
         :param bool print_data: If the data should be printed
-        :rtype: Dict{station_id: data} or None"""
-        if args is None or len(args) == 0:
-            self._socket.send(b'get-data')
-        elif len(args) == 1:
-            self._socket.send(f'get-data {args[0]}'.encode())
-        elif len(args) == 2:
-            self._socket.send(f'get-data {args[0]} {args[1]}'.encode())
+        :rtype: Dict{station_id: Dict{column: array}} or None"""
+        if not args or args[0].lower() != 'since':
+            self._stream_data(args or [])
+            return None
+
+        if len(args) == 2:
+            request = f'get-columns {args[0]} {args[1]}'.encode()
         else:
             if print_data:
                 print("Error, invalid argument given; see help.")
             return None
 
         # Receive data
-        data = self._receive()
+        data = self._client.request(request)
 
         if data == b'error':
             print("Server responded with error.")
             return None
 
-        data = pickle.loads(data)
+        data = columnar.decode(data)  # station_id -> column arrays
 
         if print_data:
-            for station_id, info in data.items():
-                print(f"Station {station_id} data:")
-                for t, r in info:
-                    print(f"\tTemperature: {t},\tRain: {r}")
+            print(f"Highest index: {max((c['data_index'][-1] for c in data.values()), default=args[1])}")
+            client.TextWriter().write(data)
+
+        return data
+
+    def _stream_data(self, args):
+        """Streams rows, printing them in the foreground or writing them to a file in the background
+
+        :param List[str] args: [FROM] [TO] followed by options
+        :rtype: None"""
+        options = {}
+        while len(args) >= 2 and args[-2].lower() in OPTIONS:
+            options[args[-2].lower()] = args[-1]
+            args = args[:-2]
+        path = options.get('--out')
+        if len(args) > 2 or not all(x.isdigit() for x in args) or \
+                not all(options.get(o, '0').isdigit() for o in ('--limit', '--station')) or \
+                path is not None and not path.lower().endswith(('.npz', '.csv')):
+            print("Error, invalid argument given; see help.")
+            return
+
+        idx_from = int(args[0]) if args else 0
+        idx_to = int(args[1]) if len(args) == 2 else None
+        station = int(options['--station']) if '--station' in options else None
+        limit = int(options['--limit']) if '--limit' in options else None
+
+        chunks = client.query(self._client, idx_from, idx_to, station, limit)
+        if path is not None:
+            self._background(f"writing to {path}", lambda: f"wrote {client.save(chunks, path)} rows to {path}.")
+            return
+        try:
+            client.save(chunks)
+        except (ValueError, OSError) as e:
+            print(e)
+
+    def _export(self, args=None):
+        """Writes every reading on the server to a file in the background
+
+        :param List[str] args: Arguments, should be a .npz or .csv file
+        :rtype: None"""
+        if args is None or len(args) != 1 or not args[0].lower().endswith(('.npz', '.csv')):
+            print("Error, invalid argument given; see help.")
+            return
+        path = args[0]
+        self._background(f"exporting to {path}", lambda: f"exported {client.export(self._client, path)} rows to "
+                                                         f"{path}.")
+
+    def _import(self, args=None):
+        """Loads a file written by export into the server in the background
+
+        :param List[str] args: Arguments, should be a .npz file
+        :rtype: None"""
+        if args is None or len(args) != 1 or not args[0].lower().endswith('.npz'):
+            print("Error, invalid argument given; see help.")
+            return
+        path = args[0]
+        self._background(f"importing {path}", lambda: f"imported {client.import_file(self._client, path)} rows "
+                                                      f"from {path}.")
+
+    def _background(self, description, work):
+        """Runs a query on a thread of its own, so the console takes commands meanwhile
+
+        :param str description: What the query does, printed when it starts
+        :param work: Function running the query, returns what to print when done
+        :rtype: None"""
+        number = next(self._query_numbers)
+        thread = self._queries[number] = Thread(target=self._run, args=(number, work), daemon=True)
+        thread.start()
+        print(f"Query {number} {description}.")
+
+    def _run(self, number, work):
+        """Runs a background query and reports how it went
+
+        :param int number: Number of the query
+        :param work: Function running the query
+        :rtype: None"""
+        try:
+            report = work()
+        except (ValueError, OSError) as e:
+            print(f"\rQuery {number} failed: '{e}'\n", end='')  # One write, so reports don't run together
+        else:
+            print(f"\rQuery {number} {report}\n", end='')
+        finally:
+            self._queries.pop(number, None)
+
+    def _wait(self):
+        """Waits for background queries, exports and imports to finish
+
+        :rtype: None"""
+        for thread in list(self._queries.values()):
+            thread.join()
 
     def _start_webapp(self, args=None):
         """Starts the web app
@@ -197,9 +301,7 @@ class FMI:
         """
         data = b''
         try:
-            self._socket.send(b'status')
-
-            data = self._receive()
+            data = self._client.request(b'status')
         except OSError:
             print("Could not communicate with server.")
             pass
@@ -217,8 +319,7 @@ class FMI:
         """Empties connected database
 
         :rtype: None"""
-        self._socket.send(b'clear')
-        self._receive()
+        self._client.request(b'clear')
 
 
 __all__ = ['FMI']  # Overwrites from fmi import *
@@ -0,0 +1,289 @@
+import sys
+import zipfile
+from socket import socket, AF_INET, SOCK_STREAM
+
+import numpy as np
+
+from protocol import columnar
+from protocol.framing import FrameClient
+
+OUTPUT_BUFFER = 2 ** 20  # Bytes of text buffered before it is written to the terminal or a file
+COLUMNS = ('data_index', 'station_id', 'timestamp', 'temperature', 'precipitation')  # Order columns are written in
+
+
+def query(client, idx_from=0, idx_to=None, station_id=None, limit=None):
+    """Streams rows from the server, one chunk at a time as it arrives
+
+    Only the chunk being handled is held in memory. Several threads may stream over one client at once.
+
+    :param FrameClient client: Client of a connected sender
+    :param int idx_from: index to start from (inclusive)
+    :param int idx_to: Index to stop read at, None for newest
+    :param int station_id: Only read this station
+    :param int limit: Max rows read, None for all
+    :return: Iterator of station_id -> dict of 'data_index', 'station_id', 'temperature', 'precipitation' and
+        'timestamp' arrays
+    :rtype: iterator"""
+    args = ' '.join('*' if x is None else str(int(x)) for x in (idx_from, idx_to, station_id, limit))
+    return _decoded(client.stream(f'get-stream {args}'.encode()))
+
+
+def _decoded(frames):
+    """Decodes streamed chunks
+
+    :param frames: Iterator of frames, from FrameClient.stream
+    :return: Iterator of station_id -> column arrays
+    :rtype: iterator"""
+    try:
+        for frame in frames:
+            if frame == b'error':
+                raise ValueError("Server responded with error.")
+            yield columnar.decode(frame, columnar.TIMED)
+    finally:
+        frames.close()  # A query stopped early drops the rest of its frames
+
+
+def export(client, path):
+    """Writes every reading stored on the server to a file, from one snapshot, one chunk at a time
+
+    :param FrameClient client: Client of a connected sender
+    :param str path: '.npz' file, or '.csv'
+    :return: Readings written
+    :rtype: int"""
+    return save(_decoded(client.stream(b'export')), path)
+
+
+def import_file(client, path):
+    """Loads a file written by export into the server, one row group at a time
+
+    The server loads the whole file in one transaction, nothing is loaded if it fails.
+
+    :param FrameClient client: Client of a connected sender
+    :param str path: '.npz' file
+    :return: Readings loaded
+    :rtype: int"""
+    if not path.lower().endswith('.npz'):
+        raise ValueError(f"Can only import .npz files, not '{path}'.")
+    with np.load(path) as arrays:  # Opened here, so a missing file fails before the import starts
+        groups = (columnar.encode(_stations(columns), columnar.TIMED) for columns in row_groups(arrays))
+        resp = client.upload(b'import', groups)
+    if resp == b'error':
+        raise ValueError("Server responded with error.")
+    return int(resp)
+
+
+def _stations(columns):
+    """Groups the rows of flat column arrays by station
+
+    :param dict columns: Column name -> array
+    :return: station_id -> column arrays
+    :rtype: dict"""
+    order = np.argsort(columns['station_id'], kind='stable')
+    columns = {name: columns[name][order] for name in COLUMNS}
+    ids, starts = np.unique(columns['station_id'].astype(np.int64), return_index=True)
+    bounds = list(starts[1:]) + [len(order)]
+    return {int(station_id): {name: array[a:b] for name, array in columns.items()}
+            for station_id, a, b in zip(ids, starts, bounds)}
+
+
+def _flat(chunk):
+    """Joins the stations of a chunk into one array per column
+
+    :param dict chunk: station_id -> column arrays
+    :return: Column name -> array
+    :rtype: dict"""
+    return {name: np.concatenate([columns[name] for columns in chunk.values()]) if chunk else np.zeros(0)
+            for name in COLUMNS}
+
+
+class TextWriter:
+    def __init__(self, stream=None):
+        """Prints chunks as text, one write per chunk instead of one print per row
+
+        :param stream: Text stream, stdout if None
+        :rtype: None"""
+        self._stream = sys.stdout if stream is None else stream
+        self.rows = 0
+
+    def write(self, chunk):
+        """Prints one chunk
+
+        :param dict chunk: station_id -> column arrays
+        :rtype: None"""
+        lines = []
+        for station_id, columns in chunk.items():
+            lines.append(f"Station {station_id} data:")
+            lines.extend(f"\tTemperature: {t},\tRain: {r}"
+                         for t, r in zip(columns['temperature'].tolist(), columns['precipitation'].tolist()))
+            self.rows += len(columns['temperature'])
+        if lines:
+            self._stream.write('\n'.join(lines) + '\n')
+            self._stream.flush()
+
+    def close(self):
+        pass
+
+
+class CsvWriter:
+    def __init__(self, path):
+        """Writes chunks to a CSV file with a header row, through a large buffer
+
+        :param str path: File to write
+        :rtype: None"""
+        self._file = open(path, 'w', buffering=OUTPUT_BUFFER)
+        self._file.write(','.join(COLUMNS) + '\n')
+        self.rows = 0
+
+    def write(self, chunk):
+        """Appends one chunk
+
+        :param dict chunk: station_id -> column arrays
+        :rtype: None"""
+        columns = _flat(chunk)
+        rows = zip(columns['data_index'].astype(np.int64).tolist(), columns['station_id'].astype(np.int64).tolist(),
+                   *(columns[name].tolist() for name in COLUMNS[2:]))
+        self._file.write(''.join(f"{i},{s},{'' if ts != ts else ts},{t},{r}\n" for i, s, ts, t, r in rows))  # NaN time
+        self.rows += len(columns['data_index'])
+
+    def close(self):
+        self._file.close()
+
+
+class ColumnarWriter:
+    def __init__(self, path):
+        """Writes chunks to an .npz file as row groups, one .npy array per column and chunk
+
+        Arrays are stored uncompressed as 'NNNNN/column', so a reader can load one row group or one column at a time.
+        See load.
+
+        :param str path: File to write
+        :rtype: None"""
+        self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+        self._groups = 0
+        self.rows = 0
+
+    def write(self, chunk):
+        """Appends one chunk as a row group
+
+        :param dict chunk: station_id -> column arrays
+        :rtype: None"""
+        columns = _flat(chunk)
+        for name in COLUMNS:
+            with self._zip.open(f'{self._groups:05d}/{name}.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(columns[name]), allow_pickle=False)
+        self._groups += 1
+        self.rows += len(columns['data_index'])
+
+    def close(self):
+        self._zip.close()
+
+
+def open_writer(path=None):
+    """Writer for an output file, by its extension
+
+    :param str path: '.csv' or '.npz' file, None to print
+    :return: TextWriter, CsvWriter or ColumnarWriter
+    :rtype: object"""
+    if path is None:
+        return TextWriter()
+    if path.lower().endswith('.csv'):
+        return CsvWriter(path)
+    if path.lower().endswith('.npz'):
+        return ColumnarWriter(path)
+    raise ValueError(f"Unknown output format '{path}', use .csv or .npz.")
+
+
+def save(chunks, path=None):
+    """Writes chunks as they arrive
+
+    :param chunks: Iterator of station_id -> column arrays, from query
+    :param str path: '.csv' or '.npz' file, None to print
+    :return: Rows written
+    :rtype: int"""
+    writer = open_writer(path)
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+    finally:
+        writer.close()
+    return writer.rows
+
+
+def row_groups(arrays, columns=COLUMNS):
+    """Reads the row groups of a file written by ColumnarWriter, one at a time
+
+    :param arrays: Opened file, from np.load
+    :param tuple columns: Columns to read
+    :return: Iterator of column name -> array
+    :rtype: iterator"""
+    for group in sorted({key.split('/')[0] for key in arrays.files}):
+        yield {name: arrays[f'{group}/{name}'] for name in columns}
+
+
+def load(path, columns=COLUMNS):
+    """Reads a file written by ColumnarWriter
+
+    :param str path: .npz file
+    :param tuple columns: Columns to read
+    :return: Column name -> array, the row groups joined
+    :rtype: dict"""
+    with np.load(path) as arrays:
+        groups = list(row_groups(arrays, columns))
+    return {name: np.concatenate([group[name] for group in groups]) if groups else np.zeros(0) for name in columns}
+
+
+class Client:
+    def __init__(self, address, timeout=None):
+        """Connects to a server as an FMI client
+
+        :param tuple address: Server address
+        :param float timeout: Socket timeout in seconds, None to wait forever
+        :rtype: None"""
+        self._socket = socket(AF_INET, SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._socket.send(b'gib')
+        self._client = FrameClient(self._socket)
+
+    def query(self, idx_from=0, idx_to=None, station_id=None, limit=None):
+        """Streams rows from the server, see query
+
+        :rtype: iterator"""
+        return query(self._client, idx_from, idx_to, station_id, limit)
+
+    def export(self, path):
+        """Writes every reading stored on the server to a file, see export
+
+        :rtype: int"""
+        return export(self._client, path)
+
+    def import_file(self, path):
+        """Loads a file written by export into the server, see import_file
+
+        :rtype: int"""
+        return import_file(self._client, path)
+
+    def request(self, payload):
+        """Sends any other request and waits for the response
+
+        :param bytes payload: Request
+        :return: Response
+        :rtype: bytes"""
+        return self._client.request(payload)
+
+    def close(self):
+        try:
+            self._client.send(b'exit')
+        except OSError:
+            pass
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+__all__ = ['Client', 'query', 'export', 'import_file', 'save', 'load', 'row_groups', 'open_writer', 'TextWriter',
+           'CsvWriter', 'ColumnarWriter']
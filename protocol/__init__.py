@@ -0,0 +1 @@
+# Wire formats shared by the server, stations, FMI consoles and the web app.
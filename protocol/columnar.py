@@ -0,0 +1,57 @@
+import struct
+
+import numpy as np
+
+# Column name and dtype, in the order they are sent. The station_id column is not sent, it is the station's id.
+COLUMNS = (('data_index', np.dtype('<i8')), ('temperature', np.dtype('<f8')), ('precipitation', np.dtype('<f8')))
+
+# Columns of readings read by time, with the unix time each was measured
+TIMED = COLUMNS + (('timestamp', np.dtype('<f8')),)
+
+# Columns of bucketed aggregates, one row per bucket
+AGGREGATES = (('data_index', np.dtype('<i8')), ('count', np.dtype('<i8'))) + \
+    tuple((f'{name}_{stat}', np.dtype('<f8')) for name in ('temperature', 'precipitation')
+          for stat in ('min', 'mean', 'max', 'sum'))
+
+# Columns of hourly or daily rollups, one row per bucket starting at unix time 'bucket'
+ROLLUPS = (('bucket', np.dtype('<i8')),) + AGGREGATES[1:]
+
+HEADER = struct.Struct('<I')  # Station count
+STATION = struct.Struct('<qQ')  # Station id, row count
+
+
+def encode(stations, columns=COLUMNS):
+    """Packs per-station column arrays into raw buffers, without per-row objects
+
+    :param dict stations: station_id -> dict of column name -> 1-D array, as returned by Database.read_columns
+    :param tuple columns: Names and dtypes of the columns to send
+    :return: Encoded columns
+    :rtype: bytes"""
+    parts = [HEADER.pack(len(stations))]
+    for station_id, arrays in stations.items():
+        parts.append(STATION.pack(station_id, len(arrays[columns[0][0]])))
+        for name, dtype in columns:
+            parts.append(np.ascontiguousarray(arrays[name], dtype).tobytes())
+    return b''.join(parts)
+
+
+def decode(data, columns=COLUMNS):
+    """Unpacks encoded columns, the arrays except station_id are read-only views into data
+
+    :param bytes data: Encoded columns
+    :param tuple columns: Names and dtypes of the columns sent
+    :return: station_id -> dict of column name -> 1-D array
+    :rtype: dict"""
+    stations = {}
+    (count,) = HEADER.unpack_from(data)
+    offset = HEADER.size
+    for _ in range(count):
+        station_id, rows = STATION.unpack_from(data, offset)
+        offset += STATION.size
+        arrays = {}
+        for name, dtype in columns:
+            arrays[name] = np.frombuffer(data, dtype, rows, offset)
+            offset += rows * dtype.itemsize
+        arrays['station_id'] = np.full(rows, station_id, np.int64)
+        stations[station_id] = arrays
+    return stations
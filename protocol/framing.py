@@ -0,0 +1,240 @@
+import struct
+from collections import deque
+from itertools import count
+from threading import Lock
+
+HANDSHAKES = (b'gib', b'take', b'exit')  # Plain messages a connection opens with, before any frames
+
+HEADER = struct.Struct('!IQ')  # Request id, payload length
+
+_SMALL = 65536  # Payloads below this are sent in the same write as the header
+MAX_FRAME = 2 ** 30  # Bytes, a header announcing more is taken as a broken connection
+MAX_PENDING = 2 ** 26  # Bytes of frames a FrameClient holds for requests nobody is receiving yet
+
+
+def _checked(length):
+    """Checks the payload length of a header before anything is allocated for it
+
+    :param int length: Length from the header
+    :return: The length
+    :rtype: int"""
+    if length > MAX_FRAME:
+        raise ConnectionResetError(f"Frame of {length} bytes is larger than {MAX_FRAME}, the connection is broken")
+    return length
+
+
+def send_frame(sock, payload, request_id=0):
+    """Sends payload with a length header
+
+    :param socket sock: Connected socket
+    :param bytes payload: Data to send
+    :param int request_id: Id of the request the frame belongs to
+    :rtype: None"""
+    header = HEADER.pack(request_id, len(payload))
+    if len(payload) < _SMALL:
+        sock.sendall(header + payload)  # One segment, so Nagle won't hold back the payload
+    else:
+        sock.sendall(header)
+        sock.sendall(payload)
+
+
+class FrameReader:
+    def __init__(self, sock, size=_SMALL):
+        """Reads length-prefixed frames from a socket into a reusable buffer
+
+        :param socket sock: Connected socket
+        :param int size: Initial size of buffer, grows to fit the largest frame
+        :rtype: None"""
+        self._socket = sock
+        self._buffer = bytearray(max(size, HEADER.size))
+        self._view = memoryview(self._buffer)
+
+    def _read_into(self, view):
+        """Fills view from socket
+
+        :param memoryview view: View to fill
+        :rtype: None"""
+        while len(view):
+            n = self._socket.recv_into(view)
+            if n == 0:
+                raise ConnectionResetError("Connection closed")
+            view = view[n:]
+
+    def read(self):
+        """Reads one frame
+
+        The payload is a view into the reader's buffer, and is only valid until the next read.
+
+        :return: Request id and payload
+        :rtype: tuple"""
+        self._read_into(self._view[:HEADER.size])
+        request_id, length = HEADER.unpack_from(self._buffer)
+        _checked(length)
+
+        if length > len(self._buffer):
+            self._buffer = bytearray(length)
+            self._view = memoryview(self._buffer)
+
+        payload = self._view[:length]
+        self._read_into(payload)
+        return request_id, payload
+
+
+class FrameClient:
+    def __init__(self, sock):
+        """Sends requests and matches responses by request id, so requests can be pipelined
+
+        Frames read while waiting for another request are held until their request is received, up to MAX_PENDING
+        bytes. Beyond that the frames of the request holding the most are dropped, and receiving it fails.
+
+        :param socket sock: Socket connected to a server sender
+        :rtype: None"""
+        self._socket = sock
+        self._reader = FrameReader(sock)
+        self._ids = count(1)
+        self._responses = dict()  # Frames read while waiting for another request, request id -> deque
+        self._pending = 0  # Bytes in _responses
+        self._dropping = set()  # Cancelled streams, their frames are dropped until the empty frame
+        self._overflowed = set()  # Requests whose frames were dropped for MAX_PENDING
+        self._send_lock = Lock()
+        self._receive_lock = Lock()
+
+    def send(self, payload):
+        """Sends request without waiting for the response
+
+        :param bytes payload: Request
+        :return: Request id to pass to receive
+        :rtype: int"""
+        with self._send_lock:
+            request_id = next(self._ids)
+            send_frame(self._socket, payload, request_id)
+        return request_id
+
+    def _discard(self, request_id):
+        """Drops the frames held for a request, receive lock must be held
+
+        :param int request_id: Id returned by send
+        :rtype: None"""
+        frames = self._responses.pop(request_id, ())
+        self._pending -= sum(len(frame) for frame in frames)
+
+    def _hold(self, request_id, frame):
+        """Keeps a frame for the request it belongs to, receive lock must be held
+
+        :param int request_id: Id the frame came with
+        :param bytes frame: Payload
+        :rtype: None"""
+        if request_id in self._dropping:
+            if not frame:  # End of the cancelled stream
+                self._dropping.discard(request_id)
+            return
+
+        self._responses.setdefault(request_id, deque()).append(frame)
+        self._pending += len(frame)
+        while self._pending > MAX_PENDING:  # Nobody is receiving the biggest, most likely an abandoned stream
+            victim = max(self._responses, key=lambda rid: sum(len(f) for f in self._responses[rid]))
+            self._discard(victim)
+            self._overflowed.add(victim)
+            self._dropping.add(victim)
+
+    def receive(self, request_id):
+        """Waits for the response to a request
+
+        :param int request_id: Id returned by send
+        :return: Response
+        :rtype: bytes"""
+        while True:  # The lock is let go after every frame, so threads waiting for other requests get theirs
+            with self._receive_lock:
+                if request_id in self._overflowed:
+                    self._overflowed.discard(request_id)
+                    raise ValueError(f"Frames of request {request_id} were dropped, over {MAX_PENDING} bytes waited")
+                frames = self._responses.get(request_id)
+                if frames:
+                    if len(frames) == 1:
+                        del self._responses[request_id]
+                    frame = frames.popleft()
+                    self._pending -= len(frame)
+                    return frame
+                rid, payload = self._reader.read()
+                self._hold(rid, bytes(payload))
+
+    def cancel(self, request_id):
+        """Drops the frames of a stream that were read and that are still to come, when nobody will receive them
+
+        :param int request_id: Id returned by send
+        :rtype: None"""
+        with self._receive_lock:
+            frames = self._responses.get(request_id, ())
+            ended = any(not frame or frame == b'error' for frame in frames)
+            self._discard(request_id)
+            self._overflowed.discard(request_id)
+            if not ended:
+                self._dropping.add(request_id)
+
+    def stream(self, payload):
+        """Sends a request answered in several frames, and yields them as they arrive, until the empty frame
+
+        A request the server rejects is answered with one b'error' frame, which is yielded and ends the stream. If
+        the iterator is closed before the end, the rest of the stream is dropped as it arrives.
+
+        :param bytes payload: Request
+        :return: Iterator of frames
+        :rtype: iterator"""
+        request_id = self.send(payload)
+        ended = False
+        try:
+            frame = self.receive(request_id)
+            while frame:
+                yield frame
+                if frame == b'error':
+                    ended = True
+                    return
+                frame = self.receive(request_id)
+            ended = True
+        finally:
+            if not ended:
+                self.cancel(request_id)
+
+    def upload(self, payload, frames):
+        """Sends a request followed by frames with its id and an empty frame, then waits for the response
+
+        :param bytes payload: Request
+        :param frames: Iterable of payloads, sent as they are produced
+        :return: Response
+        :rtype: bytes"""
+        request_id = self.send(payload)
+        for frame in frames:
+            with self._send_lock:
+                send_frame(self._socket, frame, request_id)
+        with self._send_lock:
+            send_frame(self._socket, b'', request_id)
+        return self.receive(request_id)
+
+    def request(self, payload):
+        """Sends request and waits for the response
+
+        :param bytes payload: Request
+        :return: Response
+        :rtype: bytes"""
+        return self.receive(self.send(payload))
+
+
+async def read_frame(reader):
+    """Reads one frame from an asyncio stream
+
+    :param asyncio.StreamReader reader: Stream to read from
+    :return: Request id and payload
+    :rtype: tuple"""
+    request_id, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return request_id, await reader.readexactly(_checked(length))
+
+
+async def write_frame(writer, payload, request_id=0):
+    """Writes payload with a length header to an asyncio stream
+
+    :param asyncio.StreamWriter writer: Stream to write to
+    :param bytes payload: Data to send
+    :param int request_id: Id of the request the frame belongs to
+    :rtype: None"""
+    writer.writelines((HEADER.pack(request_id, len(payload)), payload))
+    await writer.drain()
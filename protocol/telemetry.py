@@ -0,0 +1,114 @@
+import pickle
+import struct
+
+import numpy as np
+
+MAGIC = b'FM'
+VERSION = 1
+
+HEADER = struct.Struct('<2sBBHH')  # Magic, version, flags, record count, session (0 from stations without one)
+RECORD = np.dtype([('station_id', '<u4'), ('sequence', '<u4'), ('timestamp', '<f8'),
+                   ('temperature', '<f8'), ('rain', '<f8')])  # 32 bytes per reading
+
+MAX_DATAGRAM = 1400  # Keeps datagrams inside one ethernet frame
+MAX_RECORDS = (MAX_DATAGRAM - HEADER.size) // RECORD.itemsize
+
+# Flags
+RELIABLE = 1  # Station keeps the readings until they are acked, answer with an ack
+ACK = 2  # Ack from the server, see encode_ack
+
+ACK_BODY = struct.Struct('<II')  # Station id, next sequence expected (every one before it arrived or was given up)
+MAX_NACKS = (MAX_DATAGRAM - HEADER.size - ACK_BODY.size) // 4  # Missing sequences listed in one ack
+
+
+def encode(records, flags=0, session=0):
+    """Packs readings into one datagram
+
+    :param records: Structured array with dtype RECORD, or iterable of (station_id, sequence, timestamp, temperature,
+        rain) tuples
+    :param int flags: RELIABLE to ask for acks
+    :param int session: Id of the station's run, sequences start over in a new session
+    :return: Datagram
+    :rtype: bytes"""
+    if isinstance(records, np.ndarray):
+        records = records.astype(RECORD, copy=False)
+    else:
+        records = np.array(records, RECORD)
+    return HEADER.pack(MAGIC, VERSION, flags, len(records), session) + records.tobytes()
+
+
+def decode(data):
+    """Unpacks every reading in a datagram in one call
+
+    :param bytes data: Datagram
+    :return: Structured array with dtype RECORD, a view into data
+    :rtype: np.ndarray"""
+    if len(data) < HEADER.size:
+        raise ValueError("Datagram shorter than header")
+    magic, version, flags, count, _ = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or flags & ACK:
+        raise ValueError(f"Unknown telemetry format {magic!r} v{version}")
+    if len(data) != HEADER.size + count * RECORD.itemsize:
+        raise ValueError("Datagram length does not match record count")
+    return np.frombuffer(data, RECORD, count, HEADER.size)
+
+
+def options(data):
+    """Reads the flags and session of a datagram decode accepted
+
+    :param bytes data: Datagram
+    :return: Flags and session
+    :rtype: tuple"""
+    _, _, flags, _, session = HEADER.unpack_from(data)
+    return flags, session
+
+
+def encode_ack(station_id, session, expected, missing=()):
+    """Packs an ack for a station's readings
+
+    :param int station_id: Station the ack is for
+    :param int session: Session of the readings
+    :param int expected: Next sequence expected, every reading before it can be forgotten
+    :param missing: Sequences after expected that didn't arrive, the first MAX_NACKS are sent
+    :return: Datagram
+    :rtype: bytes"""
+    missing = np.asarray(missing[:MAX_NACKS], '<u4')
+    return HEADER.pack(MAGIC, VERSION, ACK, len(missing), session) + ACK_BODY.pack(station_id, expected) + \
+        missing.tobytes()
+
+
+def decode_ack(data):
+    """Unpacks an ack
+
+    :param bytes data: Datagram
+    :return: Station id, session, next sequence expected, and array of missing sequences
+    :rtype: tuple"""
+    if len(data) < HEADER.size + ACK_BODY.size:
+        raise ValueError("Datagram shorter than an ack")
+    magic, version, flags, count, session = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or not flags & ACK:
+        raise ValueError("Not an ack")
+    if len(data) != HEADER.size + ACK_BODY.size + count * 4:
+        raise ValueError("Ack length does not match count")
+    station_id, expected = ACK_BODY.unpack_from(data, HEADER.size)
+    return station_id, session, expected, np.frombuffer(data, '<u4', count, HEADER.size + ACK_BODY.size)
+
+
+def is_binary(data):
+    """Checks if datagram uses this format, and not legacy pickles
+
+    :param bytes data: Datagram
+    :rtype: bool"""
+    return data[:2] == MAGIC
+
+
+def decode_legacy(data):
+    """Unpacks a legacy datagram, a pickled (station_id, temperature, rain) tuple
+
+    Only use this for trusted stations, unpickling runs arbitrary code.
+
+    :param bytes data: Datagram
+    :return: Structured array with dtype RECORD, with sequence 0 and timestamp NaN
+    :rtype: np.ndarray"""
+    station_id, temperature, rain = pickle.loads(data)
+    return np.array([(station_id, 0, np.nan, temperature, rain)], RECORD)
@@ -1,29 +1,52 @@
+from protocol.framing import HANDSHAKES
 from server.receiver import Receiver
 from server.sender import Sender
 from server.database import Database
-from socket import socket, AF_INET, SOCK_STREAM, SOCK_DGRAM
+from server.aio import AsyncServer
+from server.workers import WorkerPool
+from socket import socket, AF_INET, SOCK_STREAM
 from threading import Thread
 import pickle
 
 
 class Server:
-    def __init__(self, address=("localhost", 5005), database_name='StationData'):
+    def __init__(self, address=("localhost", 5005), database_name='StationData', batch_size=256, flush_interval=0.5,
+                 synchronous='NORMAL', legacy=False, workers=0, hot_capacity=0):
         """Initiates a server with udp receiver and tcp sender
 
         :param tuple address: address to receive request on
         :param str database_name: name of database to connect to
+        :param int batch_size: Amount of readings buffered before they are written, 1 writes every reading at once
+        :param float flush_interval: Max seconds a reading is buffered before it is written
+        :param str synchronous: SQLite synchronous level, 'FULL', 'NORMAL' or 'OFF'
+        :param bool legacy: Also accept pickled readings from old stations, only for trusted networks
+        :param int workers: Ingest processes sharing one UDP port, 0 to receive from every station on one thread
+        :param int hot_capacity: Latest readings per station kept in memory for recent reads, 0 for none
         :rtype: None"""
+        self._legacy = legacy
         self._senders = list()
-        self._receivers = list()
-        self._database = Database(database_name)
+        self._database = Database(database_name, batch_size, flush_interval, synchronous, hot_capacity=hot_capacity)
         self._sock = socket(AF_INET, SOCK_STREAM)
-        self._address = address
         self._sock.bind(address)
+        self._address = self._sock.getsockname()  # Resolves port 0 to the port picked by the OS
+
+        # Stations send to the UDP port with the same number as the server
+        self._workers = None
+        self._receiver = None
+        if workers > 0:
+            self._workers = WorkerPool(self._address, self._database, workers, legacy, batch_size, flush_interval)
+        else:
+            self._receiver = Receiver(self._address, self._database, legacy)
 
     def start(self):
         """Starts the server's receiver and sender
 
         :rtype: None"""
+        self._sock.listen()  # Listen before returning, so clients can connect right away
+        if self._workers is not None:
+            self._workers.start()
+        else:
+            self._receiver.start()
         Thread(target=self.connect).start()
 
     def stop(self):
@@ -33,11 +56,12 @@ class Server:
         for addr in self._senders:
             addr.stop()
 
-        for addr in self._receivers:
-            with socket(AF_INET, SOCK_DGRAM) as sock:
-                sock.sendto(b'exit', addr.address)
-            addr.stop()
+        if self._workers is not None:
+            self._workers.stop()
+        else:
+            self._receiver.stop()
 
+        self._database.flush()  # Write readings still waiting in the ingest buffer
         self._database.close()
 
         with socket(AF_INET, SOCK_STREAM) as s:
@@ -52,20 +76,19 @@ class Server:
 
         :return: Address of sender started
         :rtype: tuple"""
-        send = Sender(conn, self._database)
+        send = Sender(conn, self._database, self._workers)
         send.start()
         self._senders.append(send)
         return send.address
 
     def open_receiver(self):
-        """Opens receiver that receives data from stations
+        """Address stations send data to, the same for every station
 
-        :return: Address of receiver started
+        :return: Address of the receiver or of the workers
         :rtype: tuple"""
-        rec = Receiver(("localhost", 0), self._database)
-        rec.start()
-        self._receivers.append(rec)
-        return rec.address
+        if self._workers is not None:
+            return self._workers.address
+        return self._receiver.address
 
     def close_sender(self, address):
         """Closes sender with given address
@@ -77,15 +100,20 @@ class Server:
                 add.stop()
                 self._senders.remove(add)
 
-    def close_receiver(self, address):
-        """Closes receiver with given address
-
-        :param tuple address: Address of receiver to close
-        :rtype: None"""
-        for add in self._receivers:
-            if add.address == address:
-                add.stop()
-                self._receivers.remove(add)
+    @staticmethod
+    def _read_handshake(conn):
+        """Reads the handshake exactly, so that requests sent right after it are left for the sender
+
+        :param socket conn: Accepted connection
+        :return: The handshake, 'gib', 'take' or 'exit'
+        :rtype: bytes"""
+        data = b''
+        while data not in HANDSHAKES and len(data) < max(len(h) for h in HANDSHAKES):
+            byte = conn.recv(1)
+            if not byte:
+                break
+            data += byte
+        return data
 
     def connect(self):
         """Constantly accepts requests for senders and receivers
@@ -94,7 +122,7 @@ class Server:
         while True:
             self._sock.listen()
             conn, addr = self._sock.accept()
-            data = conn.recv(1024)
+            data = self._read_handshake(conn)
             if data.decode() == 'exit':
                 print("SERVER: Received stop-signal.")
                 self._sock.close()
@@ -104,15 +132,15 @@ class Server:
                 print(f"SERVER: Creating sender for {addr}.")
                 self.open_sender(conn)
             elif data.decode() == 'take':
-                print(f"SERVER: Creating receiver for {addr}.")
                 conn.send(pickle.dumps(self.open_receiver()))
+                conn.close()
 
     def get_index(self):
         """Returns highest index in database
 
         :return: Highest index in database
         :rtype: int"""
-        return self._database.get_count()
+        return self._database.get_index()
 
     @property
     def address(self):
@@ -123,4 +151,4 @@ class Server:
         return self._address
 
 
-__all__ = ['Server']  # Overwrites from server import *
+__all__ = ['Server', 'AsyncServer']  # Overwrites from server import *
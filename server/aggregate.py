@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def bucket(columns, points):
+    """Splits a station's rows into at most points buckets of consecutive rows, and aggregates each bucket
+
+    :param dict columns: Column arrays of one station, as returned by Database.read_columns
+    :param int points: Max amount of buckets
+    :return: Arrays with one value per bucket: data_index (first row), count, and min, mean, max and sum of
+        temperature and precipitation
+    :rtype: dict"""
+    rows = len(columns['data_index'])
+    if rows:
+        starts = np.unique(np.linspace(0, rows, min(points, rows) + 1, dtype=np.int64)[:-1])
+    else:
+        starts = np.empty(0, np.int64)
+    count = np.diff(np.append(starts, rows))
+
+    result = {'data_index': columns['data_index'][starts], 'count': count}
+    for name in ('temperature', 'precipitation'):
+        values = columns[name]
+        if rows:
+            total = np.add.reduceat(values, starts)
+            result[name + '_min'] = np.minimum.reduceat(values, starts)
+            result[name + '_max'] = np.maximum.reduceat(values, starts)
+        else:
+            total = result[name + '_min'] = result[name + '_max'] = np.empty(0)
+        result[name + '_mean'] = total / np.maximum(count, 1)
+        result[name + '_sum'] = total
+    return result
+
+
+def lttb(x, y, points):
+    """Largest-Triangle-Three-Buckets downsampling, keeps the points that preserve the shape of a line plot
+
+    :param np.ndarray x: X values, increasing
+    :param np.ndarray y: Y values
+    :param int points: Amount of points to keep
+    :return: Indices of the points kept
+    :rtype: np.ndarray"""
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:  # Too few points for triangles, spread them evenly
+        return np.linspace(0, n - 1, points, dtype=np.int64)
+
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)  # Buckets between the fixed first and last point
+    kept = np.empty(points, np.int64)
+    kept[0], kept[-1] = 0, n - 1
+
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        following = slice(end, edges[i + 2]) if i + 2 < len(edges) else slice(n - 1, n)
+        cx, cy = x[following].mean(), y[following].mean()  # Average of the next bucket
+
+        # Keep the point in this bucket forming the largest triangle with the last kept point and the next average
+        area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def downsample(columns, points):
+    """Downsamples a station's rows for plotting, keeping the LTTB points of both temperature and precipitation
+
+    :param dict columns: Column arrays of one station, as returned by Database.read_columns
+    :param int points: Points to keep per series, the result has at most twice as many rows
+    :return: Column arrays with the rows kept
+    :rtype: dict"""
+    x = columns['data_index']
+    kept = np.union1d(lttb(x, columns['temperature'], points), lttb(x, columns['precipitation'], points))
+    return {name: values[kept] for name, values in columns.items()}
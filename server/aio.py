@@ -0,0 +1,379 @@
+import asyncio
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from queue import Queue
+from socket import socket, AF_INET, SOCK_STREAM, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF
+from threading import Event, Thread
+
+import numpy as np
+
+from protocol import columnar
+from protocol.framing import HANDSHAKES, read_frame, write_frame
+from server.database import Database
+from server.receiver import RECEIVE_BUFFER, Decoder
+from server.sender import IMPORT_BACKLOG, PUSH_BACKLOG, Sender, _encoded
+
+
+async def _new_queue():
+    """Makes an asyncio.Queue on the running loop, Python 3.8 binds it to the loop of the thread making it
+
+    :rtype: asyncio.Queue"""
+    return asyncio.Queue()
+
+
+class _StreamSender(Sender):
+    def __init__(self, reader, writer, database, executor, slots):
+        """Sender serving one FMI client over asyncio streams
+
+        :param asyncio.StreamReader reader: Stream requests arrive on
+        :param asyncio.StreamWriter writer: Stream responses are written to
+        :param Database database: The database to send from
+        :param ThreadPoolExecutor executor: Executor database work runs on
+        :param asyncio.Semaphore slots: Bounds database work queued on the executor
+        :rtype: None"""
+        super().__init__(None, database)
+        self._reader = reader
+        self._writer = writer
+        self._executor = executor
+        self._slots = slots
+        self._loop = None
+
+    async def serve(self):
+        """Answers requests until the client exits or disconnects
+
+        :rtype: None"""
+        loop = self._loop = asyncio.get_running_loop()
+        try:
+            while not self._shut_down.is_set():
+                try:
+                    request_id, data = await read_frame(self._reader)
+                except (asyncio.IncompleteReadError, ConnectionResetError):
+                    break
+
+                if request_id in self._imports:  # Chunk of an import, not a request
+                    await loop.run_in_executor(None, self._chunk, request_id, data)
+                    continue
+
+                async with self._slots:
+                    resp = await loop.run_in_executor(self._executor, self._answer, data.decode(), request_id)
+                if resp == b'exit':
+                    self.stop()
+                elif resp is not None:
+                    await write_frame(self._writer, resp, request_id)
+        finally:  # Also when the server cancels the connection, so no listener outlives it
+            self._unsubscribe()
+            await loop.run_in_executor(None, self._abort_imports)
+            self._writer.close()
+
+    def _stream(self, chunks, request_id):
+        """Starts sending a streamed read, from a task on the event loop
+
+        :param chunks: Iterator of station_id -> column arrays, from Database.read_chunks
+        :param int request_id: Id to send the chunks with
+        :rtype: None"""
+        asyncio.run_coroutine_threadsafe(self._streamer(chunks, request_id), self._loop)
+
+    async def _streamer(self, chunks, request_id):
+        """Sends chunks as they are read on the executor, then an empty frame, or b'error' if reading fails
+
+        :param chunks: Iterator of station_id -> column arrays
+        :param int request_id: Id to send the chunks with
+        :rtype: None"""
+        payloads = _encoded(chunks)
+        try:
+            while True:
+                async with self._slots:
+                    payload = await self._loop.run_in_executor(self._executor, next, payloads, None)
+                if payload is None:
+                    break
+                await write_frame(self._writer, payload, request_id)  # Waits for the client to make room
+        except ConnectionError:  # Client is gone, serve cleans up
+            pass
+        finally:
+            payloads.close()
+            chunks.close()
+
+    def _import(self, request_id):
+        """Starts loading the chunks the client sends next with this request's id, answering from the event loop
+
+        :param int request_id: Id of the import request
+        :rtype: None"""
+        chunks = self._imports[request_id] = Queue(IMPORT_BACKLOG)
+        asyncio.run_coroutine_threadsafe(self._importer(chunks, request_id), self._loop)
+
+    async def _importer(self, chunks, request_id):
+        """Loads an import on a thread of its own, then answers its request
+
+        :param Queue chunks: Payloads of the import's frames
+        :param int request_id: Id of the import request
+        :rtype: None"""
+        # Not the executor, it may take long
+        resp = await self._loop.run_in_executor(None, self._load, chunks, request_id)
+        if resp is not None:
+            try:
+                await write_frame(self._writer, resp, request_id)
+            except ConnectionError:
+                pass
+
+    def _subscribe(self, request_id):
+        """Starts pushing new readings to the client, from a task on the event loop
+
+        :param int request_id: Id to send the readings with
+        :rtype: None"""
+        if self._subscription is None:
+            # Made on the loop, this runs on the executor. Length checked in _enqueue, so the stop signal always fits.
+            pushes = asyncio.run_coroutine_threadsafe(_new_queue(), self._loop).result()
+            self._subscription = partial(self._push, pushes), pushes
+            asyncio.run_coroutine_threadsafe(self._pusher(pushes, request_id), self._loop)
+            self._database.subscribe(self._subscription[0])
+
+    def _unsubscribe(self):
+        """Stops pushing new readings
+
+        :rtype: None"""
+        if self._subscription is not None:
+            push, pushes = self._subscription
+            self._database.unsubscribe(push)
+            self._subscription = None
+            self._loop.call_soon_threadsafe(pushes.put_nowait, None)
+
+    def _push(self, pushes, columns):
+        """Database listener, hands new readings to the event loop
+
+        :param asyncio.Queue pushes: Queue of the subscription
+        :param dict columns: station_id -> column arrays of the new rows
+        :rtype: None"""
+        try:
+            self._loop.call_soon_threadsafe(self._enqueue, pushes, columns)
+        except RuntimeError:  # Loop is closed, the server stopped
+            pass
+
+    @staticmethod
+    def _enqueue(pushes, columns):
+        if pushes.qsize() < PUSH_BACKLOG:  # Else the client can't keep up, and can catch up with get-columns
+            pushes.put_nowait(columns)
+
+    async def _pusher(self, pushes, request_id):
+        """Sends queued readings to the client until unsubscribed
+
+        :param asyncio.Queue pushes: Queue of the subscription
+        :param int request_id: Id of the subscription, to send the readings with
+        :rtype: None"""
+        columns = await pushes.get()
+        while columns is not None:
+            try:
+                await write_frame(self._writer, columnar.encode(columns), request_id)
+            except ConnectionError:  # Client is gone, serve cleans up
+                pass
+            columns = await pushes.get()
+
+    @property
+    def address(self):
+        """Address sender is on
+
+        :return: Address of sender (address, port)
+        :rtype: tuple"""
+        return self._writer.get_extra_info('sockname')
+
+
+class _IngestProtocol(asyncio.DatagramProtocol):
+    def __init__(self, database, executor, max_writes, legacy=False):
+        """Receives readings from every station on one UDP endpoint
+
+        Readings that arrive in the same loop iteration are written as one batch. Reliable stations are acked once
+        their readings are committed.
+
+        :param Database database: The database to write to
+        :param ThreadPoolExecutor executor: Executor writes run on
+        :param int max_writes: Max batches being written at once, later readings wait in the buffer
+        :param bool legacy: Also accept pickled readings from old stations
+        :rtype: None"""
+        self._database = database
+        self._decoder = Decoder(legacy)
+        self._transport = None
+        self._loop = None
+        self._executor = executor
+        self._max_writes = max_writes
+        self._rows = []
+        self._acks = []  # (ack, address) of the buffered readings
+        self._writing = 0
+        self._scheduled = False
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._loop = asyncio.get_running_loop()
+
+    def datagram_received(self, data, addr):
+        if data == b'exit':
+            return
+
+        records, acks = self._decoder.decode(data)
+        if records is None:
+            return
+
+        self._rows.append(records)  # Even if every reading is a duplicate, its acks wait for the write
+        self._acks.extend((ack, addr) for ack in acks)
+        if not self._scheduled:
+            self._scheduled = True
+            self._loop.call_soon(self._write)
+
+    def _write(self):
+        """Hands buffered readings to the executor
+
+        :rtype: None"""
+        self._scheduled = False
+        if not self._rows or self._writing >= self._max_writes:
+            return
+
+        rows, self._rows = self._rows, []
+        acks, self._acks = self._acks, []
+        records = np.concatenate(rows)
+        self._writing += 1
+        future = self._loop.run_in_executor(self._executor, self._database.write_records, records,
+                                            partial(self._done, records=records, acks=acks) if acks else None)
+        future.add_done_callback(self._written)
+
+    def _done(self, committed, records, acks):
+        """Database callback, answers the readings on the event loop
+
+        :param bool committed: If the readings were committed
+        :param np.ndarray records: The readings
+        :param list acks: (ack, address) pairs of the datagrams they came in
+        :rtype: None"""
+        try:
+            self._loop.call_soon_threadsafe(self._decoder.done, committed, records, acks, self._transport.sendto)
+        except RuntimeError:  # The loop is closed, stations send the readings again
+            pass
+
+    def _written(self, future):
+        self._writing -= 1
+        if not future.cancelled() and future.exception() is not None:  # Not acked, the stations send them again
+            print(f"SERVER: Writing readings failed: '{future.exception()}'")
+        if self._rows and not self._scheduled:  # Readings arrived while all writers were busy
+            self._scheduled = True
+            self._loop.call_soon(self._write)
+
+
+class AsyncServer:
+    def __init__(self, address=("localhost", 5005), database_name='StationData', batch_size=256, flush_interval=0.5,
+                 synchronous='NORMAL', legacy=False, db_workers=4, hot_capacity=0):
+        """Initiates a server that serves all stations and FMI clients from one asyncio event loop
+
+        Stations share one UDP endpoint on the same port as the TCP handshake socket. The handshakes are the same
+        as for Server: 'take' returns the ingest address, 'gib' turns the connection into a sender.
+
+        :param tuple address: address to receive request on
+        :param str database_name: name of database to connect to
+        :param int batch_size: Amount of readings buffered before they are written
+        :param float flush_interval: Max seconds a reading is buffered before it is written
+        :param str synchronous: SQLite synchronous level, 'FULL', 'NORMAL' or 'OFF'
+        :param bool legacy: Also accept pickled readings from old stations, only for trusted networks
+        :param int db_workers: Threads doing database work, requests beyond that wait on the loop
+        :param int hot_capacity: Latest readings per station kept in memory for recent reads, 0 for none
+        :rtype: None"""
+        self._database = Database(database_name, batch_size, flush_interval, synchronous, hot_capacity=hot_capacity)
+        self._executor = ThreadPoolExecutor(max_workers=db_workers)
+        self._db_workers = db_workers
+        self._legacy = legacy
+
+        self._sock = socket(AF_INET, SOCK_STREAM)
+        self._sock.bind(address)
+        self._address = self._sock.getsockname()
+
+        self._udp = socket(AF_INET, SOCK_DGRAM)
+        self._udp.setsockopt(SOL_SOCKET, SO_RCVBUF, RECEIVE_BUFFER)  # One buffer has to absorb bursts from everyone
+        self._udp.bind(self._address)  # Same port as the handshake socket
+
+        self._loop = asyncio.new_event_loop()
+        self._started = Event()
+        self._stopped = None  # asyncio.Event, created on the loop
+        self._thread = Thread(target=self._loop.run_until_complete, args=(self._serve(),))
+
+    async def _serve(self):
+        """Serves handshakes, senders and ingest until stopped
+
+        :rtype: None"""
+        self._stopped = asyncio.Event()
+        slots = asyncio.Semaphore(self._db_workers * 2)
+        server = await asyncio.start_server(lambda r, w: self._handle(r, w, slots), sock=self._sock)
+        transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _IngestProtocol(self._database, self._executor, self._db_workers, self._legacy), sock=self._udp)
+        self._started.set()
+
+        await self._stopped.wait()
+        print("SERVER: Received stop-signal.")
+        transport.close()
+        server.close()
+
+        # Drop connections that are still open
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle(self, reader, writer, slots):
+        """Reads the handshake and serves the connection
+
+        :param asyncio.StreamReader reader: Incoming stream
+        :param asyncio.StreamWriter writer: Outgoing stream
+        :param asyncio.Semaphore slots: Bounds database work queued on the executor
+        :rtype: None"""
+        data = b''
+        while data not in HANDSHAKES and len(data) < max(len(h) for h in HANDSHAKES):
+            byte = await reader.read(1)
+            if not byte:
+                break
+            data += byte
+
+        addr = writer.get_extra_info('peername')
+        if data == b'exit':
+            self._stopped.set()
+            writer.close()
+        elif data == b'gib':
+            print(f"SERVER: Creating sender for {addr}.")
+            try:
+                await _StreamSender(reader, writer, self._database, self._executor, slots).serve()
+            except asyncio.CancelledError:  # Server is stopping
+                writer.close()
+        elif data == b'take':
+            print(f"SERVER: Sending ingest address to {addr}.")
+            writer.write(pickle.dumps(self._address))
+            await writer.drain()
+            writer.close()
+        else:
+            writer.close()
+
+    def start(self):
+        """Starts the event loop on a separate thread
+
+        :rtype: None"""
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        """Stops the server, and writes buffered readings
+
+        :rtype: None"""
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join()
+        self._executor.shutdown()
+
+        self._database.flush()  # Write readings still waiting in the ingest buffer, before listeners lose the loop
+        self._loop.close()
+        self._database.close()
+
+    def get_index(self):
+        """Returns highest index in database
+
+        :return: Highest index in database
+        :rtype: int"""
+        return self._database.get_index()
+
+    @property
+    def address(self):
+        """returns address that server uses to handle requests
+
+        :return: Address (IP, PORT) of request handler
+        :rtype: tuple"""
+        return self._address
@@ -1,12 +1,146 @@
+import os
 import sqlite3
-from threading import Lock
+import tempfile
+from contextlib import contextmanager
+from itertools import chain, islice, repeat
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import perf_counter, time
+from urllib.parse import quote
+
+import numpy as np
+
+from server import aggregate, hot, partition, rollup
+from server.metrics import REGISTRY, SIZE_BUCKETS
+
+MAINTENANCE_INTERVAL = 60  # Seconds between checks for partitions to seal, downsample or drop
+PURGE_BATCH = 10000  # Sealed rows deleted from station_data per transaction, so writes get the lock in between
+STREAM_CHUNK = 65536  # Rows per chunk of a streamed read
+
+ROWS = REGISTRY.counter('database_rows_inserted_total', 'Readings written to station_data')
+BATCH_ROWS = REGISTRY.histogram('database_batch_rows', 'Readings per flushed transaction', SIZE_BUCKETS)
+FLUSH_SECONDS = REGISTRY.histogram('database_flush_seconds', 'Time to write and commit a batch')
+# Only waits are timed, a lock that is free costs nothing extra
+WRITE_LOCK_WAIT = REGISTRY.histogram('database_lock_wait_seconds', 'Time waited for a busy lock', lock='write')
+READER_WAIT = REGISTRY.histogram('database_lock_wait_seconds', 'Time waited for a busy lock', lock='reader')
+HOT_READS = REGISTRY.counter('database_hot_reads_total', 'Reads answered from the hot tier')
+HOT_MISSES = REGISTRY.counter('database_hot_misses_total', 'Reads reaching past the hot tier, answered by SQLite')
+
+# Schema changes, _MIGRATIONS[n] takes a database from PRAGMA user_version n to n + 1. New databases are created with
+# the first table and run all of them, so every database ends up with the same schema.
+_MIGRATIONS = (
+    # Ingest and measurement time of each reading. Rows from before are left without, they have neither.
+    # The index covers per-station time ranges, they are read from the index alone in time order.
+    ("ALTER TABLE station_data ADD COLUMN ingest_ts FLOAT;",
+     "ALTER TABLE station_data ADD COLUMN measured_ts FLOAT;",
+     "CREATE INDEX station_data_station_ts ON station_data (station_id, measured_ts, temperature, precipitation);"),
+    # Catalog of time partitions, see server.partition
+    (partition.CATALOG,),
+)
+
+
+def _acquire(lock):
+    """Acquires the write lock, timing the wait if another thread holds it
+
+    :param Lock lock: Lock to acquire, the caller releases it
+    :rtype: None"""
+    if not lock.acquire(False):
+        start = perf_counter()
+        lock.acquire()
+        WRITE_LOCK_WAIT.observe(perf_counter() - start)
+
+
+def _by_station(index, station, temp, rain, timestamp=None):
+    """Groups rows into contiguous column arrays per station, keeping them in the order given within each station
+
+    :param np.ndarray index: data_index of each row
+    :param np.ndarray station: station_id of each row
+    :param np.ndarray temp: Temperature of each row
+    :param np.ndarray rain: Precipitation of each row
+    :param np.ndarray timestamp: Measurement time of each row, None to leave out
+    :return: station_id -> dict of 'data_index', 'station_id', 'temperature' and 'precipitation' arrays, and
+        'timestamp' if given
+    :rtype: dict"""
+    order = np.argsort(station, kind='stable')
+    index, station, temp, rain = index[order].astype(np.int64), station[order].astype(np.int64), \
+        temp[order], rain[order]
+    ids, starts = np.unique(station, return_index=True)
+    bounds = list(starts[1:]) + [len(station)]
+
+    stations = {int(station_id): {'data_index': index[a:b], 'station_id': station[a:b],
+                                  'temperature': temp[a:b], 'precipitation': rain[a:b]}
+                for station_id, a, b in zip(ids, starts, bounds)}
+    if timestamp is not None:
+        timestamp = timestamp[order]
+        for (station_id, columns), a, b in zip(stations.items(), starts, bounds):
+            columns['timestamp'] = timestamp[a:b]
+    return stations
+
+
+def _stage(chunks):
+    """Writes the chunks of a load to a temporary file, each in the order of its indexes, without holding a lock
+
+    :param chunks: Iterable of station_id -> column arrays, see load
+    :return: The file, at its start, and the chunks in it
+    :rtype: tuple"""
+    staged = tempfile.TemporaryFile()
+    count = 0
+    try:
+        for stations in chunks:
+            if not stations:
+                continue
+            # Back in the order they were stored in, from per station
+            index, station, temp, rain, measured = (
+                np.concatenate([columns[name] for columns in stations.values()])
+                for name in ('data_index', 'station_id', 'temperature', 'precipitation', 'timestamp'))
+            order = np.argsort(index, kind='stable')
+            for array in (station[order].astype(np.int64), temp[order].astype(np.float64),
+                          rain[order].astype(np.float64), measured[order].astype(np.float64)):
+                np.save(staged, array, allow_pickle=False)
+            count += 1
+    except BaseException:
+        staged.close()
+        raise
+    staged.seek(0)
+    return staged, count
 
 
 class Database:
-    def __init__(self, database):
+    def __init__(self, database, batch_size=256, flush_interval=0.5, synchronous='NORMAL', readers=4,
+                 partition_seconds=86400, retention=None, coarse_resolution=3600, coarse_retention=None,
+                 hot_capacity=0, hot_stations=1024, hot_mapped=False):
         """Starts the database with the given name
 
+        Writes are buffered in memory and flushed to the table in one transaction once batch_size rows are waiting,
+        or flush_interval seconds after the first of them arrived, whichever comes first. A batch_size of 1 commits
+        every row on its own (the old behaviour).
+
+        Reads run on a pool of read-only connections, so they don't hold up writes. Each read sees a consistent
+        snapshot of the database, including every row written before it started.
+
+        New readings go to station_data. Once the partition_seconds period they arrived in is over, they are moved to
+        a partition file of their own next to the database (<database>.partitions), compacted and made read-only.
+        Reads fan out over the partitions that overlap the rows asked for. Partitions older than retention are
+        replaced by a downsampled partition with the mean per coarse_resolution seconds, and dropped after
+        coarse_retention, by deleting the file. Rollups keep counting dropped readings.
+
+        With hot_capacity, the last hot_capacity readings of each station are also kept in memory (see server.hot), and
+        reads of recent windows are answered from there without SQLite. Retention should be longer than the window the
+        hot tier holds.
+
         :param str database: name of database
+        :param int batch_size: Amount of buffered rows that triggers a flush
+        :param float flush_interval: Max seconds a buffered row waits before it is flushed, None to never time out
+        :param str synchronous: SQLite synchronous level, 'FULL', 'NORMAL' or 'OFF' (durability vs. latency)
+        :param int readers: Read-only connections, 0 to read on the writing connection
+        :param float partition_seconds: Seconds of arrivals per partition, None to keep everything in station_data
+        :param float retention: Seconds of measurements to keep at full resolution, None to keep them all
+        :param int coarse_resolution: Seconds per reading of downsampled partitions, None to drop expired readings
+        :param float coarse_retention: Seconds of measurements to keep downsampled, None to keep them all
+        :param int hot_capacity: Readings per station kept in the hot tier, 0 for no hot tier
+        :param int hot_stations: Stations the hot tier has room for, readings of others are read from SQLite
+        :param bool hot_mapped: Keep the hot tier in memory-mapped files next to the database (<database>.hot), so
+            it is still there after a restart
         :rtype: None
         """
         self._conn = sqlite3.connect(database, check_same_thread=False)  # Connects to database with name database
@@ -14,10 +148,74 @@ class Database:
 
         self._lock = Lock()
 
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._buffer = []  # Rows waiting to be flushed
+        self._done = []  # Called once the rows buffered with them are committed, see write_records
+        self._pending = Event()  # Set when the buffer holds rows
+        self._shut_down = Event()
+        self._listeners = []  # Called with every batch of new rows
+
+        self._path = database
+        self._directory = None  # Directory of the partition files, None if the database isn't partitioned
+        if partition_seconds is not None and database != ':memory:':
+            self._directory = database + '.partitions'
+        self._partition_seconds = partition_seconds
+        self._retention = retention
+        self._coarse_resolution = coarse_resolution
+        self._coarse_retention = coarse_retention
+        self._maintaining = Lock()  # Held while partitions are changed
+
+        self._cursor.execute("PRAGMA journal_mode=WAL;")  # Commits append to the log instead of rewriting pages
+        self._cursor.execute(f"PRAGMA synchronous={synchronous};")
+
         self._create_table()
 
+        self._readers = None  # Pool of read-only connections
+        if readers > 0 and database != ':memory:':  # An in-memory database can't be shared between connections
+            uri = f"file:{quote(os.path.abspath(database))}?mode=ro"
+            self._readers = Queue()
+            for _ in range(readers):
+                # Autocommit, so reads can control their own snapshot transaction
+                self._readers.put(sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None))
+
+        self._hot = None
+        if hot_capacity > 0:
+            directory = database + '.hot' if hot_mapped and database != ':memory:' else None
+            self._hot = hot.HotTier(hot_capacity, hot_stations, directory, self._next_index(), self.get_index() == 0)
+
+        if flush_interval is not None and self._batch_size > 1:
+            Thread(target=self._flusher, daemon=True).start()
+        if self._directory is not None:
+            Thread(target=self._maintainer, daemon=True).start()
+
+    def _next_index(self):
+        """Index the next row written will get, lock must be held or no other thread running
+
+        :rtype: int
+        """
+        self._cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'station_data';")
+        row = self._cursor.fetchone()
+        return (row[0] if row else 0) + 1
+
+    def _read_hot(self, read, *args):
+        """Reads from the hot tier, if there is one and it holds everything asked for
+
+        :param read: HotTier.read_index or HotTier.read_range, unbound
+        :param args: Arguments of read
+        :return: station_id -> column arrays, None to read from SQLite. Arrays of read_index are views into the rings,
+            overwritten once the station stores hot_capacity more readings.
+        :rtype: dict
+        """
+        if self._hot is None:
+            return None
+        self.flush()  # Readers should see everything written so far
+        stations = read(self._hot, *args)
+        (HOT_MISSES if stations is None else HOT_READS).inc()
+        return stations
+
     def _create_table(self):  # Creates database with cols
-        """Creates the database table if it doesn't exist
+        """Creates the database table if it doesn't exist, and migrates it to the current schema
 
         :rtype: None
         """
@@ -25,21 +223,295 @@ class Database:
             self._cursor.execute("CREATE TABLE IF NOT EXISTS station_data ("
                                  "data_index INTEGER PRIMARY KEY AUTOINCREMENT, temperature FLOAT NOT NULL,"
                                  "precipitation FLOAT NOT NULL,station_id INTEGER DEFAULT 0);")
+
+            self._cursor.execute("PRAGMA user_version;")
+            version = self._cursor.fetchone()[0]
+            for statements in _MIGRATIONS[version:]:
+                for statement in statements:
+                    self._cursor.execute(statement)
+            self._cursor.execute(f"PRAGMA user_version = {len(_MIGRATIONS)};")  # In the same transaction
+
+            if rollup.create_tables(self._cursor):  # Database from before rollups, count what is already there
+                rollup.rebuild(self._cursor, self._chunks(self._conn.cursor()))
             self._conn.commit()
 
-    def write(self, station_id, temperature, precipitation):
+    def _flush(self):
+        """Writes all buffered rows in one transaction, lock must be held
+
+        :rtype: None
+        """
+        if not self._buffer:
+            return
+
+        start = perf_counter()
+        rows, self._buffer = self._buffer, []
+        done, self._done = self._done, []
+        self._pending.clear()
+        try:
+            self._cursor.executemany("INSERT INTO station_data (temperature, precipitation, station_id, measured_ts, "
+                                     "ingest_ts) VALUES (?, ?, ?, ?, ?);", rows)
+
+            # Rows got consecutive indexes up to the table's sequence, there is no other writer
+            self._cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'station_data';")
+            last = self._cursor.fetchone()[0]
+            temp, rain, station, measured, _ = np.array(rows, np.float64).T
+            index = np.arange(last - len(rows) + 1, last + 1)
+            rollup.update(self._cursor, index, station.astype(np.int64), temp, rain, measured)
+
+            self._conn.commit()  # Rows and rollups in one transaction
+        except BaseException:
+            self._conn.rollback()
+            for callback in done:
+                callback(False)
+            raise
+        for callback in done:
+            callback(True)
+        if self._hot is not None:
+            self._hot.append(index, station.astype(np.int64), temp, rain, measured)
+        ROWS.inc(len(rows))
+        BATCH_ROWS.observe(len(rows))
+        FLUSH_SECONDS.observe(perf_counter() - start)
+
+        if self._listeners:
+            columns = _by_station(index, station, temp, rain, measured)
+            for listener in list(self._listeners):
+                listener(columns)
+
+    def _flusher(self):
+        """Flushes the buffer when rows have waited for flush_interval seconds
+
+        :rtype: None
+        """
+        while not self._shut_down.is_set():
+            self._pending.wait()  # Sleep until something is buffered
+            if self._shut_down.wait(self._flush_interval):
+                break
+            with self._lock:
+                try:
+                    self._flush()
+                except sqlite3.Error as e:  # The rows are dropped, callbacks of write_records were told
+                    print(f"DATABASE: Flush failed: '{e}'")
+
+    def _maintainer(self):
+        """Maintains the partitions every MAINTENANCE_INTERVAL seconds
+
+        :rtype: None
+        """
+        while not self._shut_down.wait(MAINTENANCE_INTERVAL):
+            try:
+                self.maintain()
+            except (sqlite3.Error, OSError) as e:  # Tried again next time
+                print(f"DATABASE: Partition maintenance failed: '{e}'")
+
+    def _chunks(self, cursor, size=1000000):
+        """Reads every reading at full resolution, in index order, as column arrays
+
+        :param sqlite3.Cursor cursor: Cursor to read station_data and the catalog with
+        :param int size: Rows per chunk
+        :return: Iterator of (data_index, station_id, temperature, precipitation, measured_ts) arrays
+        :rtype: iterator
+        """
+        rows = self._scan(cursor, "data_index, station_id, temperature, precipitation, measured_ts", "1", {},
+                          resolution=partition.RAW)
+        for chunk in iter(lambda: list(islice(rows, size)), []):
+            index, station, temp, rain, measured = np.array(chunk, np.float64).T  # NULL times become NaN
+            yield index.astype(np.int64), station.astype(np.int64), temp, rain, measured
+
+    def _scan(self, cursor, columns, where, params, order='', **ranges):
+        """Runs a query on the partitions that may hold rows for it, in index order, then on station_data
+
+        :param sqlite3.Cursor cursor: Cursor from _reading, the catalog and station_data are read in its snapshot
+        :param str columns: Columns to select
+        :param str where: Condition, with named parameters
+        :param dict params: Parameters of where
+        :param str order: ORDER BY clause, applied per partition
+        :param ranges: index_from, index_to, ts_from, ts_to and resolution of the partitions to read, see
+            partition.read_catalog
+        :return: Iterator of rows
+        :rtype: iterator
+        """
+        partitions = partition.read_catalog(cursor, **ranges)
+        cursor.execute("SELECT MAX(index_to) FROM partitions;")
+        sealed = cursor.fetchone()[0] or 0
+
+        query = f"SELECT {columns} FROM station_data WHERE {where}"
+        yield from partition.scan(self._directory, partitions, query + order + ';', params)
+        # Sealed rows may not have been purged from station_data yet
+        yield from cursor.execute(f"{query} AND data_index > :sealed{order};", dict(params, sealed=sealed))
+
+    @contextmanager
+    def _reading(self):
+        """Gives a cursor for reading, on a connection of its own
+
+        Everything buffered is written first, and the cursor reads from one snapshot until the block ends.
+
+        :rtype: sqlite3.Cursor
+        """
+        self.flush()  # Readers should see everything written so far
+
+        if self._readers is None:
+            with self._lock:
+                yield self._cursor
+            return
+
+        try:
+            conn = self._readers.get_nowait()
+        except Empty:  # Every reader is busy, wait for one
+            start = perf_counter()
+            conn = self._readers.get()
+            READER_WAIT.observe(perf_counter() - start)
+        try:
+            conn.execute("BEGIN;")  # Snapshot starts at the first read
+            yield conn.cursor()
+        finally:
+            conn.execute("COMMIT;")
+            self._readers.put(conn)
+
+    def _append(self, rows, done=None):
+        """Buffers rows, and flushes if the batch is full
+
+        :param rows: Iterable of (temperature, precipitation, station_id, measured_ts, ingest_ts)
+        :param done: Called with True once the rows are committed, with False if writing them failed
+        :rtype: None
+        """
+        _acquire(self._lock)
+        try:
+            self._buffer.extend(rows)
+            if done is not None:
+                self._done.append(done)
+            if len(self._buffer) >= self._batch_size:
+                self._flush()
+            elif self._buffer:
+                self._pending.set()
+            elif done is not None:  # No rows, and everything written before is committed
+                self._done = []
+                done(True)
+        finally:
+            self._lock.release()
+
+    def write(self, station_id, temperature, precipitation, timestamp=None):
         """
         Writes row to database
 
         :param int station_id: Id of station data comes from
         :param float temperature: Temperature reading
         :param float precipitation: Precipitation reading
+        :param float timestamp: Unix time the reading was measured, None for now
+        :rtype: None
+        """
+        self.write_many(((station_id, temperature, precipitation, timestamp),))
+
+    def write_many(self, rows):
+        """
+        Writes several rows to database
+
+        :param rows: Iterable of (station_id, temperature, precipitation) or
+            (station_id, temperature, precipitation, measured unix time)
+        :rtype: None
+        """
+        now = time()
+        self._append((temp, rain, station, now if not ts or ts[0] is None or ts[0] != ts[0] else ts[0], now)
+                     for station, temp, rain, *ts in rows)  # ts[0] != ts[0] for NaN
+
+    def write_records(self, records, done=None):
+        """
+        Writes decoded telemetry records to database
+
+        :param np.ndarray records: Structured array with station_id, timestamp, temperature and rain fields
+        :param done: Called with True once the records and every row written before them are committed, with False if
+            writing them failed. It runs while the write lock is held, it should only hand the result off.
+        :rtype: None
+        """
+        now = time()
+        measured = records['timestamp']
+        measured = np.where(np.isnan(measured), now, measured)  # Legacy stations don't send the time
+        self._append(zip(records['temperature'].tolist(), records['rain'].tolist(), records['station_id'].tolist(),
+                         measured.tolist(), repeat(now)), done)
+
+    def load(self, chunks):
+        """Bulk loads readings, all of them in one transaction with the indexes of station_data dropped meanwhile
+
+        Readings get new indexes after the ones stored, in the order of the old ones, and arrive now as far as
+        partitions are concerned, their measurement times are kept. The chunks are staged in a temporary file first,
+        so a slow source holds up nothing. Writes and reads only wait while the staged readings are inserted, and
+        listeners aren't told about them. If a chunk can't be read nothing is loaded.
+
+        :param chunks: Iterable of station_id -> dict of 'data_index', 'station_id', 'temperature', 'precipitation'
+            and 'timestamp' arrays, as from export. data_index only orders the readings of a chunk.
+        :return: Readings loaded
+        :rtype: int
+        """
+        staged, count = _stage(chunks)
+        loaded = 0
+        with staged, self._maintaining, self._lock:
+            self._flush()
+            self._cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = "
+                                 "'station_data' AND sql IS NOT NULL;")
+            indexes = self._cursor.fetchall()
+            self._cursor.execute("BEGIN;")  # Dropping the indexes is undone too if the load fails
+            try:
+                for name, _ in indexes:
+                    self._cursor.execute(f"DROP INDEX {name};")
+
+                now = time()
+                for _ in range(count):
+                    station, temp, rain, measured = (np.load(staged, allow_pickle=False) for _ in range(4))
+                    self._cursor.executemany(
+                        "INSERT INTO station_data (temperature, precipitation, station_id, measured_ts, ingest_ts) "
+                        "VALUES (?, ?, ?, ?, ?);",
+                        zip(temp.tolist(), rain.tolist(), station.tolist(),
+                            [None if t != t else t for t in measured.tolist()], repeat(now)))  # NaN for no time
+
+                    self._cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'station_data';")
+                    last = self._cursor.fetchone()[0]
+                    index = np.arange(last - len(temp) + 1, last + 1)
+                    rollup.update(self._cursor, index, station, temp, rain, measured)
+                    if self._hot is not None:  # Before the commit, so the chunk needn't be kept until then
+                        self._hot.append(index, station, temp, rain, measured)
+                    loaded += len(temp)
+
+                for _, sql in indexes:  # Built once over every row, faster than updating it row by row
+                    self._cursor.execute(sql)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                if self._hot is not None:  # It may hold readings that were rolled back
+                    self._hot.reset(self._next_index(), empty=False)
+                raise
+        ROWS.inc(loaded)
+        return loaded
+
+    def subscribe(self, listener):
+        """Calls listener with the rows of every batch written from now on
+
+        The listener runs on the writing thread while the write lock is held, it should only hand the rows off.
+
+        :param listener: Callable taking station_id -> dict of column arrays, like read_columns returns
         :rtype: None
         """
         with self._lock:
-            self._cursor.execute("INSERT INTO station_data (temperature, precipitation, station_id) VALUES (?, ?, ?);",
-                                 (temperature, precipitation, station_id))
-            self._conn.commit()
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """Stops calling listener
+
+        :param listener: Listener given to subscribe
+        :rtype: None
+        """
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def flush(self):
+        """Writes all buffered rows to the database now
+
+        :rtype: None
+        """
+        _acquire(self._lock)
+        try:
+            self._flush()
+        finally:
+            self._lock.release()
 
     def read(self, idx_from=0, idx_to=-1):  # Reads given row from database
         """Reads rows from index
@@ -49,19 +521,21 @@ class Database:
         :return: Dictionary of tuples(temp, prec) ordered by station_id.
         :rtype: dict
         """
-        # Query for reading row
-        query = "SELECT temperature, precipitation, station_id FROM station_data WHERE data_index >= ?"
-        params = idx_from,
+        stations = self._read_hot(hot.HotTier.read_index, idx_from, idx_to)
+        if stations is not None:
+            return {station: list(zip(columns['temperature'].tolist(), columns['precipitation'].tolist()))
+                    for station, columns in stations.items()}
 
+        # Condition for reading rows
+        where = "data_index >= :idx_from"
         if idx_to != -1:
-            query += " AND data_index <= ?"
-            params = idx_from, idx_to
-
-        query += ';'  # End of query
+            where += " AND data_index <= :idx_to"
+        params = dict(idx_from=idx_from, idx_to=idx_to)
 
         data = {}
-        with self._lock:
-            for row in self._cursor.execute(query, params):  # Copy data to list
+        with self._reading() as cursor:
+            for row in self._scan(cursor, "temperature, precipitation, station_id", where, params,
+                                  index_from=idx_from, index_to=None if idx_to == -1 else idx_to):  # Copy data to list
                 temp, rain, station = tuple(row)
                 if station not in data:
                     data[station] = []
@@ -69,6 +543,203 @@ class Database:
 
         return data
 
+    def read_since(self, idx):
+        """Reads rows added after index, for clients that keep a cursor
+
+        :param int idx: Highest index the client already has (exclusive)
+        :return: Dictionary of tuples(temp, prec) ordered by station_id, and the new highest index
+        :rtype: tuple
+        """
+        data = {}
+        with self._reading() as cursor:
+            for index, temp, rain, station in self._scan(
+                    cursor, "data_index, temperature, precipitation, station_id", "data_index > :since",
+                    dict(since=idx), " ORDER BY data_index", index_from=idx + 1):
+                if station not in data:
+                    data[station] = []
+                data[station].append((temp, rain))
+                idx = index
+
+        return data, idx
+
+    def read_columns(self, idx_from=0, idx_to=-1, since=None):
+        """Reads rows from index as contiguous column arrays per station
+
+        :param int idx_from: index to start from (inclusive)
+        :param int idx_to: Index to stop read at
+        :param int since: Read rows after this index instead (exclusive), for clients that keep a cursor
+        :return: station_id -> dict of 'data_index', 'station_id', 'temperature' and 'precipitation' arrays. Arrays
+            answered from the hot tier are views into its rings, overwritten once the station stores hot_capacity more
+            readings, copy them to keep them longer.
+        :rtype: dict
+        """
+        if since is not None:
+            idx_from, idx_to = since + 1, -1
+        stations = self._read_hot(hot.HotTier.read_index, idx_from, idx_to)
+        if stations is not None:
+            return stations
+
+        where = "data_index >= :idx_from"
+        if idx_to != -1:
+            where += " AND data_index <= :idx_to"
+
+        with self._reading() as cursor:
+            # Stream values straight into one array, without keeping a list of row tuples around.
+            # Integers in these columns fit a float64 exactly.
+            rows = self._scan(cursor, "data_index, station_id, temperature, precipitation", where,
+                              dict(idx_from=idx_from, idx_to=idx_to),
+                              index_from=idx_from, index_to=None if idx_to == -1 else idx_to)
+            table = np.fromiter(chain.from_iterable(rows), np.float64)
+        return _by_station(*table.reshape(-1, 4).T)
+
+    def read_chunks(self, idx_from=0, idx_to=-1, station_id=None, limit=None, size=STREAM_CHUNK):
+        """Reads rows from index in chunks of column arrays per station, in index order
+
+        Each chunk is read on its own, after the last index of the chunk before, so a slow consumer holds no reader and
+        only one chunk is in memory at a time.
+
+        :param int idx_from: index to start from (inclusive)
+        :param int idx_to: Index to stop read at
+        :param int station_id: Only read this station
+        :param int limit: Max rows read, None for all
+        :param int size: Max rows per chunk
+        :return: Iterator of station_id -> dict of 'data_index', 'station_id', 'temperature', 'precipitation' and
+            'timestamp' arrays, NaN timestamps for rows from before timestamps were stored
+        :rtype: iterator
+        """
+        where = "data_index >= :idx_from"
+        if idx_to != -1:
+            where += " AND data_index <= :idx_to"
+        if station_id is not None:
+            where += " AND station_id = :station"
+
+        while limit is None or limit > 0:
+            count = size if limit is None else min(size, limit)
+            with self._reading() as cursor:
+                rows = self._scan(cursor, "data_index, station_id, temperature, precipitation, measured_ts", where,
+                                  dict(idx_from=idx_from, idx_to=idx_to, station=station_id), " ORDER BY data_index",
+                                  index_from=idx_from, index_to=None if idx_to == -1 else idx_to)
+                table = np.array(list(islice(rows, count)), np.float64).reshape(-1, 5)  # NULL times become NaN
+                rows.close()  # Closes the partitions still open
+            if not len(table):
+                return
+
+            yield _by_station(*table.T)
+            idx_from = int(table[-1, 0]) + 1
+            if limit is not None:
+                limit -= len(table)
+            if len(table) < count:  # Nothing more
+                return
+
+    def export(self, size=STREAM_CHUNK):
+        """Reads every reading at full resolution from one snapshot, in chunks of column arrays per station
+
+        The snapshot is held until the last chunk is read, so a backup is consistent. Downsampled partitions aren't
+        read, their readings are only kept as means.
+
+        :param int size: Max rows per chunk
+        :return: Iterator of station_id -> dict of 'data_index', 'station_id', 'temperature', 'precipitation' and
+            'timestamp' arrays, like read_chunks
+        :rtype: iterator
+        """
+        with self._reading() as cursor:
+            rows = self._scan(cursor, "data_index, station_id, temperature, precipitation, measured_ts", "1", {},
+                              " ORDER BY data_index", resolution=partition.RAW)
+            for chunk in iter(lambda: list(islice(rows, size)), []):
+                yield _by_station(*np.array(chunk, np.float64).T)  # NULL times become NaN
+
+    def read_range(self, ts_from=0, ts_to=None, station_id=None):
+        """Reads readings measured in a time range as column arrays per station, in time order
+
+        Served from the (station_id, measured_ts) index alone. Rows from before timestamps were stored aren't in any
+        range.
+
+        :param float ts_from: Earliest measurement as unix time (inclusive)
+        :param float ts_to: Latest measurement as unix time (inclusive), None for newest
+        :param int station_id: Only read this station
+        :return: station_id -> dict of 'data_index', 'station_id', 'temperature', 'precipitation' and 'timestamp'
+            arrays
+        :rtype: dict
+        """
+        stations = self._read_hot(hot.HotTier.read_range, ts_from, ts_to, station_id)
+        if stations is not None:
+            return stations
+
+        where = "station_id = :station AND measured_ts >= :ts_from"
+        if ts_to is not None:
+            where += " AND measured_ts <= :ts_to"
+
+        with self._reading() as cursor:
+            if station_id is None:  # One index range per station, the index starts with station_id
+                cursor.execute("SELECT station_id FROM station_summary;")
+                stations = [row[0] for row in cursor.fetchall()]
+            else:
+                stations = [station_id]
+            rows = chain.from_iterable(
+                self._scan(cursor, "data_index, station_id, temperature, precipitation, measured_ts", where,
+                           dict(station=station, ts_from=ts_from, ts_to=ts_to), " ORDER BY measured_ts",
+                           ts_from=ts_from, ts_to=ts_to) for station in stations)
+            table = np.fromiter(chain.from_iterable(rows), np.float64).reshape(-1, 5)
+
+        table = table[np.lexsort((table[:, 4], table[:, 1]))]  # Partitions may overlap in measurement time
+        return _by_station(*table.T)
+
+    def read_aggregates(self, idx_from=0, idx_to=-1, points=1000):
+        """Reads rows from index, aggregated into at most points buckets per station
+
+        :param int idx_from: index to start from (inclusive)
+        :param int idx_to: Index to stop read at
+        :param int points: Max buckets per station
+        :return: station_id -> dict of arrays with one value per bucket, see aggregate.bucket
+        :rtype: dict
+        """
+        return {station: aggregate.bucket(columns, points)
+                for station, columns in self.read_columns(idx_from, idx_to).items()}
+
+    def read_downsampled(self, idx_from=0, idx_to=-1, points=1000):
+        """Reads rows from index, downsampled to about points rows per station for plotting
+
+        :param int idx_from: index to start from (inclusive)
+        :param int idx_to: Index to stop read at
+        :param int points: Points to keep per series
+        :return: station_id -> dict of column arrays, like read_columns
+        :rtype: dict
+        """
+        return {station: aggregate.downsample(columns, points)
+                for station, columns in self.read_columns(idx_from, idx_to).items()}
+
+    def read_summary(self):
+        """Reads count and last reading of every station, from the rollups
+
+        :return: station_id -> (count, last data_index, last temperature, last precipitation)
+        :rtype: dict
+        """
+        with self._reading() as cursor:
+            return rollup.read_summary(cursor)
+
+    def read_rollups(self, resolution, station_id=None, ts_from=0, ts_to=None):
+        """Reads hourly or daily aggregates, from the rollups
+
+        :param str resolution: 'hourly' or 'daily'
+        :param int station_id: Only read this station
+        :param float ts_from: Earliest bucket start as unix time (inclusive)
+        :param float ts_to: Latest bucket start as unix time (inclusive), None for newest
+        :return: station_id -> dict of arrays with one value per bucket, see rollup.read
+        :rtype: dict
+        """
+        with self._reading() as cursor:
+            return rollup.read(cursor, rollup.RESOLUTIONS[resolution], station_id, ts_from, ts_to)
+
+    def rebuild_rollups(self):
+        """Recomputes the rollups from station_data, e.g. after the table was changed by hand
+
+        :rtype: None
+        """
+        with self._lock:
+            self._flush()
+            rollup.rebuild(self._cursor, self._chunks(self._conn.cursor()))
+            self._conn.commit()
+
     def get_count(self):
         """
         Gets count of all datapoints in database.
@@ -76,10 +747,24 @@ class Database:
         :return: Datapoint count
         :rtype: int
         """
-        with self._lock:
-            self._cursor.execute("SELECT COUNT(data_index) FROM station_data")
+        with self._reading() as cursor:
+            cursor.execute("SELECT TOTAL(count) FROM station_summary")  # One row per station, not per reading
+
+            return int(cursor.fetchone()[0])  # Only selecting one value
+
+    def get_index(self):
+        """
+        Returns the highest data_index in the database, it changes whenever rows are added or cleared.
 
-            return self._cursor.fetchone()[0]  # Only selecting one value
+        :return: Highest index, 0 when empty
+        :rtype: int
+        """
+        with self._reading() as cursor:
+            cursor.execute("SELECT MAX(data_index) FROM station_data")  # Primary key, no scan
+            live = cursor.fetchone()[0] or 0
+            cursor.execute("SELECT MAX(index_to) FROM partitions")  # Everything may be sealed
+
+            return max(live, cursor.fetchone()[0] or 0)
 
     def get_station_count(self):
         """
@@ -88,20 +773,127 @@ class Database:
         :return: Amount of stations
         :rtype: int
         """
-        with self._lock:
-            self._cursor.execute("SELECT COUNT(DISTINCT station_id) FROM station_data")
+        with self._reading() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM station_summary")
 
-            return self._cursor.fetchone()[0]  # Only selecting one value
+            return cursor.fetchone()[0]  # Only selecting one value
 
     def close(self):
-        """Closes the sql connection
+        """Flushes remaining rows and closes the sql connections
 
         :rtype: None
         """
-        with self._lock:
+        self._shut_down.set()
+        self._pending.set()  # Wake flusher so it can exit
+        with self._maintaining, self._lock:  # Lets partition maintenance finish
+            self._flush()
             self._conn.close()
+        if self._hot is not None:
+            self._hot.flush()
+
+        while self._readers is not None and not self._readers.empty():
+            self._readers.get().close()
 
     def clear(self):
+        """Deletes every row, partition and rollup
+
+        :rtype: None
+        """
+        with self._maintaining:
+            with self._lock:
+                self._buffer = []
+                self._done = []  # Deleted anyway, later acks cover them
+                self._pending.clear()
+                partitions = partition.read_catalog(self._cursor)
+                self._cursor.execute("DELETE FROM partitions")
+                # No WHERE, so SQLite frees the table's pages instead of deleting row by row. At most one period of
+                # readings is in station_data, the rest is in partition files.
+                self._cursor.execute("DELETE FROM station_data")
+                rollup.clear(self._cursor)
+                self._conn.commit()
+                if self._hot is not None:
+                    self._hot.reset(self._next_index())
+
+            for name, *_ in partitions:  # Out of the catalog, so no read opens them anymore
+                partition.remove(self._directory, name)
+
+    def maintain(self, now=None):
+        """Seals finished periods into partitions, and downsamples and drops partitions past retention.
+        Runs every MAINTENANCE_INTERVAL seconds on its own.
+
+        :param float now: Unix time to maintain as of, None for now
+        :rtype: None
+        """
+        if self._directory is None:
+            return
+
+        now = time() if now is None else now
+        with self._maintaining:
+            self._seal(now // self._partition_seconds * self._partition_seconds)
+            self._purge()
+            self._expire(now)
+
+    def _seal(self, period):
+        """Copies the readings that arrived before period to a new partition
+
+        :param float period: Start of the current period
+        :rtype: None
+        """
+        with self._reading() as cursor:
+            cursor.execute("SELECT MAX(index_to) FROM partitions;")
+            sealed = cursor.fetchone()[0] or 0
+            cursor.execute("SELECT MAX(data_index) FROM station_data WHERE data_index > ? "
+                           "AND (ingest_ts < ? OR ingest_ts IS NULL);", (sealed, period))
+            last = cursor.fetchone()[0]
+        if last is None:
+            return
+
+        name, *row = partition.seal(self._directory, self._path, sealed + 1, last)  # Without holding up writes
         with self._lock:
-            self._cursor.execute("DELETE FROM station_data")
-            self._conn.commit()
+            self._cursor.execute("INSERT INTO partitions (name, resolution, index_from, index_to, ts_from, ts_to, "
+                                 "ingest_to, rows) VALUES (?, ?, ?, ?, ?, ?, ?, ?);", [name, partition.RAW] + row)
+            self._conn.commit()  # From here reads take the rows from the partition
+
+    def _purge(self):
+        """Deletes sealed readings from station_data, PURGE_BATCH at a time
+
+        :rtype: None
+        """
+        while True:
+            with self._lock:
+                self._cursor.execute("SELECT MAX(index_to) FROM partitions;")
+                sealed = self._cursor.fetchone()[0] or 0
+                self._cursor.execute("SELECT MIN(data_index) FROM station_data;")
+                low = self._cursor.fetchone()[0]
+                if low is None or low > sealed:
+                    return
+                self._cursor.execute("DELETE FROM station_data WHERE data_index BETWEEN ? AND ?;",
+                                     (low, min(sealed, low + PURGE_BATCH - 1)))
+                self._conn.commit()
+
+    def _expire(self, now):
+        """Downsamples raw partitions past retention, and drops downsampled ones past coarse_retention
+
+        :param float now: Unix time
+        :rtype: None
+        """
+        with self._reading() as cursor:
+            partitions = partition.read_catalog(cursor)
+
+        for name, resolution, _, _, _, ts_to, ingest_to, _ in partitions:
+            newest = ts_to if ts_to is not None else ingest_to
+            retention = self._retention if resolution == partition.RAW else self._coarse_retention
+            if newest is None or retention is None or now - newest <= retention:  # No times, age unknown
+                continue
+
+            row = None
+            if resolution == partition.RAW and self._coarse_resolution is not None:
+                coarse, *stats = partition.coarsen(self._directory, name, self._coarse_resolution)
+                row = [coarse, self._coarse_resolution] + stats
+            with self._lock:
+                self._cursor.execute("DELETE FROM partitions WHERE name = ?;", (name,))
+                if row is not None:
+                    self._cursor.execute("INSERT INTO partitions (name, resolution, index_from, index_to, ts_from, "
+                                         "ts_to, ingest_to, rows) VALUES (?, ?, ?, ?, ?, ?, ?, ?);", row)
+                self._conn.commit()
+            partition.remove(self._directory, name)
@@ -0,0 +1,262 @@
+import os
+from threading import Lock
+from time import time
+
+import numpy as np
+
+# Arrays of the tier, one row per station slot and one column per reading in the ring
+_RINGS = (('data_index', np.dtype('<i8')), ('timestamp', np.dtype('<f8')), ('temperature', np.dtype('<f8')),
+          ('precipitation', np.dtype('<f8')))
+
+
+def _open(path, shape, dtype, fill):
+    """Opens an array of the tier, memory-mapped from an .npy file if a path is given
+
+    :param str path: File to map, None to keep the array in memory
+    :param tuple shape: Shape of the array
+    :param np.dtype dtype: Type of the array
+    :param fill: Value of a new array
+    :return: The array, and whether it was read from an existing file
+    :rtype: tuple"""
+    if path is None:
+        return np.full(shape, fill, dtype), False
+    if os.path.exists(path):
+        array = np.lib.format.open_memmap(path, 'r+')
+        if array.shape == shape and array.dtype == dtype:
+            return array, True
+        del array  # Sized for other settings, start over
+    array = np.lib.format.open_memmap(path, 'w+', dtype, shape)
+    array[...] = fill
+    return array, False
+
+
+class HotTier:
+    def __init__(self, capacity=4096, stations=1024, directory=None, next_index=1, empty=True):
+        """The latest readings of every station, in fixed-size ring buffers next to the database
+
+        Each station gets a slot with room for its last capacity readings, in index order. The tier knows from which
+        index on, and from which measurement time on, it holds every reading stored, so a query for a window after
+        both is answered from memory, and anything older is left to SQLite. Readings pushed out of a ring, and readings
+        of stations that didn't get one of the slots, move those bounds up.
+
+        With a directory the rings are memory-mapped .npy files, and are used again after a restart if no readings
+        were stored without them in between.
+
+        :param int capacity: Readings kept per station
+        :param int stations: Station slots
+        :param str directory: Directory of the memory-mapped files, None to keep the rings in memory
+        :param int next_index: Index the next reading stored will get
+        :param bool empty: If nothing is stored yet, so every measurement time is in the tier
+        :rtype: None"""
+        self._capacity = max(1, capacity)
+        self._lock = Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        def path(name):
+            return None if directory is None else os.path.join(directory, name + '.npy')
+
+        kept = True
+        self._rings = {}
+        for name, dtype in _RINGS:
+            self._rings[name], reused = _open(path(name), (max(1, stations), self._capacity), dtype, 0)
+            kept = kept and reused
+        self._ids, reused = _open(path('station_id'), (max(1, stations),), np.dtype('<i8'), -1)  # -1 for free slots
+        kept = kept and reused
+        self._counts, reused = _open(path('count'), (max(1, stations),), np.dtype('<i8'), 0)  # Readings ever written
+        kept = kept and reused
+        # Index the tier is complete from, measurement time it is complete from, and the next index expected
+        self._state, reused = _open(path('state'), (3,), np.dtype('<f8'), 0)
+        kept = kept and reused
+
+        if not kept or self._state[2] != next_index:  # Readings were stored while the tier was away
+            self._reset(next_index, empty)
+        self._slots = {int(station_id): slot for slot, station_id in enumerate(self._ids.tolist()) if station_id >= 0}
+
+    def _reset(self, next_index, empty):
+        """Forgets every reading
+
+        :param int next_index: Index the next reading stored will get
+        :param bool empty: If nothing is stored, else only readings measured from now on can be answered
+        :rtype: None"""
+        self._ids[:] = -1
+        self._counts[:] = 0
+        self._state[:] = (0, -np.inf, next_index) if empty else (next_index, time(), next_index)
+        self._slots = {}
+
+    def reset(self, next_index, empty=True):
+        """Forgets every reading, after the database was cleared
+
+        :param int next_index: Index the next reading stored will get
+        :param bool empty: If nothing is stored
+        :rtype: None"""
+        with self._lock:
+            self._reset(next_index, empty)
+
+    def _drop(self, index, timestamp):
+        """Moves the bounds past readings that aren't kept
+
+        :param np.ndarray index: Indexes of the readings
+        :param np.ndarray timestamp: Measurement times of the readings, NaN if unknown
+        :rtype: None"""
+        if len(index):
+            self._state[0] = max(self._state[0], index.max() + 1)
+            measured = timestamp[timestamp == timestamp]
+            if len(measured):
+                self._state[1] = max(self._state[1], measured.max())
+
+    def _slot(self, station_id):
+        """Slot of a station, a free one for a new station
+
+        :param int station_id: Station
+        :return: Slot, -1 if every slot is taken
+        :rtype: int"""
+        slot = self._slots.get(station_id)
+        if slot is None and len(self._slots) < len(self._ids):
+            slot = self._slots[station_id] = len(self._slots)
+            self._ids[slot] = station_id
+        return -1 if slot is None else slot
+
+    def append(self, index, station, temperature, precipitation, timestamp):
+        """Keeps readings just stored, pushing the oldest of their stations out of full rings
+
+        :param np.ndarray index: data_index of each reading, ascending
+        :param np.ndarray station: station_id of each reading
+        :param np.ndarray temperature: Temperature of each reading
+        :param np.ndarray precipitation: Precipitation of each reading
+        :param np.ndarray timestamp: Measurement time of each reading, NaN if unknown
+        :rtype: None"""
+        if not len(index):
+            return
+        with self._lock:
+            ids, inverse = np.unique(station, return_inverse=True)
+            slot = np.array([self._slot(int(i)) for i in ids], np.int64)[inverse]
+
+            # Grouped by slot in index order, rank is the position within the slot's readings of this batch
+            order = np.argsort(slot, kind='stable')
+            slot, index, timestamp = slot[order], index[order], timestamp[order]
+            first, last = np.searchsorted(slot, slot, 'left'), np.searchsorted(slot, slot, 'right')
+            rank = np.arange(len(slot)) - first
+            written = self._counts[slot] + rank  # Readings of the station before this one, every one takes a position
+            kept = (slot >= 0) & (rank >= last - first - self._capacity)  # No slot, or pushed out by the same batch
+            self._drop(index[~kept], timestamp[~kept])
+            np.add.at(self._counts, slot[slot >= 0], 1)
+
+            slot, rank, written, order = slot[kept], rank[kept], written[kept], order[kept]
+            position = written % self._capacity
+            full = (written >= self._capacity) & (rank < self._capacity)  # Overwrites a reading of an earlier batch
+            self._drop(self._rings['data_index'][slot[full], position[full]],
+                       self._rings['timestamp'][slot[full], position[full]])
+
+            for name, values in (('data_index', index[kept]), ('timestamp', timestamp[kept]),
+                                 ('temperature', temperature[order]), ('precipitation', precipitation[order])):
+                self._rings[name][slot, position] = values
+            self._state[2] = max(self._state[2], index.max() + 1)
+
+    def _segments(self, slot):
+        """Parts of a slot's ring in index order, oldest first
+
+        :param int slot: Slot
+        :return: (start, stop) positions
+        :rtype: list"""
+        count = int(self._counts[slot])
+        if count <= self._capacity:
+            return [(0, count)]
+        head = count % self._capacity
+        return [(head, self._capacity), (0, head)] if head else [(0, self._capacity)]
+
+    def _columns(self, slot, pieces, timestamp):
+        """Column arrays of a station from pieces of its ring, views if there is only one piece
+
+        :param int slot: Slot
+        :param list pieces: (start, stop) positions, in the order wanted
+        :param bool timestamp: Include the 'timestamp' column
+        :return: Column name -> array
+        :rtype: dict"""
+        names = ('data_index', 'temperature', 'precipitation') + (('timestamp',) if timestamp else ())
+        if len(pieces) == 1:
+            columns = {name: self._rings[name][slot, pieces[0][0]:pieces[0][1]] for name in names}
+        else:
+            columns = {name: np.concatenate([self._rings[name][slot, a:b] for a, b in pieces]) for name in names}
+        columns['station_id'] = np.full(len(columns['data_index']), self._ids[slot], np.int64)
+        return columns
+
+    def read_index(self, idx_from=0, idx_to=-1, timestamp=False):
+        """Reads readings from index, if the tier holds every one of them
+
+        The arrays are views into the rings where possible, they are only valid until the station stores capacity
+        more readings.
+
+        :param int idx_from: index to start from (inclusive)
+        :param int idx_to: Index to stop read at, -1 for newest
+        :param bool timestamp: Include the 'timestamp' column
+        :return: station_id -> dict of 'data_index', 'station_id', 'temperature' and 'precipitation' arrays, None if
+            readings before idx_from may be missing
+        :rtype: dict"""
+        with self._lock:
+            if idx_from < self._state[0]:
+                return None
+            stations = {}
+            for station_id, slot in self._slots.items():
+                pieces = []
+                for a, b in self._segments(slot):
+                    ring = self._rings['data_index'][slot, a:b]
+                    lo = a + np.searchsorted(ring, idx_from, 'left')
+                    hi = b if idx_to == -1 else a + np.searchsorted(ring, idx_to, 'right')
+                    if hi > lo:
+                        pieces.append((lo, hi))
+                if pieces:
+                    stations[station_id] = self._columns(slot, pieces, timestamp)
+            return stations
+
+    def read_range(self, ts_from, ts_to=None, station_id=None):
+        """Reads readings measured in a time range, if the tier holds every one of them
+
+        :param float ts_from: Earliest measurement as unix time (inclusive)
+        :param float ts_to: Latest measurement as unix time (inclusive), None for newest
+        :param int station_id: Only read this station
+        :return: station_id -> dict of 'data_index', 'station_id', 'temperature', 'precipitation' and 'timestamp'
+            arrays in time order, None if readings measured from ts_from on may be missing
+        :rtype: dict"""
+        with self._lock:
+            if ts_from <= self._state[1]:  # Readings measured at the bound itself may have been pushed out
+                return None
+            if station_id is None:
+                slots = np.arange(len(self._slots))
+            else:
+                slots = np.array([self._slots[station_id]] if station_id in self._slots else [], np.int64)
+
+            # Every ring at once, positions not written yet left out
+            measured = self._rings['timestamp'][slots]
+            selected = (measured >= ts_from) & (np.arange(self._capacity) < self._counts[slots, None])
+            if ts_to is not None:
+                selected &= measured <= ts_to
+            rows, positions = np.nonzero(selected)
+            slot = slots[rows]
+            # By station, then time, they may arrive out of order, then index like SQLite
+            order = np.lexsort((self._rings['data_index'][slot, positions], measured[rows, positions], slot))
+            slot, positions = slot[order], positions[order]
+
+            ids, starts = np.unique(slot, return_index=True)
+            bounds = list(starts[1:]) + [len(slot)]
+            columns = {name: ring[slot, positions] for name, ring in self._rings.items()}
+            return {int(self._ids[s]): dict({name: array[a:b] for name, array in columns.items()},
+                                            station_id=np.full(b - a, self._ids[s], np.int64))
+                    for s, a, b in zip(ids, starts, bounds)}
+
+    @property
+    def bounds(self):
+        """Index and measurement time the tier is complete from
+
+        :rtype: tuple"""
+        with self._lock:
+            return int(self._state[0]), float(self._state[1])
+
+    def flush(self):
+        """Writes memory-mapped rings to their files
+
+        :rtype: None"""
+        with self._lock:
+            for array in list(self._rings.values()) + [self._ids, self._counts, self._state]:
+                if isinstance(array, np.memmap):
+                    array.flush()
@@ -0,0 +1,213 @@
+from bisect import bisect_left
+from threading import Lock, current_thread, local
+
+# += is a read, an add and a write, so the receiver, writer, flusher and sender threads would lose updates to each other
+# on a shared number. Counters sit on the ingest path and keep a count per thread instead, summed when read. Histograms
+# are observed once per batch or request and take a lock.
+
+# Upper bounds in seconds of the latency buckets, from well under a millisecond to a few seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Upper bounds of the batch size buckets, in rows
+SIZE_BUCKETS = (1, 4, 16, 43, 64, 256, 1024, 4096, 16384, 65536)
+
+SNMP = '/proc/net/snmp'  # Linux UDP statistics, for datagrams the kernel dropped before a receiver read them
+
+
+def _labels(labels):
+    """Formats labels the Prometheus way
+
+    :param tuple labels: Sorted (name, value) pairs
+    :rtype: str"""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def _number(value):
+    """Formats a sample value, integers without a fraction
+
+    :param float value: Value
+    :rtype: str"""
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if value == int(value) else repr(float(value))
+
+
+class Counter:
+    def __init__(self):
+        """Value that only goes up
+
+        :rtype: None"""
+        self._lock = Lock()  # Guards the list of cells, each cell is only added to by its thread
+        self._local = local()
+        self._cells = []  # (thread, [count]) of every live thread that counted
+        self._retired = 0  # Counts of threads that are gone
+
+    def inc(self, amount=1):
+        """Adds to the counter
+
+        :param float amount: Amount to add
+        :rtype: None"""
+        try:
+            self._local.cell[0] += amount
+        except AttributeError:  # First count of this thread
+            cell = self._local.cell = [amount]
+            with self._lock:
+                self._cells.append((current_thread(), cell))
+
+    @property
+    def value(self):
+        """Sum of the counts of every thread
+
+        :rtype: float"""
+        with self._lock:
+            live = []
+            for thread, cell in self._cells:
+                if thread.is_alive():
+                    live.append((thread, cell))
+                else:  # Counts no more, so the list only holds live threads
+                    self._retired += cell[0]
+            self._cells = live
+            return self._retired + sum(cell[0] for _, cell in live)
+
+    def samples(self, name, labels):
+        """Lines of the Prometheus text format
+
+        :param str name: Metric name
+        :param tuple labels: Sorted (name, value) pairs
+        :rtype: list"""
+        return [f'{name}{_labels(labels)} {_number(self.value)}']
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Distribution of observed values over fixed buckets
+
+        :param tuple buckets: Upper bounds of the buckets, in increasing order
+        :rtype: None"""
+        self._lock = Lock()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last one is above every bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Counts a value in its bucket
+
+        :param float value: Observed value
+        :rtype: None"""
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labels):
+        """Lines of the Prometheus text format, with cumulative buckets
+
+        :param str name: Metric name
+        :param tuple labels: Sorted (name, value) pairs
+        :rtype: list"""
+        with self._lock:  # Buckets, sum and count of the same observations
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+        lines.append(f'{name}_count{_labels(labels)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        """Metrics by name and labels, rendered together
+
+        :rtype: None"""
+        self._lock = Lock()
+        self._families = dict()  # name -> [type, help, {labels: metric}]
+        self._collectors = []  # Functions giving (name, type, help, value) when rendered
+
+    def _get(self, kind, name, description, labels, make):
+        """Gets the metric with these labels, created on first use
+
+        :param str kind: 'counter' or 'histogram'
+        :param str name: Metric name
+        :param str description: Help text
+        :param dict labels: Label names and values
+        :param make: Creates the metric
+        :rtype: Counter | Histogram"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.setdefault(name, [kind, description, dict()])
+            if family[0] != kind:
+                raise ValueError(f"Metric '{name}' is a {family[0]}, not a {kind}")
+            if key not in family[2]:
+                family[2][key] = make()
+            return family[2][key]
+
+    def counter(self, name, description, **labels):
+        """Gets a counter, the same one for the same name and labels
+
+        :param str name: Metric name, ending in _total
+        :param str description: Help text
+        :param labels: Label names and values
+        :rtype: Counter"""
+        return self._get('counter', name, description, labels, Counter)
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS, **labels):
+        """Gets a histogram, the same one for the same name and labels
+
+        :param str name: Metric name
+        :param str description: Help text
+        :param tuple buckets: Upper bounds of the buckets, used when the histogram is created
+        :param labels: Label names and values
+        :rtype: Histogram"""
+        return self._get('histogram', name, description, labels, lambda: Histogram(buckets))
+
+    def collect(self, function):
+        """Adds values read when the metrics are rendered, for things counted elsewhere
+
+        :param function: Called without arguments, returns an iterable of (name, type, help, value)
+        :rtype: None"""
+        with self._lock:
+            self._collectors.append(function)
+
+    def render(self):
+        """Every metric in the Prometheus text format
+
+        :rtype: str"""
+        with self._lock:
+            families = [(name, kind, description, list(metrics.items()))
+                        for name, (kind, description, metrics) in sorted(self._families.items())]
+            collectors = list(self._collectors)
+
+        lines = []
+        for name, kind, description, metrics in families:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+            for labels, metric in sorted(metrics, key=lambda item: item[0]):
+                lines += metric.samples(name, labels)
+        for function in collectors:
+            for name, kind, description, value in function():
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}', f'{name} {_number(value)}']
+        return '\n'.join(lines) + '\n'
+
+
+def kernel_drops():
+    """Datagrams the kernel dropped because a receive buffer was full, on the whole host
+
+    :return: (name, type, help, value) for Registry.collect, nothing where /proc/net/snmp is missing
+    :rtype: list"""
+    try:
+        with open(SNMP) as snmp:
+            header, values = [line.split() for line in snmp if line.startswith('Udp:')][:2]
+    except (OSError, ValueError):
+        return []
+    stats = dict(zip(header[1:], values[1:]))
+    return [('receiver_datagrams_dropped_total', 'counter',
+             'UDP datagrams dropped by the kernel because a receive buffer was full, host-wide',
+             int(stats.get('RcvbufErrors', 0)))]
+
+
+REGISTRY = Registry()  # Metrics of this process, shared by every server in it
+REGISTRY.collect(kernel_drops)
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+from urllib.parse import quote
+
+RAW = 0  # Resolution of partitions holding readings as they came in
+
+COLUMNS = "data_index, temperature, precipitation, station_id, ingest_ts, measured_ts"
+
+# Partitions have the columns and index of station_data, so the same queries run on both
+_TABLE = ("CREATE TABLE station_data (data_index INTEGER PRIMARY KEY, temperature FLOAT NOT NULL,"
+          "precipitation FLOAT NOT NULL, station_id INTEGER DEFAULT 0, ingest_ts FLOAT, measured_ts FLOAT);")
+_INDEX = "CREATE INDEX station_data_station_ts ON station_data (station_id, measured_ts, temperature, precipitation);"
+
+# Catalog of partition files, one row per file. Created by a migration in server.database.
+CATALOG = ("CREATE TABLE partitions (name TEXT PRIMARY KEY, resolution INTEGER NOT NULL, index_from INTEGER NOT NULL,"
+           "index_to INTEGER NOT NULL, ts_from FLOAT, ts_to FLOAT, ingest_to FLOAT, rows INTEGER NOT NULL);")
+
+
+def _uri(path, mode):
+    """SQLite URI of a file
+
+    :param str path: Path of the file
+    :param str mode: 'ro', 'rw' or 'rwc'
+    :rtype: str"""
+    return f"file:{quote(os.path.abspath(path))}?mode={mode}"
+
+
+def _build(directory, name, source, select, params):
+    """Writes a partition file from a query on another database, then compacts it and makes it read-only
+
+    :param str directory: Directory of the partition files
+    :param str name: Name of the new partition
+    :param str source: Path of the database to read, attached as 'source'
+    :param str select: Query returning the partition's rows in COLUMNS order
+    :param tuple params: Parameters of select
+    :return: Catalog row of the partition, without resolution
+    :rtype: tuple"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + '.db')
+    if os.path.exists(path):  # Left over from an interrupted run, it was never in the catalog
+        os.remove(path)
+
+    conn = sqlite3.connect(_uri(path, 'rwc'), uri=True)
+    try:
+        conn.execute("ATTACH DATABASE ? AS source;", (_uri(source, 'ro'),))
+        conn.execute(_TABLE)
+        conn.execute(f"INSERT INTO station_data ({COLUMNS}) {select};", params)  # In index order, appends pages
+        conn.execute(_INDEX)
+        conn.commit()
+        conn.execute("DETACH DATABASE source;")
+        conn.execute("VACUUM;")  # Packs the pages, the file never changes again
+        stats = conn.execute("SELECT MIN(data_index), MAX(data_index), MIN(measured_ts), MAX(measured_ts), "
+                             "MAX(ingest_ts), COUNT(*) FROM station_data;").fetchone()
+    finally:
+        conn.close()
+    os.chmod(path, 0o444)
+    return (name,) + stats
+
+
+def seal(directory, database, index_from, index_to):
+    """Copies readings from station_data into a new raw partition
+
+    :param str directory: Directory of the partition files
+    :param str database: Path of the database, read on a connection of its own
+    :param int index_from: First data_index to copy
+    :param int index_to: Last data_index to copy
+    :return: Catalog row of the partition, without resolution
+    :rtype: tuple"""
+    return _build(directory, f'raw-{index_from}', database,
+                  f"SELECT {COLUMNS} FROM source.station_data WHERE data_index BETWEEN ? AND ? ORDER BY data_index",
+                  (index_from, index_to))
+
+
+def coarsen(directory, name, resolution):
+    """Downsamples a partition into a new one, with the mean of every station's readings per bucket
+
+    Each row gets the highest data_index of its bucket, and the bucket start as measurement time.
+
+    :param str directory: Directory of the partition files
+    :param str name: Partition to downsample
+    :param int resolution: Seconds per bucket
+    :return: Catalog row of the new partition, without resolution
+    :rtype: tuple"""
+    return _build(directory, f'{resolution}s-{name.split("-")[-1]}', os.path.join(directory, name + '.db'),
+                  "SELECT MAX(data_index), AVG(temperature), AVG(precipitation), station_id, MAX(ingest_ts), "
+                  "CAST(measured_ts / ? AS INTEGER) * ? AS bucket FROM source.station_data "
+                  "GROUP BY station_id, bucket ORDER BY 1",
+                  (resolution, resolution))
+
+
+def remove(directory, name):
+    """Deletes a partition file, after it was taken out of the catalog
+
+    :param str directory: Directory of the partition files
+    :param str name: Partition to delete
+    :rtype: None"""
+    try:
+        os.remove(os.path.join(directory, name + '.db'))
+    except FileNotFoundError:
+        pass
+
+
+def read_catalog(cursor, index_from=None, index_to=None, ts_from=None, ts_to=None, resolution=None):
+    """Reads the partitions that may hold rows in an index or time range, in index order
+
+    :param sqlite3.Cursor cursor: Cursor to read with
+    :param int index_from: Lowest data_index wanted
+    :param int index_to: Highest data_index wanted
+    :param float ts_from: Earliest measurement wanted
+    :param float ts_to: Latest measurement wanted
+    :param int resolution: Only partitions of this resolution, RAW for full resolution
+    :return: (name, resolution, index_from, index_to, ts_from, ts_to, ingest_to, rows) tuples
+    :rtype: list"""
+    query = "SELECT name, resolution, index_from, index_to, ts_from, ts_to, ingest_to, rows FROM partitions WHERE 1"
+    params = []
+    for condition, value in (("index_to >= ?", index_from), ("index_from <= ?", index_to),
+                             ("ts_to >= ?", ts_from), ("ts_from <= ?", ts_to), ("resolution = ?", resolution)):
+        if value is not None:
+            query += " AND " + condition
+            params.append(value)
+    cursor.execute(query + " ORDER BY index_from;", params)
+    return cursor.fetchall()
+
+
+def scan(directory, partitions, query, params):
+    """Runs a query on every partition, the rows of one partition at a time
+
+    A partition that was dropped by retention since the catalog was read is skipped.
+
+    :param str directory: Directory of the partition files
+    :param list partitions: Catalog rows, from read_catalog
+    :param str query: Query on station_data
+    :param params: Parameters of query
+    :rtype: iterator"""
+    for name, *_ in partitions:
+        try:  # Partitions never change, so SQLite can skip locking
+            conn = sqlite3.connect(_uri(os.path.join(directory, name + '.db'), 'ro') + '&immutable=1', uri=True)
+        except sqlite3.OperationalError:
+            continue
+        try:
+            yield from conn.execute(query, params)
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
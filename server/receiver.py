@@ -1,54 +1,177 @@
-import pickle
+import select
 import socket
+import sqlite3
 import threading
+from functools import partial
+from queue import Queue
 
+import numpy as np
+
+from protocol import telemetry
 from server.database import Database
+from server.metrics import REGISTRY
+from server.sequence import SequenceTracker
+
+RECEIVE_BUFFER = 4 * 2 ** 20  # Bytes, the kernel caps this at net.core.rmem_max
+BATCH_BUFFER = 2 ** 20  # Bytes of datagrams read in one batch, before they are handed to the writer
+POLL_INTERVAL = 0.2  # Seconds between checks for shutdown while no datagram arrives
+
+DATAGRAMS = REGISTRY.counter('receiver_datagrams_total', 'Datagrams received from stations')
+DECODE_FAILED = REGISTRY.counter('receiver_decode_failed_total', 'Datagrams dropped because they could not be decoded')
+
+
+def send_acks(send, acks):
+    """Sends acks, dropping those the socket can't take, their stations send the readings again
+
+    :param send: sendto of the socket or transport
+    :param list acks: (ack, address) pairs
+    :rtype: None"""
+    for ack, address in acks:
+        try:
+            send(ack, address)
+        except OSError:
+            pass
+
+
+class Decoder:
+    def __init__(self, legacy=False):
+        """Decodes datagrams from stations, and follows their sequences to find new readings and the acks to send
+
+        Shared by every ingest path, the threaded receiver, the asyncio endpoint and the ingest workers.
+
+        :param bool legacy: Also accept pickled readings from old stations, only for trusted networks
+        :rtype: None"""
+        self._legacy = legacy
+        self._tracker = SequenceTracker()
+
+    def decode(self, data):
+        """Decodes one datagram and finds its new readings
+
+        :param data: Datagram from a station, bytes or a memoryview
+        :return: New readings (None if the datagram is malformed) and acks to send back
+        :rtype: tuple"""
+        DATAGRAMS.inc()
+        try:
+            records = telemetry.decode(data) if telemetry.is_binary(data) or not self._legacy \
+                else telemetry.decode_legacy(data)  # Unpack data
+        except Exception:  # Malformed or foreign datagram, drop it
+            DECODE_FAILED.inc()
+            return None, ()
+
+        if telemetry.is_binary(data):  # Legacy readings have no sequence
+            return self._tracker.track(records, *telemetry.options(data))
+        return records, ()
+
+    def done(self, committed, records, acks, send):
+        """Answers readings once the database is done with them, acks are only sent for committed readings
+
+        :param bool committed: If the readings were committed, else they are asked for again
+        :param np.ndarray records: The readings
+        :param list acks: (ack, address) pairs of the datagrams they came in
+        :param send: sendto of the socket or transport
+        :rtype: None"""
+        if committed:
+            send_acks(send, acks)
+        elif acks:
+            self._tracker.forget(records)
 
 
 class Receiver:
-    def __init__(self, address, database):
+    def __init__(self, address, database, legacy=False):
         """Initiates the receiver with given address (udp)
 
+        One receiver serves every station on one socket, telling them apart by the station id in each reading.
+        Datagrams waiting in the socket are read in batches into one reusable buffer, and each batch is handed to a
+        writer thread as one array, so a slow commit doesn't stop receiving. Reliable stations are acked once their
+        readings are committed.
+
         :param tuple address: Address (address, port) to start the receiver on
         :param Database database: The database to send from
+        :param bool legacy: Also accept pickled readings from old stations, only for trusted networks
         :rtype: None"""
         self._address = address
+        self._decoder = Decoder(legacy)
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)  # Absorbs bursts from everyone
 
         self._database = database  # Database
+        self._batches = Queue(maxsize=64)  # Batches of readings and their acks for the writer, None stops it
+
+        self._buffer = bytearray(BATCH_BUFFER)
+        self._view = memoryview(self._buffer)
 
         self._shut_down = threading.Event()  # Off button for _update
+        self._threads = []
+
+    def _drain(self):
+        """Reads the datagrams waiting in the socket, waiting up to POLL_INTERVAL for the first one
+
+        :return: (offset, length, address) of each datagram in the buffer
+        :rtype: list"""
+        datagrams = []
+        if not select.select([self._socket], [], [], POLL_INTERVAL)[0]:
+            return datagrams
+        offset = 0
+        try:
+            while BATCH_BUFFER - offset >= 65535:  # Room for any datagram
+                length, address = self._socket.recvfrom_into(self._view[offset:], 65535)
+                datagrams.append((offset, length, address))
+                offset += length
+        except BlockingIOError:  # Nothing more waiting
+            pass
+        return datagrams
 
     def _update(self):
-        """Receives the data and stores it in database until stopped
+        """Receives the data and hands it to the writer until stopped
 
         :rtype: None"""
-        while not self._shut_down.isSet():  # While on
-            data, _ = self._socket.recvfrom(4096)  # Receive data, don't care about address
-
-            if data == b'exit':
-                break
-
-            station_id, temperature, precipitation = pickle.loads(data)  # Unpack data
+        self._socket.setblocking(False)  # Reads stop at the first empty one
+        while not self._shut_down.is_set():  # While on
+            batch, acks = [], []
+            for offset, length, address in self._drain():
+                records, replies = self._decoder.decode(self._view[offset:offset + length])
+                if records is not None:  # Even if every reading is a duplicate, its acks wait for the writer
+                    batch.append(records)
+                acks.extend((ack, address) for ack in replies)
+
+            if batch:
+                self._batches.put((np.concatenate(batch), acks))  # Copies the readings out of the buffer
+
+        self._batches.put(None)
+        # Close socket
+        self._socket.close()
 
-            self._database.write(station_id, temperature, precipitation)  # Write data to database
+    def _write(self):
+        """Writes batches of readings to the database until the receiver stops
 
-        # Close socket and database
-        self._socket.close()
+        :rtype: None"""
+        item = self._batches.get()
+        while item is not None:
+            records, acks = item
+            try:
+                self._database.write_records(records, partial(self._decoder.done, records=records, acks=acks,
+                                                              send=self._socket.sendto) if acks else None)
+            except sqlite3.Error as e:  # Not acked, reliable stations send the readings again
+                print(f"SERVER: Writing readings failed: '{e}'")
+            item = self._batches.get()
 
     def start(self):
-        """Starts the receiver on a separate thread
+        """Starts the receiver and its writer on separate threads
 
         :rtype: None"""
-        self._socket.bind(('localhost', 0))
+        self._socket.bind(self._address)
 
-        threading.Thread(target=self._update).start()  # Starts thread that receives data and stores it
+        self._threads = [threading.Thread(target=self._update), threading.Thread(target=self._write)]
+        for thread in self._threads:  # Starts threads that receive data and store it
+            thread.start()
 
     def stop(self):
-        """Stops the receiver
+        """Stops the receiver, and waits until the readings it got are handed to the database
 
         :rtype: None"""
         self._shut_down.set()  # Stops thread that receives data
+        for thread in self._threads:
+            thread.join()
 
     @property
     def address(self):
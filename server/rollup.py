@@ -0,0 +1,152 @@
+import numpy as np
+
+RESOLUTIONS = {'hourly': 3600, 'daily': 86400}  # Seconds per rollup bucket
+
+_STATS = ('count', 'temperature_min', 'temperature_max', 'temperature_sum',
+          'precipitation_min', 'precipitation_max', 'precipitation_sum')
+
+_SUMMARY_UPSERT = ("INSERT INTO station_summary (station_id, count, last_index, last_temperature, last_precipitation) "
+                   "VALUES (?, ?, ?, ?, ?) ON CONFLICT(station_id) DO UPDATE SET count = count + excluded.count, "
+                   "last_index = excluded.last_index, last_temperature = excluded.last_temperature, "
+                   "last_precipitation = excluded.last_precipitation;")
+
+_ROLLUP_UPSERT = ("INSERT INTO station_rollup (resolution, station_id, bucket, count, temperature_min, "
+                  "temperature_max, temperature_sum, precipitation_min, precipitation_max, precipitation_sum) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                  "ON CONFLICT(resolution, station_id, bucket) DO UPDATE SET count = count + excluded.count, "
+                  "temperature_min = MIN(temperature_min, excluded.temperature_min), "
+                  "temperature_max = MAX(temperature_max, excluded.temperature_max), "
+                  "temperature_sum = temperature_sum + excluded.temperature_sum, "
+                  "precipitation_min = MIN(precipitation_min, excluded.precipitation_min), "
+                  "precipitation_max = MAX(precipitation_max, excluded.precipitation_max), "
+                  "precipitation_sum = precipitation_sum + excluded.precipitation_sum;")
+
+
+def create_tables(cursor):
+    """Creates the rollup tables if they don't exist
+
+    :param sqlite3.Cursor cursor: Cursor of the writing connection
+    :return: If the tables were created now, and have to be backfilled
+    :rtype: bool"""
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'station_summary';")
+    exists = cursor.fetchone()[0]
+
+    cursor.execute("CREATE TABLE IF NOT EXISTS station_summary (station_id INTEGER PRIMARY KEY, count INTEGER NOT NULL,"
+                   "last_index INTEGER, last_temperature FLOAT, last_precipitation FLOAT);")
+    cursor.execute("CREATE TABLE IF NOT EXISTS station_rollup (resolution INTEGER NOT NULL, "
+                   "station_id INTEGER NOT NULL, bucket INTEGER NOT NULL, count INTEGER NOT NULL, "
+                   "temperature_min FLOAT, temperature_max FLOAT,"
+                   "temperature_sum FLOAT, precipitation_min FLOAT, precipitation_max FLOAT, precipitation_sum FLOAT,"
+                   "PRIMARY KEY (resolution, station_id, bucket)) WITHOUT ROWID;")
+    return not exists
+
+
+def _group(keys, *columns):
+    """Groups rows by key, returns the keys and per-group count, min, max and sum of every column
+
+    :param np.ndarray keys: Structured or 1-D key per row
+    :rtype: tuple"""
+    unique, inverse, count = np.unique(keys, return_inverse=True, return_counts=True)
+    stats = [count]
+    for values in columns:
+        low = np.full(len(unique), np.inf)
+        high = np.full(len(unique), -np.inf)
+        np.minimum.at(low, inverse, values)
+        np.maximum.at(high, inverse, values)
+        stats += [low, high, np.bincount(inverse, values, len(unique))]
+    return unique, inverse, stats
+
+
+def update(cursor, index, station, temperature, precipitation, timestamp):
+    """Adds a batch of newly inserted rows to the rollups, in the caller's transaction
+
+    :param sqlite3.Cursor cursor: Cursor of the writing connection
+    :param np.ndarray index: data_index of each row, increasing
+    :param np.ndarray station: station_id of each row
+    :param np.ndarray temperature: Temperature of each row
+    :param np.ndarray precipitation: Precipitation of each row
+    :param np.ndarray timestamp: Unix time each row was measured, the rollup buckets are taken from this, NaN if unknown
+    :rtype: None"""
+    stations, inverse, (count, *_) = _group(station)
+    last = np.zeros(len(stations), np.int64)
+    last[inverse] = np.arange(len(index))  # Later rows overwrite earlier ones, leaving each station's last row
+    cursor.executemany(_SUMMARY_UPSERT, zip(stations.tolist(), count.tolist(), index[last].tolist(),
+                                            temperature[last].tolist(), precipitation[last].tolist()))
+
+    known = ~np.isnan(timestamp)  # Rows from before timestamps were stored have no bucket
+    station, temperature, precipitation, timestamp = \
+        station[known], temperature[known], precipitation[known], timestamp[known]
+    if not len(station):
+        return
+    for seconds in RESOLUTIONS.values():
+        keys = np.rec.fromarrays((station, (timestamp // seconds * seconds).astype(np.int64)), names='s,b')
+        groups, _, stats = _group(keys, temperature, precipitation)
+        cursor.executemany(_ROLLUP_UPSERT, zip([seconds] * len(groups), groups['s'].tolist(), groups['b'].tolist(),
+                                               *(s.tolist() for s in stats)))
+
+
+def rebuild(cursor, chunks):
+    """Recomputes every rollup from the readings, e.g. for databases created before rollups existed
+
+    Rows without a measurement time are counted in the summary, but can't be placed in an hourly or daily bucket.
+
+    :param sqlite3.Cursor cursor: Cursor of the writing connection
+    :param chunks: Iterable of (data_index, station_id, temperature, precipitation, measured_ts) arrays, in index
+        order
+    :rtype: None"""
+    clear(cursor)
+    for index, station, temperature, precipitation, timestamp in chunks:
+        update(cursor, index, station, temperature, precipitation, timestamp)
+
+
+def clear(cursor):
+    """Empties the rollup tables
+
+    :param sqlite3.Cursor cursor: Cursor of the writing connection
+    :rtype: None"""
+    cursor.execute("DELETE FROM station_summary;")
+    cursor.execute("DELETE FROM station_rollup;")
+
+
+def read_summary(cursor):
+    """Reads count and last reading of every station
+
+    :param sqlite3.Cursor cursor: Cursor to read with
+    :return: station_id -> (count, last data_index, last temperature, last precipitation)
+    :rtype: dict"""
+    cursor.execute("SELECT station_id, count, last_index, last_temperature, last_precipitation FROM station_summary;")
+    return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+
+def read(cursor, resolution, station_id=None, ts_from=0, ts_to=None):
+    """Reads rollup buckets, as column arrays per station
+
+    :param sqlite3.Cursor cursor: Cursor to read with
+    :param int resolution: Seconds per bucket, one of RESOLUTIONS
+    :param int station_id: Only read this station
+    :param float ts_from: Earliest bucket start (inclusive)
+    :param float ts_to: Latest bucket start (inclusive), None for newest
+    :return: station_id -> dict of 'bucket', 'count' and min/mean/max/sum arrays of temperature and precipitation
+    :rtype: dict"""
+    query = "SELECT station_id, bucket, " + ", ".join(_STATS) + " FROM station_rollup WHERE resolution = ? " \
+            "AND bucket >= ?"
+    params = [resolution, ts_from]
+    if ts_to is not None:
+        query += " AND bucket <= ?"
+        params.append(ts_to)
+    if station_id is not None:
+        query += " AND station_id = ?"
+        params.append(station_id)
+    cursor.execute(query + " ORDER BY station_id, bucket;", params)  # Primary key order, no sorting needed
+
+    table = np.array(cursor.fetchall(), np.float64).reshape(-1, 2 + len(_STATS))
+    stations, starts = np.unique(table[:, 0], return_index=True)
+    result = {}
+    for station, rows in zip(stations.astype(np.int64).tolist(), np.split(table, starts[1:])):
+        columns = {'bucket': rows[:, 1].astype(np.int64), 'count': rows[:, 2].astype(np.int64)}
+        for i, name in enumerate(_STATS[1:], 3):
+            columns[name] = rows[:, i]
+        for name in ('temperature', 'precipitation'):
+            columns[name + '_mean'] = columns[name + '_sum'] / columns['count']
+        result[station] = columns
+    return result
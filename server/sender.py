@@ -1,28 +1,83 @@
 import pickle
+from functools import partial
+from queue import Empty, Full, Queue
 from socket import socket
 import threading
+from time import perf_counter
 
+from protocol import columnar
+from protocol.framing import FrameReader, send_frame
 from server.database import Database
+from server.metrics import REGISTRY
+
+PUSH_BACKLOG = 256  # Batches of readings queued for a subscriber before new ones are dropped
+IMPORT_BACKLOG = 8  # Chunks of an import queued for the database before reading more from the client waits
+IMPORT_TIMEOUT = 60  # Seconds an import waits for the client's next chunk before it fails
+COMMANDS = ('get-data', 'get-columns', 'get-stream', 'get-range', 'get-agg', 'get-summary', 'get-rollup', 'export',
+            'import', 'status', 'get-index', 'subscribe', 'unsubscribe', 'ping', 'metrics', 'exit',
+            'clear')  # Others are counted as 'unknown'
+
+
+def _received(chunks):
+    """Decodes the chunks of an import as they arrive, until the empty frame
+
+    :param Queue chunks: Payloads of the import's frames, None if the client went away
+    :return: Iterator of station_id -> column arrays
+    :rtype: iterator"""
+    while True:
+        try:
+            payload = chunks.get(timeout=IMPORT_TIMEOUT)
+        except Empty:
+            raise TimeoutError("Client stopped sending during import") from None
+        if payload is None:
+            raise ConnectionResetError("Client closed during import")
+        if not payload:
+            return
+        yield columnar.decode(payload, columnar.TIMED)
+
+
+def _encoded(chunks):
+    """Encodes the chunks of a streamed read, then the empty frame, or b'error' if the read failed
+
+    :param chunks: Iterator of station_id -> column arrays
+    :return: Iterator of payloads
+    :rtype: iterator"""
+    try:
+        for columns in chunks:
+            yield columnar.encode(columns, columnar.TIMED)
+    except Exception as e:  # The client is told instead of waiting for the rest
+        print(f"SERVER: Streamed read failed: '{e}'")
+        yield b'error'
+        return
+    yield b''
 
 
 class Sender:
-    def __init__(self, sock: socket, database: Database):
+    def __init__(self, sock: socket, database: Database, workers=None):
         """Initiates the sender with given address (tcp)
 
         :param socket sock: Address (address, port) to start tcp connection on
         :param Database database: The database to send from
+        :param WorkerPool workers: Ingest workers to report on in status, if the server runs any
         :rtype: None"""
         self._socket = sock
 
         self._database = database
+        self._workers = workers
 
         self._shut_down = threading.Event()
 
-    def _parse_tcp(self, data):
+        self._send_lock = threading.Lock()  # Pushed readings and responses share the socket
+        self._subscription = None  # (listener, queue of readings) of the current subscription
+        self._imports = dict()  # Request id -> queue of frames, of imports being received, None once one failed
+        self._imports_lock = threading.Lock()
+
+    def _parse_tcp(self, data, request_id=0):
         """Parses the request, gets the requested data from the database and returns the data as bytes
 
         :param str data: The request
-        :return: The requested data in bytes
+        :param int request_id: Id of the request, pushed readings are sent with the id of the subscribe request
+        :return: The requested data in bytes, None if it is sent by a stream
         :rtype: bytes"""
         data = data.split(' ')
         cmd = data[0].lower()
@@ -34,6 +89,8 @@ class Sender:
         if cmd == 'get-data':
             if len(args) == 0:
                 station_data = self._database.read()
+            elif len(args) == 2 and args[0].lower() == 'since' and args[1].isdigit():
+                return pickle.dumps(self._database.read_since(int(args[1])))  # (data, new highest index)
             elif len(args) == 1 and args[0].isdigit():
                 station_data = self._database.read(int(args[0]))
             elif len(args) == 2 and all(x.isdigit() for x in args):
@@ -42,9 +99,83 @@ class Sender:
                 return b'error'
                 
             return pickle.dumps(station_data)
+        elif cmd == 'get-columns':
+            if len(args) == 0:
+                columns = self._database.read_columns()
+            elif len(args) == 2 and args[0].lower() == 'since' and args[1].isdigit():
+                columns = self._database.read_columns(since=int(args[1]))
+            elif len(args) == 1 and args[0].isdigit():
+                columns = self._database.read_columns(int(args[0]))
+            elif len(args) == 2 and all(x.isdigit() for x in args):
+                columns = self._database.read_columns(int(args[0]), int(args[1]))
+            else:
+                return b'error'
+
+            return columnar.encode(columns)  # Raw array buffers, no per-row objects
+        elif cmd == 'get-stream':  # get-stream [FROM] [TO] [STATION] [LIMIT], '*' for any; chunks, then an empty frame
+            if len(args) > 4 or not all(x.isdigit() or x == '*' for x in args):
+                return b'error'
+
+            idx_from, idx_to, station, limit = (None if x == '*' else int(x) for x in (args + ['*'] * 4)[:4])
+            self._stream(self._database.read_chunks(idx_from or 0, -1 if idx_to is None else idx_to, station, limit),
+                         request_id)
+            return None
+        elif cmd == 'get-range':  # get-range FROM_TS [TO_TS] [STATION], readings by measurement time
+            try:
+                ts_from, ts_to = (None if x == '*' else float(x) for x in (args + ['*'])[:2])
+            except ValueError:
+                return b'error'
+            if len(args) not in (1, 2, 3) or ts_from is None or not all(x.isdigit() for x in args[2:]):
+                return b'error'
+
+            station = int(args[2]) if len(args) == 3 else None
+            return columnar.encode(self._database.read_range(ts_from, ts_to, station), columnar.TIMED)
+        elif cmd == 'get-agg':  # get-agg FROM TO POINTS [lttb]
+            if len(args) not in (3, 4) or not all(x.lstrip('-').isdigit() for x in args[:3]) \
+                    or int(args[2]) < 1 or [x.lower() for x in args[3:]] not in ([], ['lttb']):
+                return b'error'
+
+            idx_from, idx_to, points = (int(x) for x in args[:3])
+            if len(args) == 4:
+                return columnar.encode(self._database.read_downsampled(idx_from, idx_to, points))
+            return columnar.encode(self._database.read_aggregates(idx_from, idx_to, points), columnar.AGGREGATES)
+        elif cmd == 'get-summary':
+            return pickle.dumps(self._database.read_summary())  # {station_id: (count, last index, temp, rain)}
+        elif cmd == 'get-rollup':  # get-rollup hourly|daily [STATION] [FROM_TS] [TO_TS]
+            if len(args) not in range(1, 5) or args[0].lower() not in ('hourly', 'daily') \
+                    or not all(x.isdigit() or x == '*' for x in args[1:]):
+                return b'error'
+
+            station, ts_from, ts_to = (args[1:] + ['*'] * 3)[:3]
+            rollups = self._database.read_rollups(args[0].lower(), None if station == '*' else int(station),
+                                                  0 if ts_from == '*' else int(ts_from),
+                                                  None if ts_to == '*' else int(ts_to))
+            return columnar.encode(rollups, columnar.ROLLUPS)
+        elif cmd == 'export':  # Every reading from one snapshot, in chunks like get-stream
+            self._stream(self._database.export(), request_id)
+            return None
+        elif cmd == 'import':  # Chunks follow in frames with this request's id, then an empty frame; answers the count
+            self._import(request_id)
+            return None
         elif cmd == 'status':
-            return "Database contains {} data points from {} unique stations."\
-                .format(self._database.get_count(), self._database.get_station_count()).encode()
+            status = "Database contains {} data points from {} unique stations."\
+                .format(self._database.get_count(), self._database.get_station_count())
+            if self._workers is not None:
+                for worker_id, rate, rows, datagrams in self._workers.rates():
+                    status += f"\n\tWorker {worker_id}: {rate:.1f} rows/s, {rows} rows from {datagrams} datagrams."
+            return status.encode()
+        elif cmd == 'get-index':  # Highest data_index, cheap enough to poll to see if anything changed
+            return str(self._database.get_index()).encode()
+        elif cmd == 'subscribe':  # Answers 'ok', then pushes new readings (get-columns format) with this request's id
+            self._subscribe(request_id)
+            return b'ok'
+        elif cmd == 'unsubscribe':
+            self._unsubscribe()
+            return b'ok'
+        elif cmd == 'metrics':  # Counters and histograms of this server process, in the Prometheus text format
+            return REGISTRY.render().encode()
+        elif cmd == 'ping':
+            return b'pong'
         elif cmd == 'exit':
             return b'exit'
         elif cmd == 'clear':
@@ -53,27 +184,202 @@ class Sender:
         else:
             return b'error'
 
+    def _answer(self, data, request_id=0):
+        """Answers a request like _parse_tcp, and records how long it took per command
+
+        :param str data: The request
+        :param int request_id: Id of the request
+        :return: The requested data in bytes
+        :rtype: bytes"""
+        start = perf_counter()
+        resp = self._parse_tcp(data, request_id)
+        cmd = data.split(' ', 1)[0].lower()
+        command = cmd if cmd in COMMANDS else 'unknown'
+        REGISTRY.histogram('sender_request_seconds', 'Time to answer a request', command=command)\
+            .observe(perf_counter() - start)
+        if resp == b'error':
+            REGISTRY.counter('sender_errors_total', 'Requests answered with error', command=command).inc()
+        return resp
+
     def _update(self):
         """Constantly receives requests and sends the requested data back
 
         :rtype: None"""
+        reader = FrameReader(self._socket)
         while not self._shut_down.isSet():
             # Database read
             try:
-                data = self._socket.recv(4096)  # Receives request TODO add timeout for shutdown check
+                request_id, data = reader.read()  # Receives request TODO add timeout for shutdown check
             except ConnectionResetError:
                 print("A fmi somewhere closed")
                 break
 
-            resp = self._parse_tcp(data.decode())
+            if request_id in self._imports:  # Chunk of an import, not a request
+                self._chunk(request_id, bytes(data))
+                continue
+
+            resp = self._answer(bytes(data).decode(), request_id)
             if resp == b'exit':
                 self.stop()
-            else:
-                self._socket.send(resp + b'EOF')  # Responds with data
+            elif resp is not None:
+                with self._send_lock:
+                    send_frame(self._socket, resp, request_id)  # Responds with data, tagged with the request's id
 
         # Closes socket and database when done
+        self._unsubscribe()
+        self._abort_imports()
         self._socket.close()
 
+    def _subscribe(self, request_id):
+        """Starts pushing new readings to the client
+
+        :param int request_id: Id to send the readings with
+        :rtype: None"""
+        if self._subscription is None:
+            pushes = Queue(PUSH_BACKLOG)  # One per subscription, a pusher still sending after unsubscribe keeps its own
+            self._subscription = partial(self._push, pushes), pushes
+            threading.Thread(target=self._pusher, args=(pushes, request_id)).start()
+            self._database.subscribe(self._subscription[0])
+
+    def _unsubscribe(self):
+        """Stops pushing new readings
+
+        :rtype: None"""
+        if self._subscription is not None:
+            push, pushes = self._subscription
+            self._database.unsubscribe(push)
+            self._subscription = None
+            pushes.put(None)  # Stops pusher once it has sent what is queued
+
+    def _stream(self, chunks, request_id):
+        """Starts sending a streamed read, next to other requests
+
+        :param chunks: Iterator of station_id -> column arrays, from Database.read_chunks
+        :param int request_id: Id to send the chunks with
+        :rtype: None"""
+        threading.Thread(target=self._streamer, args=(chunks, request_id)).start()
+
+    def _streamer(self, chunks, request_id):
+        """Sends chunks as they are read, then an empty frame, or b'error' if reading fails
+
+        A client that reads slowly blocks the send, so the next chunk isn't read before there is room for it.
+
+        :param chunks: Iterator of station_id -> column arrays
+        :param int request_id: Id to send the chunks with
+        :rtype: None"""
+        try:
+            for payload in _encoded(chunks):
+                with self._send_lock:
+                    send_frame(self._socket, payload, request_id)
+        except OSError:  # Client is gone, _update cleans up
+            pass
+        finally:
+            chunks.close()
+
+    def _import(self, request_id):
+        """Starts loading the chunks the client sends next with this request's id
+
+        :param int request_id: Id of the import request
+        :rtype: None"""
+        chunks = self._imports[request_id] = Queue(IMPORT_BACKLOG)
+        threading.Thread(target=self._importer, args=(chunks, request_id)).start()
+
+    def _chunk(self, request_id, payload):
+        """Hands a frame of an import to the importer, waiting while the database is behind
+
+        :param int request_id: Id of the import request
+        :param bytes payload: Encoded chunk, empty at the end
+        :rtype: None"""
+        with self._imports_lock:
+            chunks = self._imports[request_id]
+            if not payload:
+                del self._imports[request_id]
+        if chunks is not None:  # Else the import failed, the rest of its frames are dropped
+            chunks.put(payload)
+
+    def _close_import(self, request_id, chunks):
+        """Drops the frames of an import that is over, so reading from the client never waits for it again
+
+        :param int request_id: Id of the import request
+        :param Queue chunks: Payloads of the import's frames
+        :rtype: None"""
+        with self._imports_lock:
+            if self._imports.get(request_id) is chunks:  # The client is still sending
+                self._imports[request_id] = None
+        while True:  # Frees a put that is waiting for room
+            try:
+                chunks.get_nowait()
+            except Empty:
+                break
+
+    def _abort_imports(self):
+        """Rolls back imports the client didn't finish
+
+        :rtype: None"""
+        with self._imports_lock:
+            imports = [chunks for chunks in self._imports.values() if chunks is not None]
+            self._imports.clear()
+        for chunks in imports:
+            chunks.put(None)
+
+    def _load(self, chunks, request_id):
+        """Loads the chunks of an import into the database
+
+        :param Queue chunks: Payloads of the import's frames
+        :param int request_id: Id of the import request
+        :return: Readings loaded, b'error' if nothing was loaded, None if the client is gone
+        :rtype: bytes"""
+        try:
+            return str(self._database.load(_received(chunks))).encode()
+        except ConnectionResetError:
+            return None
+        except Exception as e:  # Bad chunk or stalled client, the load was rolled back
+            print(f"SERVER: Import failed: '{e}'")
+            return b'error'
+        finally:
+            self._close_import(request_id, chunks)
+
+    def _importer(self, chunks, request_id):
+        """Loads an import, then answers its request
+
+        :param Queue chunks: Payloads of the import's frames
+        :param int request_id: Id of the import request
+        :rtype: None"""
+        resp = self._load(chunks, request_id)
+        if resp is not None:
+            try:
+                with self._send_lock:
+                    send_frame(self._socket, resp, request_id)
+            except OSError:  # Client is gone
+                pass
+
+    @staticmethod
+    def _push(pushes, columns):
+        """Database listener, queues new readings for the pusher
+
+        :param Queue pushes: Queue of the subscription
+        :param dict columns: station_id -> column arrays of the new rows
+        :rtype: None"""
+        try:
+            pushes.put_nowait(columns)
+        except Full:  # Client can't keep up, it can catch up with 'get-columns since N'
+            pass
+
+    def _pusher(self, pushes, request_id):
+        """Sends queued readings to the client until unsubscribed
+
+        :param Queue pushes: Queue of the subscription
+        :param int request_id: Id of the subscription, to send the readings with
+        :rtype: None"""
+        columns = pushes.get()
+        while columns is not None:
+            try:
+                with self._send_lock:
+                    send_frame(self._socket, columnar.encode(columns), request_id)
+            except OSError:  # Client is gone, _update cleans up
+                pass
+            columns = pushes.get()
+
     def start(self):
         """Starts the sender
 
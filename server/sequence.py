@@ -0,0 +1,147 @@
+from threading import Lock
+
+import numpy as np
+
+from protocol import telemetry
+from server.metrics import REGISTRY
+
+WINDOW = 4096  # Sequences a station may run ahead of a missing reading before it is given up
+
+GAPS = REGISTRY.counter('receiver_sequence_gaps_total', 'Readings missing when a later one of the station arrived')
+RECOVERED = REGISTRY.counter('receiver_gaps_recovered_total', 'Missing readings that arrived late or again')
+LOST = REGISTRY.counter('receiver_gaps_lost_total', 'Missing readings given up on, the station ran WINDOW ahead')
+DUPLICATES = REGISTRY.counter('receiver_duplicates_total', 'Readings that arrived again, dropped if the station is '
+                                                           'reliable')
+RESTARTS = REGISTRY.counter('receiver_station_restarts_total', 'Stations that started their sequence over')
+
+
+class _Station:
+    __slots__ = ('session', 'reliable', 'expected', 'next', 'missing')
+
+    def __init__(self, session, first, reliable=False):
+        """Sequence state of one station
+
+        :param int session: Session of the station
+        :param int first: First sequence of the session
+        :param bool reliable: If the station retransmits until acked
+        :rtype: None"""
+        self.session = session
+        self.reliable = reliable
+        self.expected = first  # Lowest sequence not received yet, every one before arrived or was given up
+        self.next = first  # One past the highest sequence received
+        self.missing = set()  # Sequences between expected and next that didn't arrive
+
+
+class SequenceTracker:
+    def __init__(self):
+        """Follows the sequence numbers of every station, to find lost, late and repeated readings
+
+        Binary datagrams carry a sequence per reading. Gaps are kept per station until the readings arrive after all
+        or the station is WINDOW sequences ahead. Repeated readings are dropped for reliable stations, which retransmit
+        until acked, and only counted for the others. A reliable station starts a new session when it starts over,
+        another station starts over when its sequence goes back by more than WINDOW.
+
+        :rtype: None"""
+        self._lock = Lock()
+        self._stations = dict()
+
+    def _give_up(self, state):
+        """Drops missing sequences more than WINDOW behind the newest
+
+        :param _Station state: Station to trim
+        :rtype: None"""
+        oldest = state.next - WINDOW
+        lost = [s for s in state.missing if s < oldest]
+        state.missing.difference_update(lost)
+        LOST.inc(len(lost))
+        state.expected = min(state.missing) if state.missing else state.next
+
+    def _seen(self, state, sequence):
+        """Records one sequence
+
+        :param _Station state: Station the reading is from
+        :param int sequence: Sequence of the reading
+        :return: Whether it is new
+        :rtype: bool"""
+        if sequence == state.next:  # In order, the usual case
+            state.next += 1
+            if not state.missing:
+                state.expected = state.next
+            return True
+
+        if sequence > state.next:  # Readings in between are missing, for now
+            GAPS.inc(sequence - state.next)
+            oldest = sequence + 1 - WINDOW  # Anything before is given up once this arrived
+            if oldest > state.next:  # Don't track what would be given up right away
+                LOST.inc(oldest - state.next)
+            state.missing.update(range(max(state.next, oldest), sequence))
+            state.next = sequence + 1
+            if state.expected < oldest:
+                self._give_up(state)
+            return True
+
+        if sequence in state.missing:  # Late or retransmitted
+            state.missing.remove(sequence)
+            RECOVERED.inc()
+            if sequence == state.expected:
+                while state.expected < state.next and state.expected not in state.missing:
+                    state.expected += 1
+            return True
+
+        DUPLICATES.inc()
+        return False
+
+    def track(self, records, flags=0, session=0):
+        """Records the sequences of a datagram's readings
+
+        :param np.ndarray records: Decoded readings, with dtype telemetry.RECORD
+        :param int flags: Flags of the datagram, see telemetry.options
+        :param int session: Session of the datagram
+        :return: Readings to store, and acks to send back if the datagram asked for them
+        :rtype: tuple"""
+        reliable = bool(flags & telemetry.RELIABLE)
+        ids, sequences = records['station_id'].tolist(), records['sequence'].tolist()
+        new = []
+        with self._lock:
+            for station_id, sequence in zip(ids, sequences):
+                state = self._stations.get(station_id)
+                if state is None:
+                    # Reliable stations send their oldest reading first, and wait for the ack before sending more
+                    state = self._stations[station_id] = _Station(session, sequence, reliable)
+                elif reliable and session != state.session or \
+                        not reliable and sequence + WINDOW < state.next:
+                    RESTARTS.inc()
+                    state = self._stations[station_id] = _Station(session, sequence, reliable)
+                new.append(self._seen(state, sequence))
+
+            acks = []
+            if reliable:
+                for station_id in dict.fromkeys(ids):  # Once per station, in order
+                    state = self._stations[station_id]
+                    acks.append(telemetry.encode_ack(station_id, session, state.expected, sorted(state.missing)))
+
+        if reliable and not all(new):
+            records = records[np.array(new, bool)]
+        return records, acks
+
+    def forget(self, records):
+        """Marks readings of reliable stations as missing again, after they couldn't be stored
+
+        The next acks list them, so the stations send them again.
+
+        :param np.ndarray records: Readings returned by track
+        :rtype: None"""
+        with self._lock:
+            for station_id, sequence in zip(records['station_id'].tolist(), records['sequence'].tolist()):
+                state = self._stations.get(station_id)
+                if state is not None and state.reliable and sequence < state.next:
+                    state.missing.add(sequence)
+                    state.expected = min(state.expected, sequence)
+
+    def gaps(self):
+        """Readings currently missing per station
+
+        :return: station_id -> missing sequences
+        :rtype: dict"""
+        with self._lock:
+            return {station_id: len(state.missing) for station_id, state in self._stations.items() if state.missing}
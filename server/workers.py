@@ -0,0 +1,194 @@
+import multiprocessing
+import sqlite3
+from collections import deque
+from functools import partial
+from queue import Empty
+from socket import socket, timeout, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF, SO_REUSEPORT
+from threading import Lock, Thread
+from time import monotonic
+
+import numpy as np
+
+from protocol import telemetry
+from server.receiver import DATAGRAMS, DECODE_FAILED, POLL_INTERVAL, RECEIVE_BUFFER, Decoder
+
+RATE_WINDOW = 10  # Seconds that worker rates are averaged over
+
+
+def _joined(batch):
+    """Joins the readings of a batch into one array
+
+    :param list batch: Decoded readings, with dtype telemetry.RECORD
+    :rtype: np.ndarray"""
+    return np.concatenate(batch) if batch else np.zeros(0, telemetry.RECORD)
+
+
+def _ingest(worker_id, address, rows_out, acks_in, ready, stop, legacy, batch_size, flush_interval):
+    """Worker process: receives datagrams on a shared port and passes batches of records to the writer
+
+    Reliable stations are acked from the worker's socket once the writer reports their readings committed.
+
+    :param int worker_id: Id reported with every batch
+    :param tuple address: UDP address shared by all workers
+    :param multiprocessing.Queue rows_out: Queue to the writer, gets (worker_id, records, datagrams, failed, acks),
+        failed counts datagrams that couldn't be decoded
+    :param multiprocessing.Queue acks_in: Queue from the writer, gets (committed, records, acks) of batches with acks
+    :param multiprocessing.Semaphore ready: Released once the socket is bound
+    :param multiprocessing.Event stop: Set to stop the worker
+    :param bool legacy: Also accept pickled readings
+    :param int batch_size: Records that trigger a hand-off
+    :param float flush_interval: Max seconds records wait before they are handed off, None to wait for batch_size
+    :rtype: None"""
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)  # The kernel spreads datagrams over all workers
+    sock.setsockopt(SOL_SOCKET, SO_RCVBUF, RECEIVE_BUFFER)
+    sock.bind(address)
+    # Acks are sent and the stop flag is checked between datagrams
+    sock.settimeout(POLL_INTERVAL if flush_interval is None else min(flush_interval, POLL_INTERVAL))
+    ready.release()
+
+    decoder = Decoder(legacy)  # A station stays with one worker while its address does. Counts stay in here.
+    batch, acks, size, datagrams, failed, last = [], [], 0, 0, 0, monotonic()
+    while not stop.is_set():
+        try:
+            data, sender = sock.recvfrom(65535)
+        except (timeout, BlockingIOError):  # Nothing arrived, BlockingIOError with a flush_interval of 0
+            data = None
+        if data is not None:
+            records, replies = decoder.decode(data)
+            if records is None:  # Malformed or foreign datagram, dropped but counted
+                failed += 1
+            else:
+                batch.append(records)
+                acks.extend((ack, sender) for ack in replies)
+                size += len(records)
+                datagrams += 1
+
+        if (batch or failed) and (size >= batch_size or
+                                  flush_interval is not None and monotonic() - last >= flush_interval):
+            rows_out.put((worker_id, _joined(batch), datagrams, failed, acks))
+            batch, acks, size, datagrams, failed, last = [], [], 0, 0, 0, monotonic()
+
+        while True:
+            try:
+                decoder.done(*acks_in.get_nowait(), send=sock.sendto)
+            except Empty:
+                break
+
+    if batch or failed:
+        rows_out.put((worker_id, _joined(batch), datagrams, failed, acks))
+    sock.close()
+
+
+class WorkerPool:
+    def __init__(self, address, database, workers, legacy=False, batch_size=256, flush_interval=0.5):
+        """Ingest processes sharing one SO_REUSEPORT socket, and the thread writing their batches to the database
+
+        :param tuple address: UDP address the workers share
+        :param Database database: The database to write to
+        :param int workers: Amount of worker processes
+        :param bool legacy: Also accept pickled readings, only for trusted networks
+        :param int batch_size: Records a worker collects before handing them off
+        :param float flush_interval: Max seconds a worker holds records, None to hold them until batch_size
+        :rtype: None"""
+        self._address = address
+        self._database = database
+
+        context = multiprocessing.get_context('spawn')  # Don't fork the server's threads and database connection
+        self._queue = context.Queue()
+        self._acks = [context.Queue() for _ in range(workers)]  # Results of batches with acks, back to each worker
+        self._ready = context.Semaphore(0)
+        self._stop = context.Event()
+        self._processes = [context.Process(target=_ingest, daemon=True,
+                                           args=(i, address, self._queue, self._acks[i], self._ready, self._stop,
+                                                 legacy, batch_size, flush_interval))
+                           for i in range(workers)]
+        self._writer = Thread(target=self._write)
+
+        self._lock = Lock()
+        self._totals = [[0, 0] for _ in range(workers)]  # Rows and datagrams per worker
+        self._recent = deque()  # (time, worker_id, rows) in the last RATE_WINDOW seconds
+
+    def _write(self):
+        """Writes batches from workers until every worker has stopped
+
+        :rtype: None"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            worker_id, records, datagrams, failed, acks = item
+            DATAGRAMS.inc(datagrams + failed)  # Counted here, the workers' metrics stay in their processes
+            DECODE_FAILED.inc(failed)
+            try:
+                self._database.write_records(records, partial(self._done, worker_id, records, acks) if acks else None)
+            except sqlite3.Error as e:  # Not acked, reliable stations send the readings again
+                print(f"SERVER: Writing readings failed: '{e}'")
+            with self._lock:
+                self._totals[worker_id][0] += len(records)
+                self._totals[worker_id][1] += datagrams
+                self._recent.append((monotonic(), worker_id, len(records)))
+
+    def _done(self, worker_id, records, acks, committed):
+        """Database callback, hands the result of a batch back to its worker
+
+        :param int worker_id: Worker the batch came from
+        :param np.ndarray records: Readings of the batch
+        :param list acks: (ack, address) pairs of the batch
+        :param bool committed: If the readings were committed
+        :rtype: None"""
+        if not self._stop.is_set():  # Else the worker is gone, stations send the readings again
+            self._acks[worker_id].put((committed, records, acks))
+
+    def start(self):
+        """Starts workers and writer, and waits until every worker is receiving
+
+        :rtype: None"""
+        for process in self._processes:
+            process.start()
+        for _ in self._processes:
+            while not self._ready.acquire(timeout=POLL_INTERVAL):
+                exited = [process for process in self._processes if process.exitcode is not None]
+                if exited:  # Couldn't bind or import, it will never be ready
+                    self._stop.set()
+                    for process in self._processes:
+                        process.join()
+                    raise RuntimeError(f"Ingest worker exited with code {exited[0].exitcode} before it was receiving")
+        self._writer.start()
+
+    def stop(self):
+        """Stops workers, and waits until their last batches are written
+
+        :rtype: None"""
+        self._stop.set()
+        for process in self._processes:
+            process.join()
+        for acks in self._acks:  # Nobody reads them anymore, don't wait for them at exit
+            acks.cancel_join_thread()
+        self._queue.put(None)  # Behind every batch the workers sent
+        self._writer.join()
+
+    def rates(self):
+        """Rows per second handled by each worker over the last RATE_WINDOW seconds
+
+        :return: (worker_id, rows per second, total rows, total datagrams) per worker
+        :rtype: list"""
+        now = monotonic()
+        recent = [0] * len(self._processes)
+        with self._lock:
+            while self._recent and self._recent[0][0] < now - RATE_WINDOW:
+                self._recent.popleft()
+            for _, worker_id, rows in self._recent:
+                recent[worker_id] += rows
+            totals = [tuple(t) for t in self._totals]
+
+        return [(i, recent[i] / RATE_WINDOW, rows, datagrams) for i, (rows, datagrams) in enumerate(totals)]
+
+    @property
+    def address(self):
+        """Address the workers receive on
+
+        :return: Address (address, port)
+        :rtype: tuple"""
+        return self._address
@@ -1,7 +1,16 @@
-from server import Server
+import sys
+
+from server import Server, AsyncServer
 
 if __name__ == "__main__":
-    s = Server(('0.0.0.0', 5005), 'test')
+    # 'python server_main.py async' serves everything from one event loop instead of a thread per connection
+    # 'python server_main.py workers N' receives station data in N processes sharing one port
+    if 'async' in sys.argv[1:]:
+        s = AsyncServer(('0.0.0.0', 5005), 'test')
+    elif 'workers' in sys.argv[1:-1]:
+        s = Server(('0.0.0.0', 5005), 'test', workers=int(sys.argv[sys.argv.index('workers') + 1]))
+    else:
+        s = Server(('0.0.0.0', 5005), 'test')
     s.start()
     go = True
     while go:
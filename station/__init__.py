@@ -1,20 +1,40 @@
 import pickle
-from socket import socket, AF_INET, SOCK_DGRAM, SOCK_STREAM
+import random
+from socket import socket, timeout, AF_INET, SOCK_DGRAM, SOCK_STREAM
 import threading
-from time import sleep
+from time import monotonic, sleep, time
 
+from protocol import telemetry
 from station.station import StationSimulator
+from station.fleet import FleetSimulator
+from station.outbox import Outbox
+from station.replay import Replay
+
+RETRANSMIT_AFTER = 1.0  # Seconds without an ack before unacked readings are sent again
+LINGER = 3.0  # Seconds a reliable station waits for its last acks when stopped
 
 
 class Station:
-    def __init__(self, server_addr, interval=1, station_id=0, start_hour=0):
+    def __init__(self, server_addr, interval=1, station_id=0, start_hour=0, batch=1, legacy=False, reliable=False,
+                 outbox=None, capacity=4096):
         """Initiates station
 
+        A reliable station keeps its readings until the server acks them. Acks are cumulative and list the readings
+        that are missing after that, which are sent again right away. When RETRANSMIT_AFTER seconds pass after a
+        send without an ack, the oldest readings are sent again too, however long the interval is.
+
         :param tuple server_addr: Address of station
         :param int interval: Interval of data updates in seconds
         :param int station_id: Id of station
         :param int start_hour: Hour to start simulation on
+        :param int batch: Readings sent together in one datagram
+        :param bool legacy: Send pickled readings, for servers started with legacy=True
+        :param bool reliable: Keep readings until acked, and send them again if they got lost
+        :param str outbox: File to keep unacked readings in across restarts, None to keep them in memory
+        :param int capacity: Max unacked readings kept, the oldest are dropped beyond that
         :rtype: None"""
+        if legacy and reliable:
+            raise ValueError("Legacy readings have no sequence, they can't be sent reliably")
         self._socket = socket(AF_INET, SOCK_DGRAM)  # Creates socket
         self._server_address = server_addr  # Stores the address to send data
 
@@ -22,22 +42,123 @@ class Station:
         self._start_hour = start_hour
 
         self._interval = interval  # Stores the interval
+        self._batch = min(max(1, batch), telemetry.MAX_RECORDS)
+        self._legacy = legacy
+        self._sequence = 0  # Sequence number of next reading
         self._station = StationSimulator(simulation_interval=interval)  # Creates the station simulator
 
+        self._outbox = None  # Unacked readings, if reliable
+        self._session = 0
+        if reliable:
+            self._outbox = Outbox(capacity, outbox)
+            self._sequence = self._outbox.next_sequence
+            self._session = random.getrandbits(16)  # New session every run, so the server knows we started over
+        self._acked = threading.Event()  # Set once the session's first datagram is acked
+        self._last_ack = monotonic()
+        self._unacked_since = None  # When readings were sent with none acked since, None if every sent one is acked
+        self._resent = dict()  # sequence -> when it was last sent again
+        self._resend_lock = threading.Lock()  # Readings are sent again from both threads
+        self._highest_sent = -1
+        self.retransmitted = 0  # Readings sent again
+
         self._shut_down = threading.Event()  # Event for shutdown
+        self._done = threading.Event()  # Set when the sender is done, acks are read until then
 
     def _update(self):
         """Constantly sends data to server
 
         :rtype: None"""
+        readings = []
         while not self._shut_down.wait(self._interval):
-            # Send serialized temperature and rain data to server.
-            self._socket.sendto(pickle.dumps((self._id, self._station.temperature, self._station.rain)),
-                                self._server_address)
+            if self._legacy:
+                # Send serialized temperature and rain data to server.
+                self._socket.sendto(pickle.dumps((self._id, self._station.temperature, self._station.rain)),
+                                    self._server_address)
+                continue
+
+            reading = (self._id, self._sequence, time(), self._station.temperature, self._station.rain)
+            self._sequence += 1
+            if self._outbox is not None:
+                self._outbox.put(reading)
+                if not self._acked.is_set():  # The server starts the session at the first reading it gets
+                    if self._highest_sent < 0 or monotonic() - self._last_ack > RETRANSMIT_AFTER:
+                        self._resend(self._outbox.oldest(telemetry.MAX_RECORDS), force=True)
+                        self._last_ack = monotonic()  # Time of the attempt, until there is an ack
+                    continue
+                since = self._unacked_since  # Not the last ack, a station sending less often waits longer for it
+                if since is not None and monotonic() - since > RETRANSMIT_AFTER:  # Acks don't come, send oldest again
+                    readings = []
+                    self._resend(self._outbox.oldest(telemetry.MAX_RECORDS))
+                    continue
+            readings.append(reading)
+            if len(readings) >= self._batch:
+                self._send(readings)
+                readings = []
+
+        if readings:  # Don't lose the last partial batch
+            self._send(readings)
+        if self._outbox is not None:  # Give the last readings a chance to be acked, the outbox keeps the rest
+            deadline = monotonic() + LINGER
+            while len(self._outbox) and monotonic() < deadline:
+                sleep(0.05)
+                self._resend(self._outbox.oldest(telemetry.MAX_RECORDS))
+            self._done.set()
 
         # Shut down station simulation
         self._station.shut_down()
 
+    def _send(self, readings):
+        """Sends readings in one datagram
+
+        :param list readings: (station_id, sequence, timestamp, temperature, rain) tuples
+        :rtype: None"""
+        flags = telemetry.RELIABLE if self._outbox is not None else 0
+        self._socket.sendto(telemetry.encode(readings, flags, self._session), self._server_address)
+        self._highest_sent = max(self._highest_sent, readings[-1][1])
+        if self._unacked_since is None:
+            self._unacked_since = monotonic()
+
+    def _resend(self, readings, force=False):
+        """Sends unacked readings again, skipping those sent again within RETRANSMIT_AFTER seconds
+
+        :param list readings: Readings from the outbox, in sequence order
+        :param bool force: Send all of them
+        :rtype: None"""
+        now = monotonic()
+        with self._resend_lock:
+            if not force:
+                readings = [r for r in readings
+                            if now - self._resent.get(r[1], -RETRANSMIT_AFTER) >= RETRANSMIT_AFTER]
+            for r in readings:
+                self._resent[r[1]] = now
+            self.retransmitted += sum(r[1] <= self._highest_sent for r in readings)
+            for offset in range(0, len(readings), telemetry.MAX_RECORDS):
+                self._send(readings[offset:offset + telemetry.MAX_RECORDS])
+
+    def _receive_acks(self):
+        """Forgets acked readings and sends missing ones again, until the sender is done
+
+        :rtype: None"""
+        self._socket.settimeout(0.2)
+        while not self._done.is_set():
+            try:
+                station_id, session, expected, missing = telemetry.decode_ack(self._socket.recv(65535))
+            except (timeout, ValueError):  # Nothing yet, or not an ack
+                continue
+            if station_id != self._id or session != self._session:
+                continue
+
+            self._last_ack = monotonic()
+            self._unacked_since = None if expected > self._highest_sent else self._last_ack  # Else still waiting
+            self._outbox.ack(expected)
+            with self._resend_lock:
+                for sequence in [s for s in self._resent if s < expected]:
+                    del self._resent[sequence]
+            if missing.size:
+                self._resend(self._outbox.get(missing.tolist()))
+            self._acked.set()
+        self._outbox.close()
+
     def start(self):
         """Start the station
 
@@ -55,12 +176,14 @@ class Station:
         sleep(self._interval / 2)  # Wait for initial input
 
         threading.Thread(target=self._update).start()  # Start the sender on a new thread
+        if self._outbox is not None:
+            threading.Thread(target=self._receive_acks).start()
 
     def stop(self):
-        """Stops the station
+        """Stops the station, a reliable one waits up to LINGER seconds for its last acks
 
         :rtype: None"""
         self._shut_down.set()
 
 
-__all__ = ['Station']  # Overwrites from station import *
+__all__ = ['Station', 'FleetSimulator', 'Replay']  # Overwrites from station import *
@@ -0,0 +1,146 @@
+import pickle
+from socket import socket, AF_INET, SOCK_DGRAM, SOCK_STREAM
+import threading
+from time import time
+
+import numpy as np
+
+from protocol import telemetry
+from station.station import StationSimulator
+
+BURST = 16  # Datagrams sent back to back before pausing, a tick's datagrams are spread over the interval
+
+
+class FleetSimulator:
+    """Simulates many weather stations at once, for load testing.
+
+    Every station follows the model of StationSimulator, but the state of all
+    stations is kept in arrays and stepped in one vectorized call per
+    interval. Readings are sent from a single thread and socket, packed into
+    as few datagrams as possible, after one handshake with the server.
+
+    Parameters
+    ----------
+    server_addr
+        Address of the server.
+    stations
+        Number of stations.
+    interval
+        Seconds between readings, every station reads once per interval.
+        Every reading is one simulated hour, like StationSimulator.
+    first_id
+        Id of the first station, the others follow.
+    start_hour
+        Hour to start the simulation on, an int for all stations or an array
+        with one per station.
+    seed
+        Seed of the random generator, None for a random one.
+    simulator
+        Keyword arguments for the climate, see StationSimulator."""
+
+    def __init__(self, server_addr, stations=1000, interval=1, first_id=0, start_hour=0, seed=None, **simulator):
+        self._server_address = server_addr
+        self._interval = interval
+        self._rng = np.random.default_rng(seed)
+
+        # Climate parameters, computed the same way as for one station
+        model = StationSimulator(**simulator)
+        self._avg_temp = model._avg_temp
+        self._temp_interval = model._temp_interval
+        self._prob_rainy_day = model._prob_rainy_day
+        self._avg_precipitation_rainy_day = model._avg_precipitation_rainy_day
+
+        # State of every station
+        self._ids = np.arange(first_id, first_id + stations, dtype=np.uint32)
+        self._hour = np.zeros(stations, np.int64) + start_hour
+        self._is_rainy_day = np.zeros(stations, bool)
+        self._temperature = np.zeros(stations)
+        self._rain = np.zeros(stations)
+
+        self._records = np.zeros(stations, telemetry.RECORD)  # Reused for every tick
+        self._records['station_id'] = self._ids
+
+        self._socket = socket(AF_INET, SOCK_DGRAM)
+        self._shut_down = threading.Event()
+        self._thread = None
+
+        self.readings = 0  # Sent so far
+        self.datagrams = 0
+
+    def _simulate(self):
+        """Steps every station one hour: new readings, then the next hour, and a new rainy-day draw at midnight."""
+        n = len(self._ids)
+        self._temperature = (self._avg_temp + self._temp_interval *
+                             np.sin(np.pi * self._hour / 12 - np.pi / 2) + self._rng.normal(size=n))
+        self._rain = np.where(self._is_rainy_day,
+                              np.maximum(self._rng.normal(self._avg_precipitation_rainy_day, size=n), 0), 0)
+
+        self._hour = (self._hour + 1) % 24
+        midnight = self._hour == 0
+        self._is_rainy_day[midnight] = self._rng.binomial(1, self._prob_rainy_day, midnight.sum())
+
+    def _send(self, sequence, start):
+        """Sends the current reading of every station, spread over the interval
+
+        Parameters
+        ----------
+        sequence
+            Sequence number of the readings.
+        start
+            Unix time the interval started."""
+        records = self._records
+        records['sequence'] = sequence
+        records['timestamp'] = time()
+        records['temperature'] = self._temperature.round(2)
+        records['rain'] = self._rain.round(2)
+
+        chunks = range(0, len(records), telemetry.MAX_RECORDS)
+        bursts = -(-len(chunks) // BURST)
+        for i, offset in enumerate(chunks):
+            if i and not i % BURST:  # Next burst's share of the interval
+                if self._shut_down.wait(max(0.0, start + self._interval * (i // BURST) / bursts - time())):
+                    return
+            self._socket.sendto(telemetry.encode(records[offset:offset + telemetry.MAX_RECORDS]),
+                                self._server_address)
+            self.datagrams += 1
+            self.readings += len(records[offset:offset + telemetry.MAX_RECORDS])
+
+    def _update(self):
+        """Simulates and sends every interval until stopped."""
+        sequence = 0
+        start = time()
+        while not self._shut_down.is_set():
+            self._simulate()
+            self._send(sequence, start)
+            sequence += 1
+            start += self._interval
+            if self._shut_down.wait(max(0.0, start - time())):
+                break
+
+    def start(self):
+        """Asks the server where to send readings, and starts sending."""
+        with socket(AF_INET, SOCK_STREAM) as sock:  # One handshake for the whole fleet
+            sock.connect(self._server_address)
+            sock.send(b'take')
+            address = pickle.loads(sock.recv(1024))
+        self._server_address = address[0], address[1]
+
+        self._thread = threading.Thread(target=self._update)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sending, and waits for the last datagram."""
+        self._shut_down.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._socket.close()
+
+    @property
+    def temperature(self):
+        """Current temperature of every station."""
+        return self._temperature.round(2)
+
+    @property
+    def rain(self):
+        """Current rain of every station."""
+        return self._rain.round(2)
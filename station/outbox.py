@@ -0,0 +1,110 @@
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+
+
+class Outbox:
+    def __init__(self, capacity=4096, path=None):
+        """Readings a station sent but the server didn't ack yet, oldest first
+
+        Kept in memory, or in an SQLite file at path so they survive a restart of the station. When capacity readings
+        are waiting, the oldest is dropped for every new one.
+
+        :param int capacity: Max readings kept
+        :param str path: File to keep the readings in, None to keep them in memory
+        :rtype: None"""
+        self._capacity = max(1, capacity)
+        self._lock = Lock()
+        self._memory = None
+        self._conn = None
+        self.dropped = 0  # Readings pushed out before they were acked
+        self.next_sequence = 0  # Sequence of the next reading, continues where the file left off
+
+        if path is None:
+            self._memory = OrderedDict()  # sequence -> reading
+            return
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS outbox (sequence INTEGER PRIMARY KEY, station_id INTEGER, "
+                           "timestamp FLOAT, temperature FLOAT, rain FLOAT);")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS next_sequence (sequence INTEGER);")
+        row = self._conn.execute("SELECT MAX(sequence) FROM next_sequence;").fetchone()
+        self.next_sequence = row[0] or 0
+        self._conn.commit()
+
+    def put(self, reading):
+        """Keeps a reading until it is acked
+
+        :param tuple reading: (station_id, sequence, timestamp, temperature, rain), the sequence one past the last
+        :rtype: None"""
+        with self._lock:
+            self.next_sequence = reading[1] + 1
+            if self._memory is not None:
+                self._memory[reading[1]] = reading
+                if len(self._memory) > self._capacity:
+                    self._memory.popitem(last=False)
+                    self.dropped += 1
+                return
+
+            self._conn.execute("INSERT OR REPLACE INTO outbox VALUES (?, ?, ?, ?, ?);", (reading[1],) + reading[:1] +
+                               reading[2:])
+            self._conn.execute("DELETE FROM next_sequence;")
+            self._conn.execute("INSERT INTO next_sequence VALUES (?);", (self.next_sequence,))
+            over = self._conn.execute("SELECT COUNT(*) FROM outbox;").fetchone()[0] - self._capacity
+            if over > 0:
+                self._conn.execute("DELETE FROM outbox WHERE sequence IN "
+                                   "(SELECT sequence FROM outbox ORDER BY sequence LIMIT ?);", (over,))
+                self.dropped += over
+            self._conn.commit()
+
+    def ack(self, expected):
+        """Forgets every reading before a sequence
+
+        :param int expected: Sequence the server expects next
+        :rtype: None"""
+        with self._lock:
+            if self._memory is not None:
+                while self._memory and next(iter(self._memory)) < expected:
+                    self._memory.popitem(last=False)
+                return
+            self._conn.execute("DELETE FROM outbox WHERE sequence < ?;", (expected,))
+            self._conn.commit()
+
+    def get(self, sequences):
+        """Readings with these sequences that are still kept
+
+        :param sequences: Iterable of sequences
+        :return: Readings, in the order given
+        :rtype: list"""
+        with self._lock:
+            if self._memory is not None:
+                return [self._memory[s] for s in sequences if s in self._memory]
+            readings = []
+            for s in sequences:
+                row = self._conn.execute("SELECT station_id, sequence, timestamp, temperature, rain FROM outbox "
+                                         "WHERE sequence = ?;", (int(s),)).fetchone()
+                if row is not None:
+                    readings.append(row)
+            return readings
+
+    def oldest(self, limit):
+        """The oldest readings kept
+
+        :param int limit: Max readings
+        :rtype: list"""
+        with self._lock:
+            if self._memory is not None:
+                return [reading for _, reading in zip(range(limit), self._memory.values())]
+            return self._conn.execute("SELECT station_id, sequence, timestamp, temperature, rain FROM outbox "
+                                      "ORDER BY sequence LIMIT ?;", (limit,)).fetchall()
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            if self._memory is not None:
+                return len(self._memory)
+            return self._conn.execute("SELECT COUNT(*) FROM outbox;").fetchone()[0]
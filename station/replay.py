@@ -0,0 +1,139 @@
+import pickle
+from socket import socket, AF_INET, SOCK_DGRAM, SOCK_STREAM
+from time import perf_counter, sleep
+
+import numpy as np
+
+from protocol import telemetry
+from station.station import StationSimulator
+
+
+class Replay:
+    """Deterministic synthetic readings of many stations, made as fast as
+    the CPU allows instead of in real time.
+
+    Every station is a StationSimulator with a random generator seeded from
+    the seed and its id, so a station's series doesn't depend on which other
+    stations are replayed with it. Each reading is one simulated hour, and is
+    timestamped step seconds after the one before.
+
+    Parameters
+    ----------
+    stations
+        Number of stations.
+    hours
+        Readings per station.
+    seed
+        Seed of the series, the same seed gives the same readings.
+    first_id
+        Id of the first station, the others follow.
+    start_hour
+        Hour of the first reading.
+    start_time
+        Unix time of the first reading.
+    step
+        Seconds between the timestamps of a station's readings.
+    simulator
+        Keyword arguments for the climate, see StationSimulator."""
+
+    def __init__(self, stations=100, hours=24 * 30, seed=0, first_id=0, start_hour=0, start_time=1600000000,
+                 step=3600, **simulator):
+        self._ids = np.arange(first_id, first_id + stations, dtype=np.uint32)
+        self._hours = hours
+        self._seed = seed
+        self._start_hour = start_hour
+        self._start_time = start_time
+        self._step = step
+        self._simulator = simulator
+
+    def __len__(self):
+        return len(self._ids) * self._hours
+
+    def records(self, chunk_hours=24):
+        """Makes the readings, chunk_hours of every station at a time, in time order.
+
+        Parameters
+        ----------
+        chunk_hours
+            Hours per chunk, bounds memory for long series.
+
+        Returns
+        -------
+        iterator
+            Structured arrays with dtype telemetry.RECORD."""
+        stations = []
+        for station_id in self._ids.tolist():
+            station = StationSimulator(seed=[self._seed, station_id], **self._simulator)
+            station._hour = self._start_hour
+            stations.append(station)
+
+        for first in range(0, self._hours, chunk_hours):
+            hours = min(chunk_hours, self._hours - first)
+            readings = [station.replay(hours) for station in stations]
+            temperature = np.array([t for t, _ in readings]).T  # (hours, stations), one row per hour
+            rain = np.array([r for _, r in readings]).T
+
+            records = np.zeros(temperature.shape, telemetry.RECORD)
+            records['station_id'] = self._ids
+            records['sequence'] = np.arange(first, first + hours)[:, None]
+            records['timestamp'] = self._start_time + self._step * records['sequence']
+            records['temperature'] = temperature
+            records['rain'] = rain
+            yield records.ravel()
+
+    def load(self, database, chunk_hours=24):
+        """Writes every reading straight into a database, without the network.
+
+        Parameters
+        ----------
+        database
+            server.database.Database to write to.
+        chunk_hours
+            Hours per chunk.
+
+        Returns
+        -------
+        int
+            Readings written."""
+        rows = 0
+        for records in self.records(chunk_hours):
+            database.write_records(records)
+            rows += len(records)
+        database.flush()
+        return rows
+
+    def stream(self, server_addr, rate=None, chunk_hours=24):
+        """Sends every reading to a server, in full datagrams after one handshake.
+
+        Parameters
+        ----------
+        server_addr
+            Address of the server.
+        rate
+            Readings per second to send at most, None for as fast as possible.
+        chunk_hours
+            Hours per chunk.
+
+        Returns
+        -------
+        int
+            Readings sent."""
+        with socket(AF_INET, SOCK_STREAM) as sock:
+            sock.connect(server_addr)
+            sock.send(b'take')
+            address = pickle.loads(sock.recv(1024))
+        address = address[0], address[1]
+
+        sent = 0
+        start = perf_counter()
+        with socket(AF_INET, SOCK_DGRAM) as udp:
+            for records in self.records(chunk_hours):
+                for offset in range(0, len(records), telemetry.MAX_RECORDS):
+                    datagram = records[offset:offset + telemetry.MAX_RECORDS]
+                    if rate is not None:  # Ahead of schedule, wait
+                        ahead = start + sent / rate - perf_counter()
+                        if ahead > 0:
+                            sleep(ahead)
+                    udp.sendto(telemetry.encode(datagram), address)
+                    sent += len(datagram)
+        return sent
@@ -1,7 +1,6 @@
 from threading import Event, Lock, Thread
 
 import numpy as np
-from numpy.random import binomial, normal
 
 
 class StationSimulator:
@@ -31,7 +30,10 @@ class StationSimulator:
         Average precipitation days
     simulation_interval
         Elapsed time between simulations in seconds.
-        Default value is 3600 (1h)."""
+        Default value is 3600 (1h).
+    seed
+        Seed of the station's random generator, None for a random one.
+        The same seed gives the same readings."""
 
     _days_of_month = {
         "January": 31,
@@ -55,7 +57,8 @@ class StationSimulator:
                  avg_low_temp: int = 7,
                  avg_precipitation: int = 105,
                  avg_precipitation_days: int = 12,
-                 simulation_interval: int = 3600) -> None:
+                 simulation_interval: int = 3600,
+                 seed=None) -> None:
 
         self._location = location
         self._month = month
@@ -71,6 +74,13 @@ class StationSimulator:
             (12 * avg_precipitation_days)
 
         self._simulation_interval = simulation_interval
+        # Temperature noise, rain and rainy days each draw from a generator of their own, so replay gives the
+        # same readings however it is split up
+        self._rng, self._rain_rng, self._day_rng = (np.random.default_rng(s)
+                                                    for s in np.random.SeedSequence(seed).spawn(3))
+
+        self._is_rainy_day = 0
+        self._hour = 0
 
         # Internal reading of the sensors. It is assumed that the sensors
         # need at least one hour to provide accurate measures.
@@ -83,8 +93,8 @@ class StationSimulator:
     def _simulate(self):
 
         temperature = (self._avg_temp + self._temp_interval *
-                       np.sin(np.pi * self._hour / 12 - np.pi / 2) + normal())
-        rain = max(normal(self._avg_precipitation_rainy_day),
+                       np.sin(np.pi * self._hour / 12 - np.pi / 2) + self._rng.normal())
+        rain = max(self._rain_rng.normal(self._avg_precipitation_rainy_day),
                    0) if self._is_rainy_day else 0
 
         with self._lock:
@@ -96,7 +106,45 @@ class StationSimulator:
             self._simulate()
             self._hour = (self._hour + 1) % 24
             if not self._hour:
-                self._is_rainy_day = binomial(1, self._prob_rainy_day)
+                self._is_rainy_day = self._day_rng.binomial(1, self._prob_rainy_day)
+
+    def replay(self, hours: int):
+        """Simulates the next hours at once, without waiting between them.
+
+        Continues from the current hour and rainy-day flag, and leaves the
+        simulation where the series ends, so long series can be made in parts.
+        A series made in parts is the same as one made at once.
+
+        Parameter
+        ---------
+        hours
+            Number of hours to simulate.
+
+        Returns
+        -------
+        tuple
+            Temperature and rain of every hour, as arrays."""
+        if hours <= 0:
+            return np.zeros(0), np.zeros(0)
+        hour = self._hour + np.arange(hours)  # Hour of each reading, before wrapping at midnight
+        temperature = (self._avg_temp + self._temp_interval *
+                       np.sin(np.pi * (hour % 24) / 12 - np.pi / 2) + self._rng.normal(size=hours))
+
+        # A new day is drawn after each reading at 23, and holds from the next reading on
+        midnight = (hour + 1) % 24 == 0
+        draws = self._day_rng.binomial(1, self._prob_rainy_day, int(midnight.sum()))
+        days = np.concatenate(([0], np.cumsum(midnight)[:-1]))
+        is_rainy_day = np.concatenate(([self._is_rainy_day], draws))[days].astype(bool)
+        rain = np.where(is_rainy_day,
+                        np.maximum(self._rain_rng.normal(self._avg_precipitation_rainy_day, size=hours), 0), 0)
+
+        self._hour = int(self._hour + hours) % 24
+        if len(draws):
+            self._is_rainy_day = draws[-1]
+        with self._lock:
+            self._temperature = temperature[-1]
+            self._rain = rain[-1]
+        return temperature.round(2), rain.round(2)
 
     def turn_on(self, starting_hour: int = 0):
         """Starts the simulation.
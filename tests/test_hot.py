@@ -0,0 +1,57 @@
+import numpy as np
+
+from server.database import Database
+from server.hot import HotTier
+
+
+def _append(tier, index, station, timestamp=None):
+    index = np.asarray(index, np.int64)
+    timestamp = index.astype(np.float64) if timestamp is None else np.asarray(timestamp, np.float64)
+    tier.append(index, np.asarray(station, np.int64), index * 1.0, index * 0.1, timestamp)
+
+
+def test_append_more_than_capacity_in_one_batch():
+    tier = HotTier(capacity=4, stations=4)
+    _append(tier, range(1, 7), [0] * 6)
+
+    assert tier.bounds[0] == 3
+    assert tier.read_index(3)[0]['data_index'].tolist() == [3, 4, 5, 6]
+    assert tier.read_index(5)[0]['data_index'].tolist() == [5, 6]
+    assert tier.read_index(2) is None
+
+    _append(tier, [7, 8], [0, 0])  # Ring keeps its order after the oversized batch
+    assert tier.read_index(5)[0]['data_index'].tolist() == [5, 6, 7, 8]
+
+
+def test_append_interleaved_stations_past_capacity():
+    tier = HotTier(capacity=3, stations=4)
+    _append(tier, [1, 2], [0, 1])
+    _append(tier, range(3, 13), [0, 1] * 5)
+
+    stations = tier.read_index(tier.bounds[0])
+    assert stations[0]['data_index'].tolist() == [7, 9, 11]
+    assert stations[1]['data_index'].tolist() == [8, 10, 12]
+
+
+def test_read_range_falls_back_on_duplicate_timestamps_at_the_bound():
+    tier = HotTier(capacity=2, stations=4)
+    _append(tier, [1, 2, 3, 4], [0] * 4, [100, 200, 200, 300])
+
+    assert tier.read_range(200) is None  # Reading 2 was measured at 200 too, and pushed out
+    assert tier.read_range(201)[0]['data_index'].tolist() == [4]
+
+
+def test_database_matches_sqlite():
+    hot, cold = Database(':memory:', hot_capacity=4), Database(':memory:')
+    rows = [(0, float(i), 0.0, ts) for i, ts in enumerate([100, 200, 200, 300, 300, 300, 400], 1)]
+    for db in (hot, cold):
+        db.write_many(rows)
+        db.flush()
+
+    for idx_from in range(1, 8):
+        assert hot.read_columns(idx_from)[0]['data_index'].tolist() == \
+            cold.read_columns(idx_from)[0]['data_index'].tolist()
+    for ts_from in (100, 200, 300, 301, 400):
+        assert hot.read_range(ts_from)[0]['data_index'].tolist() == cold.read_range(ts_from)[0]['data_index'].tolist()
+    hot.close()
+    cold.close()
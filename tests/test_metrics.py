@@ -0,0 +1,23 @@
+import threading
+
+from server.metrics import Counter, Histogram
+
+
+def test_updates_from_many_threads_are_all_counted():
+    counter, histogram = Counter(), Histogram(buckets=(1, 10))
+
+    def update():
+        for i in range(20000):
+            counter.inc()
+            histogram.observe(i % 20)
+
+    threads = [threading.Thread(target=update) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value == 160000
+    assert histogram.count == 160000
+    assert histogram.counts == [16000, 72000, 72000]
+    assert histogram.samples('h', ())[-1] == 'h_count 160000'
@@ -0,0 +1,85 @@
+import os
+from time import time
+
+import numpy as np
+
+from server.database import Database
+
+DAY = 86400
+
+
+def _rows(indexes, base=1000):
+    return [(i % 3, float(i), i * 0.1, base + i) for i in indexes]
+
+
+def _lists(stations):
+    return {station_id: {name: values.tolist() for name, values in columns.items()}
+            for station_id, columns in stations.items()}
+
+
+def _chunks(db, **kwargs):
+    stations = dict()
+    for chunk in db.read_chunks(size=7, **kwargs):
+        for station_id, columns in chunk.items():
+            stations.setdefault(station_id, []).append(columns)
+    return {station_id: {name: np.concatenate([c[name] for c in chunks]).tolist() for name in chunks[0]}
+            for station_id, chunks in stations.items()}
+
+
+def _files(db):
+    return sorted(os.listdir(db._directory)) if os.path.isdir(db._directory) else []
+
+
+def test_reads_are_the_same_after_sealing(tmp_path):
+    db = Database(str(tmp_path / 'db'))
+    db.write_many(_rows(range(60)))
+    db.flush()
+    before = (_lists(db.read_range()), _lists(db.read_range(1020, 1040, station_id=1)), _lists(db.read_columns(25)),
+              _chunks(db), _chunks(db, idx_from=10, idx_to=50, station_id=2))
+
+    db.maintain(time() + DAY)
+    assert _files(db) == ['raw-1.db']
+    db.write_many(_rows(range(60, 90)))  # Reads now span the partition and station_data
+    db.flush()
+
+    after = (_lists(db.read_range(0, 1059)), _lists(db.read_range(1020, 1040, station_id=1)),
+             _lists(db.read_columns(25, 60)), _chunks(db, idx_to=60),
+             _chunks(db, idx_from=10, idx_to=50, station_id=2))
+    assert after == before
+    assert _chunks(db, idx_from=55, idx_to=65)[1]['data_index'] == [56, 59, 62, 65]
+    db.close()
+
+
+def test_expired_partitions_are_coarsened_then_dropped(tmp_path):
+    db = Database(str(tmp_path / 'db'), retention=DAY, coarse_resolution=20, coarse_retention=2 * DAY)
+    base = int(time()) // 20 * 20
+    db.write_many(_rows(range(60), base))  # Measured over the next minute
+    db.flush()
+    db.maintain(base + 1.5 * DAY)  # Seals, then the partition is past retention
+
+    assert _files(db) == ['20s-1.db']
+    stations = db.read_range()
+    assert stations[0]['timestamp'].tolist() == [base, base + 20, base + 40]
+    assert stations[0]['temperature'].tolist() == [np.mean(range(0, 20, 3)), np.mean(range(21, 40, 3)),
+                                                   np.mean(range(42, 60, 3))]
+
+    db.maintain(base + 3 * DAY)  # Past coarse_retention
+    assert _files(db) == []
+    assert db.read_range() == {}
+    db.close()
+
+
+def test_clear_removes_partition_files(tmp_path):
+    db = Database(str(tmp_path / 'db'))
+    db.write_many(_rows(range(30)))
+    db.flush()
+    db.maintain(time() + DAY)
+    db.write_many(_rows(range(30, 40)))
+    db.flush()
+    assert _files(db) == ['raw-1.db']
+
+    db.clear()
+    assert _files(db) == []
+    assert db.read_range() == {}
+    assert _chunks(db) == {}
+    db.close()
@@ -0,0 +1,167 @@
+import pickle
+import threading
+from socket import socket, timeout, AF_INET, SOCK_DGRAM, SOCK_STREAM
+from time import monotonic, sleep
+
+import numpy as np
+
+import station
+from protocol import telemetry
+from server.sequence import SequenceTracker
+from station.outbox import Outbox
+
+
+def _records(station_id, sequences):
+    return np.array([(station_id, s, 0.0, 0.0, 0.0) for s in sequences], telemetry.RECORD)
+
+
+def _ack(acks):
+    station_id, session, expected, missing = telemetry.decode_ack(acks[-1])
+    return expected, missing.tolist()
+
+
+def test_tracker_acks_gaps_until_they_arrive():
+    tracker = SequenceTracker()
+    records, acks = tracker.track(_records(1, [0, 1, 3, 5]), telemetry.RELIABLE, 7)
+    assert records['sequence'].tolist() == [0, 1, 3, 5]
+    assert _ack(acks) == (2, [2, 4])
+
+    records, acks = tracker.track(_records(1, [4]), telemetry.RELIABLE, 7)  # Out of order
+    assert records['sequence'].tolist() == [4]
+    assert _ack(acks) == (2, [2])
+
+    _, acks = tracker.track(_records(1, [2]), telemetry.RELIABLE, 7)
+    assert _ack(acks) == (6, [])
+
+
+def test_tracker_drops_repeats_of_reliable_stations():
+    tracker = SequenceTracker()
+    tracker.track(_records(1, [0, 1, 2]), telemetry.RELIABLE, 7)
+    records, acks = tracker.track(_records(1, [1, 3]), telemetry.RELIABLE, 7)
+    assert records['sequence'].tolist() == [3]
+    assert _ack(acks) == (4, [])
+
+    records, _ = tracker.track(_records(2, [0, 1, 1]))  # Not reliable, only counted
+    assert records['sequence'].tolist() == [0, 1, 1]
+
+
+def test_tracker_starts_over_on_a_new_session():
+    tracker = SequenceTracker()
+    tracker.track(_records(1, [10, 11]), telemetry.RELIABLE, 7)
+    _, acks = tracker.track(_records(1, [0]), telemetry.RELIABLE, 8)
+    assert _ack(acks) == (1, [])
+
+
+def test_tracker_asks_again_for_readings_that_were_not_stored():
+    tracker = SequenceTracker()
+    records, _ = tracker.track(_records(1, [0, 1, 2, 3]), telemetry.RELIABLE, 7)
+    tracker.forget(records[2:3])
+
+    _, acks = tracker.track(_records(1, [4]), telemetry.RELIABLE, 7)
+    assert _ack(acks) == (2, [2])
+    records, acks = tracker.track(_records(1, [2]), telemetry.RELIABLE, 7)
+    assert records['sequence'].tolist() == [2]
+    assert _ack(acks) == (5, [])
+
+
+def test_outbox_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'outbox')
+    outbox = Outbox(path=path)
+    for sequence in range(5):
+        outbox.put((3, sequence, float(sequence), 20.0, 0.5))
+    outbox.ack(3)
+    outbox.close()
+
+    outbox = Outbox(path=path)
+    assert outbox.next_sequence == 5
+    assert len(outbox) == 2
+    assert [r[1] for r in outbox.oldest(10)] == [3, 4]
+    assert [r[1] for r in outbox.get([4, 9])] == [4]
+    outbox.close()
+
+
+def test_outbox_drops_the_oldest_beyond_capacity(tmp_path):
+    for path in (None, str(tmp_path / 'outbox')):
+        outbox = Outbox(capacity=3, path=path)
+        for sequence in range(5):
+            outbox.put((3, sequence, 0.0, 0.0, 0.0))
+        assert [r[1] for r in outbox.oldest(10)] == [2, 3, 4]
+        assert outbox.dropped == 2
+        outbox.close()
+
+
+class _Uplink:
+    def __init__(self, drop=()):
+        """Stands in for a server: answers the station's handshake, tracks its readings and acks them
+
+        :param drop: Sequences dropped the first time they arrive"""
+        self.udp = socket(AF_INET, SOCK_DGRAM)
+        self.udp.bind(('localhost', 0))
+        self.udp.settimeout(0.05)
+        self.tcp = socket(AF_INET, SOCK_STREAM)
+        self.tcp.bind(('localhost', 0))
+        self.tcp.listen()
+        self.address = self.tcp.getsockname()
+
+        self.datagrams = []  # Readings per datagram
+        self.stored = set()
+        self._drop = set(drop)
+        self._tracker = SequenceTracker()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def _run(self):
+        conn, _ = self.tcp.accept()
+        conn.recv(4)  # b'take'
+        conn.send(pickle.dumps(self.udp.getsockname()))
+        conn.close()
+        while not self._stop.is_set():
+            try:
+                data, sender = self.udp.recvfrom(65535)
+            except timeout:
+                continue
+            records = telemetry.decode(data)
+            self.datagrams.append(len(records))
+            dropped = np.isin(records['sequence'], list(self._drop))
+            self._drop.difference_update(records['sequence'][dropped].tolist())
+            records, acks = self._tracker.track(records[~dropped], *telemetry.options(data))
+            self.stored.update(records['sequence'].tolist())
+            for ack in acks:
+                self.udp.sendto(ack, sender)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.udp.close()
+        self.tcp.close()
+
+
+def _run_station(uplink, readings, **kwargs):
+    s = station.Station(uplink.address, reliable=True, **kwargs)
+    s.start()
+    deadline = monotonic() + 10
+    while len(uplink.stored) < readings and monotonic() < deadline:
+        sleep(0.02)
+    s.stop()
+    s._done.wait(station.LINGER + 1)
+    uplink.stop()
+    return s
+
+
+def test_lost_readings_are_sent_again():
+    uplink = _Uplink(drop=[2, 3, 7])
+    s = _run_station(uplink, 10, interval=0.02)
+
+    assert set(range(10)) <= uplink.stored
+    assert s.retransmitted >= 3
+
+
+def test_batches_when_the_interval_is_longer_than_retransmit_after(monkeypatch):
+    monkeypatch.setattr(station, 'RETRANSMIT_AFTER', 0.1)
+    uplink = _Uplink()
+    _run_station(uplink, 7, interval=0.2, batch=2)
+
+    # The first reading opens the session on its own, every later datagram carries a full batch
+    assert uplink.datagrams[0] == 1
+    assert set(uplink.datagrams[1:4]) == {2}